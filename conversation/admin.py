@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Conversation, ConversationMessage
+from .models import Conversation, ConversationMessage, InboxEntry
 
 admin.site.register(Conversation)
 admin.site.register(ConversationMessage)
+admin.site.register(InboxEntry)
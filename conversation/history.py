@@ -0,0 +1,35 @@
+"""Conversation history, newest page first.
+
+A conversation page shows its latest `MESSAGES_PER_PAGE` messages; older
+ones are loaded a page at a time as the reader scrolls up. Pages are cut
+with a keyset on (created_at, id) like the catalog (item/pagination.py),
+so every page is one query on the `message_history_idx`
+index, with the authors joined in.
+"""
+from django.db.models import Q
+
+from item.pagination import decode_cursor, encode_cursor
+
+
+MESSAGES_PER_PAGE = 30
+
+
+def history_page(conversation, cursor=None, per_page=MESSAGES_PER_PAGE):
+    """The messages just before `cursor` (or the latest), oldest first, and the cursor of the page before them (or None)."""
+    messages = (
+        conversation.messages.select_related('created_by')
+        .order_by('-created_at', '-id')
+    )
+    position = decode_cursor(cursor)
+    if position is not None and position[0] == 'key':
+        created_at, pk = position[1]
+        messages = messages.filter(Q(created_at__lte=created_at), Q(created_at__lt=created_at) | Q(id__lt=pk))
+
+    # one extra row tells whether there are older messages
+    page = list(messages[:per_page + 1])
+    older = None
+    if len(page) > per_page:
+        page = page[:per_page]
+        older = encode_cursor(page[-1])
+    page.reverse()
+    return page, older
@@ -0,0 +1,75 @@
+"""Per-user inbox rows, maintained as messages are sent.
+
+Each member of a conversation has an `InboxEntry` holding what the inbox
+shows: the item's name and thumbnail, the other member's username, a
+snippet of the last message, when it was sent and how many messages the
+member has not read. Sending a message updates the conversation's rows
+with one UPDATE (creating them on the first message), so the inbox page
+is one indexed query instead of loading every conversation's item and
+members. Item changes are copied in from conversation/signals.py, the
+thumbnail again once the image's resized copies are made.
+"""
+from django.db.models import Case, F, When
+from django.utils.text import Truncator
+
+from item.images import thumbnail_url
+from item.models import Item
+
+from .models import InboxEntry
+
+
+SNIPPET_LENGTH = 100
+
+
+def snippet(content):
+    return Truncator(' '.join(content.split())).chars(SNIPPET_LENGTH)
+
+
+def record_message(message):
+    """Show `message` as the last one in its conversation's inbox rows; unread for everyone but its author."""
+    conversation = message.conversation
+    updated = InboxEntry.objects.filter(conversation=conversation).update(
+        last_message=snippet(message.content),
+        last_message_at=message.created_at,
+        unread_count=Case(When(user_id=message.created_by_id, then=F('unread_count')), default=F('unread_count') + 1),
+    )
+    members = list(conversation.members.all())
+    if updated < len(members):
+        create_entries(conversation, members, message)
+
+
+def create_entries(conversation, members, message):
+    item = conversation.item
+    thumbnail = thumbnail_url(item.image, item.image_variants)
+    InboxEntry.objects.bulk_create([
+        InboxEntry(
+            user=member,
+            conversation=conversation,
+            item_name=item.name,
+            item_thumbnail=thumbnail,
+            counterpart=next((other.username for other in members if other.pk != member.pk), ''),
+            last_message=snippet(message.content),
+            last_message_at=message.created_at,
+            unread_count=0 if member.pk == message.created_by_id else 1,
+        )
+        for member in members
+    ], ignore_conflicts=True)
+
+
+def refresh_item(item):
+    """Copy an item's current name and thumbnail into the inbox rows of its conversations."""
+    InboxEntry.objects.filter(conversation__item=item).update(
+        item_name=item.name,
+        item_thumbnail=thumbnail_url(item.image, item.image_variants),
+    )
+
+
+def refresh_thumbnails(item_ids):
+    """Point the inbox rows of these items at their current thumbnails."""
+    items = Item.objects.filter(pk__in=item_ids, conversations__isnull=False).distinct().only('image', 'image_variants')
+    for item in items:
+        InboxEntry.objects.filter(conversation__item=item).update(item_thumbnail=thumbnail_url(item.image, item.image_variants))
+
+
+def mark_read(user, conversation):
+    InboxEntry.objects.filter(user=user, conversation=conversation, unread_count__gt=0).update(unread_count=0)
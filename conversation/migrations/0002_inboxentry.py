@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:58
+
+import posixpath
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+# copies of conversation.inbox.snippet and item.images.thumbnail_url as they
+# were when this migration was written, so later changes to them do not change it
+def snippet(content):
+    return Truncator(' '.join(content.split())).chars(100)
+
+
+def thumbnail_url(image, variants):
+    if not image:
+        return ''
+    if variants and variants.get('name') == image.name and variants['widths']:
+        directory, base = posixpath.split(posixpath.splitext(image.name.replace('\\', '/'))[0])
+        return image.storage.url(posixpath.join(directory, 'derivatives', f'{base}-{variants["widths"][0]}w.jpg'))
+    return image.url
+
+
+def fill_inboxes(apps, schema_editor):
+    Conversation = apps.get_model('conversation', 'Conversation')
+    ConversationMessage = apps.get_model('conversation', 'ConversationMessage')
+    InboxEntry = apps.get_model('conversation', 'InboxEntry')
+
+    last_messages = {}
+    for message in ConversationMessage.objects.order_by('created_at', 'id').iterator():
+        last_messages[message.conversation_id] = message
+    entries = []
+    for conversation in Conversation.objects.select_related('item').prefetch_related('members'):
+        members = list(conversation.members.all())
+        message = last_messages.get(conversation.pk)
+        for member in members:
+            entries.append(InboxEntry(
+                user=member,
+                conversation=conversation,
+                item_name=conversation.item.name,
+                item_thumbnail=thumbnail_url(conversation.item.image, conversation.item.image_variants),
+                counterpart=next((other.username for other in members if other.pk != member.pk), ''),
+                last_message=snippet(message.content) if message else '',
+                last_message_at=message.created_at if message else conversation.modified_at,
+            ))
+    InboxEntry.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversation', '0001_initial'),
+        ('item', '0009_item_category_recent_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_name', models.CharField(max_length=255)),
+                ('item_thumbnail', models.CharField(blank=True, max_length=500)),
+                ('counterpart', models.CharField(blank=True, max_length=150)),
+                ('last_message', models.CharField(blank=True, max_length=200)),
+                ('last_message_at', models.DateTimeField()),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='conversation.conversation')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-last_message_at', '-id'),
+                'indexes': [models.Index(fields=['user', '-last_message_at', '-id'], name='inbox_entry_user_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'conversation'), name='inbox_entry_unique')],
+            },
+        ),
+        migrations.RunPython(fill_inboxes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversation', '0002_inboxentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversationmessage',
+            index=models.Index(fields=['conversation', 'created_at', 'id'], name='message_history_idx'),
+        ),
+    ]
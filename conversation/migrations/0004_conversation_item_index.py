@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversation', '0003_conversationmessage_history_index'),
+        ('item', '0010_item_access_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['item', '-modified_at'], name='conversation_item_recent_idx'),
+        ),
+    ]
@@ -11,9 +11,40 @@ class Conversation(models.Model):
 
     class Meta:
         ordering = ('-modified_at',)
+        indexes = [
+            # a buyer's conversation about an item (views.new_conversation)
+            models.Index(fields=['item', '-modified_at'], name='conversation_item_recent_idx'),
+        ]
     
 class ConversationMessage(models.Model):
     conversation = models.ForeignKey(Conversation, related_name='messages', on_delete=models.CASCADE)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
-    created_by = models.ForeignKey(User, related_name='created_messages', on_delete=models.CASCADE)
\ No newline at end of file
+    created_by = models.ForeignKey(User, related_name='created_messages', on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+            # history pages, newest first (conversation/history.py)
+            models.Index(fields=['conversation', 'created_at', 'id'], name='message_history_idx'),
+        ]
+
+
+class InboxEntry(models.Model):
+    """One row of a user's inbox, kept up to date as messages are sent (see conversation/inbox.py)."""
+    user = models.ForeignKey(User, related_name='inbox_entries', on_delete=models.CASCADE)
+    conversation = models.ForeignKey(Conversation, related_name='inbox_entries', on_delete=models.CASCADE)
+    item_name = models.CharField(max_length=255)
+    item_thumbnail = models.CharField(max_length=500, blank=True)
+    counterpart = models.CharField(max_length=150, blank=True)
+    last_message = models.CharField(max_length=200, blank=True)
+    last_message_at = models.DateTimeField()
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ('-last_message_at', '-id')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'conversation'], name='inbox_entry_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_message_at', '-id'], name='inbox_entry_user_idx'),
+        ]
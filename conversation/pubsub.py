@@ -0,0 +1,99 @@
+"""Publish/subscribe for pushing new messages to open conversations.
+
+`ConversationMessage` saves are published on the conversation's channel
+once their transaction commits (conversation/signals.py), and the events
+view streams them to every member who has the chat open.
+
+`LocalBroker` delivers within the current process only, which is what a
+single ASGI worker and the tests need. Several worker processes need a
+broker shared between them (e.g. on Redis pub/sub), set with the
+`CONVERSATION_BROKER` setting; it only has to provide `subscribe` and
+`publish` like `LocalBroker`.
+"""
+import asyncio
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def channel_name(conversation_id):
+    return f'conversation:{conversation_id}'
+
+
+def message_payload(message):
+    return {
+        'id': message.pk,
+        'author': message.created_by.username,
+        'author_id': message.created_by_id,
+        'content': message.content,
+        'created_at': message.created_at.isoformat(),
+    }
+
+
+class LocalBroker:
+    """In-process channels: `publish` calls every callback subscribed to the channel."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, channel, callback):
+        """Call `callback(payload)` for everything published on `channel`; returns the unsubscribe function."""
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(callback)
+
+        def unsubscribe():
+            with self._lock:
+                callbacks = self._subscribers.get(channel, set())
+                callbacks.discard(callback)
+                if not callbacks:
+                    self._subscribers.pop(channel, None)
+
+        return unsubscribe
+
+    def publish(self, channel, payload):
+        with self._lock:
+            callbacks = list(self._subscribers.get(channel, ()))
+        for callback in callbacks:
+            callback(payload)
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscribers.get(channel, ()))
+
+
+class Subscription:
+    """A channel subscription read from a coroutine; publishing may happen on any thread."""
+
+    def __init__(self, broker, channel):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.unsubscribe = broker.subscribe(channel, self.deliver)
+
+    def deliver(self, payload):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, payload)
+        except RuntimeError:
+            # the connection's event loop is already gone
+            pass
+
+    async def get(self, timeout):
+        """The next payload, or None after `timeout` seconds without one."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.unsubscribe()
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'CONVERSATION_BROKER', 'conversation.pubsub.LocalBroker'))()
+    return _broker
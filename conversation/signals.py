@@ -0,0 +1,32 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from item.images import variants_saved
+from item.models import Item
+
+from .inbox import record_message, refresh_item, refresh_thumbnails
+from .models import ConversationMessage
+from .pubsub import channel_name, get_broker, message_payload
+
+
+@receiver(post_save, sender=ConversationMessage)
+def message_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        record_message(instance)
+        # pushed to the open chats once the message is really there
+        channel, payload = channel_name(instance.conversation_id), message_payload(instance)
+        transaction.on_commit(lambda: get_broker().publish(channel, payload))
+
+
+@receiver(post_save, sender=Item)
+def item_saved(sender, instance, created, raw=False, **kwargs):
+    # inbox rows carry a copy of the item's name and thumbnail
+    if not created and not raw:
+        refresh_item(instance)
+
+
+@receiver(variants_saved)
+def item_variants_saved(sender, item_ids, **kwargs):
+    # the resized copies are made after the item is saved: show the small one
+    refresh_thumbnails(item_ids)
@@ -1,3 +1,263 @@
+import asyncio
+import shutil
+import tempfile
+import threading
+from io import BytesIO, StringIO
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+
+from PIL import Image
+
+from core.tests import QueryPlanTestCase, ViewBudgetTestCase
+from item.models import Category, Item
+
+from .history import history_page
+from .inbox import SNIPPET_LENGTH, record_message
+from .models import Conversation, ConversationMessage, InboxEntry
+from .pubsub import LocalBroker, Subscription, channel_name, get_broker
+
+
+class ConversationBudgetTests(ViewBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.buyer = User.objects.create_user('buyer')
+        self.client.force_login(self.buyer)
+
+    def start_conversations(self, count, messages=20):
+        items = Item.objects.exclude(conversations__members=self.buyer).select_related('created_by')[:count]
+        for item in items:
+            conversation = Conversation.objects.create(item=item)
+            conversation.members.add(self.buyer, item.created_by)
+            history = ConversationMessage.objects.bulk_create([
+                ConversationMessage(conversation=conversation, content=f'Сообщение {i}', created_by=(self.buyer, item.created_by)[i % 2])
+                for i in range(messages)
+            ])
+            record_message(history[-1])
+        return conversation
+
+    def test_inbox(self):
+        for size in self.catalog_sizes():
+            self.start_conversations(25)
+            with self.subTest(items=size):
+                self.assertGetBudget(reverse('conversation:inbox'), queries=3, ms=100)
+
+    def test_detail(self):
+        for size in self.catalog_sizes():
+            conversation = self.start_conversations(1, messages=100)
+            with self.subTest(items=size):
+                # session, user, conversation, marking it read, messages
+                self.assertGetBudget(reverse('conversation:detail', args=[conversation.pk]), queries=5, ms=100)
+
+    def test_history(self):
+        for size in self.catalog_sizes():
+            conversation = self.start_conversations(1, messages=500)
+            cursor = history_page(conversation)[1]
+            with self.subTest(items=size):
+                # session, user, conversation, messages
+                self.assertGetBudget(reverse('conversation:history', args=[conversation.pk]), {'cursor': cursor}, queries=4, ms=100)
+
+
+class ConversationQueryPlanTests(QueryPlanTestCase):
+
+    def test_views(self):
+        buyer = User.objects.create_user('buyer')
+        item = Item.objects.first()
+        conversation = Conversation.objects.create(item=item)
+        conversation.members.add(buyer, item.created_by)
+        message = ConversationMessage.objects.create(conversation=conversation, content='Здравствуйте', created_by=buyer)
+        record_message(message)
+        self.assertUsesIndex(Conversation.objects.filter(item=item, members=buyer)[:1], 'conversation_item_recent_idx')
+        self.assertUsesIndex(conversation.messages.order_by('-created_at', '-id')[:31], 'message_history_idx')
+
+        self.client.force_login(buyer)
+        self.assertGetNoFullScan(reverse('conversation:new', args=[item.pk]))
+        self.assertGetNoFullScan(reverse('conversation:inbox'))
+        self.assertGetNoFullScan(reverse('conversation:detail', args=[conversation.pk]))
+
+
+class HistoryTests(TestCase):
+
+    def test_pages_walk_back_through_every_message(self):
+        seller = User.objects.create_user('seller')
+        item = Item.objects.create(category=Category.objects.create(name='Диваны'), name='Диван', created_by=seller)
+        conversation = Conversation.objects.create(item=item)
+        messages = ConversationMessage.objects.bulk_create([
+            ConversationMessage(conversation=conversation, content=f'Сообщение {i}', created_by=seller)
+            for i in range(25)
+        ])
+        # messages sent within the same instant are told apart by id
+        ConversationMessage.objects.filter(pk__in=[m.pk for m in messages[5:15]]).update(created_at=messages[5].created_at)
+
+        pages, cursor = [], None
+        while True:
+            page, cursor = history_page(conversation, cursor, per_page=4)
+            pages.insert(0, page)
+            if cursor is None:
+                break
+        self.assertEqual(len(pages[-1]), 4)
+        self.assertEqual([m.pk for page in pages for m in page], [m.pk for m in messages])
+
+
+class InboxTests(TestCase):
+
+    def entry(self, user):
+        return InboxEntry.objects.get(user=user)
+
+    def test_unread_and_last_message(self):
+        seller, buyer = User.objects.create_user('seller'), User.objects.create_user('buyer')
+        item = Item.objects.create(category=Category.objects.create(name='Диваны'), name='Диван', created_by=seller)
+        self.client.force_login(buyer)
+        self.client.post(reverse('conversation:new', args=[item.pk]), {'content': 'Здравствуйте'})
+        conversation = Conversation.objects.get(item=item)
+        self.assertEqual((self.entry(buyer).unread_count, self.entry(seller).unread_count), (0, 1))
+        self.assertEqual((self.entry(buyer).counterpart, self.entry(seller).counterpart), ('seller', 'buyer'))
+        self.assertEqual(self.entry(seller).item_name, 'Диван')
+
+        self.client.post(reverse('conversation:detail', args=[conversation.pk]), {'content': 'Ещё  продаётся?\n' + 'а' * 200})
+        seller_entry = self.entry(seller)
+        self.assertEqual(seller_entry.unread_count, 2)
+        self.assertEqual(len(seller_entry.last_message), SNIPPET_LENGTH)
+        self.assertTrue(seller_entry.last_message.startswith('Ещё продаётся? ааа'))
+        self.assertEqual(seller_entry.last_message_at, conversation.messages.latest('id').created_at)
+
+        # reading the conversation clears the reader's count only
+        self.client.force_login(seller)
+        self.client.get(reverse('conversation:detail', args=[conversation.pk]))
+        self.assertEqual((self.entry(buyer).unread_count, self.entry(seller).unread_count), (0, 0))
+        self.client.post(reverse('conversation:detail', args=[conversation.pk]), {'content': 'Да'})
+        self.assertEqual((self.entry(buyer).unread_count, self.entry(seller).unread_count), (1, 0))
+        self.assertEqual(self.entry(buyer).last_message, 'Да')
+
+        item.name = 'Угловой диван'
+        item.save()
+        self.assertEqual(set(InboxEntry.objects.values_list('item_name', flat=True)), {'Угловой диван'})
+
+    def test_thumbnail_follows_derivatives(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        photo = BytesIO()
+        Image.new('RGB', (700, 400), 'orange').save(photo, 'JPEG')
+        seller, buyer = User.objects.create_user('seller'), User.objects.create_user('buyer')
+        with self.settings(MEDIA_ROOT=media):
+            item = Item.objects.create(
+                category=Category.objects.create(name='Диваны'), name='Диван', created_by=seller,
+                image=SimpleUploadedFile('sofa.jpg', photo.getvalue(), content_type='image/jpeg'),
+            )
+            conversation = Conversation.objects.create(item=item)
+            conversation.members.add(buyer, seller)
+            ConversationMessage.objects.create(conversation=conversation, content='Здравствуйте', created_by=buyer)
+            # the resized copies are made later, after the inbox rows
+            self.assertEqual(set(InboxEntry.objects.values_list('item_thumbnail', flat=True)), {item.image.url})
+            call_command('build_image_derivatives', workers=1, stdout=StringIO())
+        item.refresh_from_db()
+        self.assertEqual(item.image_variants['widths'], [160, 320, 640])
+        thumbnails = set(InboxEntry.objects.values_list('item_thumbnail', flat=True))
+        self.assertEqual(len(thumbnails), 1)
+        self.assertTrue(thumbnails.pop().endswith('-160w.jpg'))
+
+
+class BrokerTests(TestCase):
+
+    def test_publish_reaches_channel_subscribers(self):
+        broker = LocalBroker()
+        received = []
+        unsubscribe = broker.subscribe('conversation:1', received.append)
+        broker.publish('conversation:1', {'id': 1})
+        broker.publish('conversation:2', {'id': 2})
+        unsubscribe()
+        broker.publish('conversation:1', {'id': 3})
+        self.assertEqual(received, [{'id': 1}])
+        self.assertEqual(broker.subscriber_count('conversation:1'), 0)
+
+    async def test_subscription_receives_from_other_threads(self):
+        broker = LocalBroker()
+        subscription = Subscription(broker, 'conversation:1')
+        thread = threading.Thread(target=broker.publish, args=('conversation:1', {'id': 1}))
+        thread.start()
+        thread.join()
+        self.assertEqual(await subscription.get(1), {'id': 1})
+        self.assertIsNone(await subscription.get(0.01))
+        subscription.close()
+        self.assertEqual(broker.subscriber_count('conversation:1'), 0)
+
+
+class EventsTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user('seller')
+        self.buyer = User.objects.create_user('buyer')
+        category = Category.objects.create(name='Диваны')
+        item = Item.objects.create(category=category, name='Диван', price_tg=100000, created_by=self.seller)
+        self.conversation = Conversation.objects.create(item=item)
+        self.conversation.members.add(self.buyer, self.seller)
+        self.first = ConversationMessage.objects.create(conversation=self.conversation, content='Здравствуйте', created_by=self.buyer)
+        self.url = reverse('conversation:events', args=[self.conversation.pk])
+
+    async def test_backlog_after_last_event_id(self):
+        second = await ConversationMessage.objects.acreate(conversation=self.conversation, content='Добрый день', created_by=self.seller)
+        await self.async_client.aforce_login(self.buyer)
+        response = await self.async_client.get(self.url, headers={'Last-Event-ID': str(self.first.pk)})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b'retry:'))
+        body = (await anext(chunks)).decode()
+        self.assertTrue(body.startswith(f'id: {second.pk}\nevent: message\n'))
+        self.assertIn('Добрый день', body)
+        await chunks.aclose()
+
+    def test_no_stream_under_wsgi(self):
+        self.client.force_login(self.buyer)
+        # 204 keeps EventSource from reconnecting over and over
+        self.assertEqual(self.client.get(self.url).status_code, 204)
+        page = self.client.get(reverse('conversation:detail', args=[self.conversation.pk]))
+        self.assertNotContains(page, 'data-events-url')
+        response = self.client.post(reverse('conversation:detail', args=[self.conversation.pk]), {'content': 'Ещё продаётся?'})
+        self.assertRedirects(response, reverse('conversation:detail', args=[self.conversation.pk]))
+
+    async def test_chat_page_under_asgi(self):
+        await self.async_client.aforce_login(self.buyer)
+        page = await self.async_client.get(reverse('conversation:detail', args=[self.conversation.pk]))
+        self.assertContains(page, f'data-events-url="{self.url}"')
+
+    def test_members_only(self):
+        self.client.force_login(User.objects.create_user('stranger'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_sent_message_is_published(self):
+        received = []
+        unsubscribe = get_broker().subscribe(channel_name(self.conversation.pk), received.append)
+        self.addCleanup(unsubscribe)
+        self.client.force_login(self.seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('conversation:detail', args=[self.conversation.pk]),
+                {'content': 'Да, ещё продаётся'}, HTTP_X_REQUESTED_WITH='fetch',
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([payload['content'] for payload in received], ['Да, ещё продаётся'])
+        self.assertEqual(received[0]['id'], response.json()['id'])
 
-# Create your tests here.
+    async def test_stream_under_asgi(self):
+        await self.async_client.aforce_login(self.buyer)
+        response = await self.async_client.get(self.url, {'after': 0})
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b'retry:'))
+        self.assertIn('Здравствуйте'.encode(), await anext(chunks))
+        channel = channel_name(self.conversation.pk)
+        next_chunk = asyncio.ensure_future(anext(chunks))
+        while not get_broker().subscriber_count(channel):
+            await asyncio.sleep(0)
+        get_broker().publish(channel, {'id': self.first.pk + 1, 'content': 'Новое'})
+        self.assertIn('Новое'.encode(), await asyncio.wait_for(next_chunk, 1))
+        # the client going away cancels the response task while it waits
+        waiting = asyncio.ensure_future(anext(chunks))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(get_broker().subscriber_count(channel), 0)
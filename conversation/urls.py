@@ -7,5 +7,7 @@ app_name = 'conversation'
 urlpatterns = [
     path('', views.inbox, name='inbox'),
     path('<int:pk>/', views.detail, name='detail'),
+    path('<int:pk>/history/', views.history, name='history'),
+    path('<int:pk>/events/', views.events, name='events'),
     path('new/<int:item_pk>/', views.new_conversation, name='new'),
 ]
@@ -1,10 +1,23 @@
+import json
+
 from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 
 from item.models import Item
 
 from .forms import ConversationMessageForm
-from .models import Conversation
+from .history import history_page
+from .inbox import mark_read
+from .models import Conversation, ConversationMessage, InboxEntry
+from .pubsub import Subscription, channel_name, get_broker, message_payload
+
+
+# seconds between keep-alive comments on an idle event stream
+KEEPALIVE_INTERVAL = 15
+# how soon EventSource reconnects after the stream drops
+RETRY_MS = 3000
 
 @login_required
 def new_conversation(request, item_pk):
@@ -13,10 +26,10 @@ def new_conversation(request, item_pk):
     if item.created_by == request.user:
         return redirect('dashboard:index')
     
-    conversations = Conversation.objects.filter(item=item).filter(members__in=[request.user.id])
+    conversation = Conversation.objects.filter(item=item, members=request.user).first()
 
-    if conversations:
-        return redirect('conversation:detail', pk=conversations.first().id)
+    if conversation:
+        return redirect('conversation:detail', pk=conversation.id)
 
     if request.method == 'POST':
         form = ConversationMessageForm(request.POST)
@@ -42,10 +55,11 @@ def new_conversation(request, item_pk):
 
 @login_required
 def inbox(request):
-    conversations = Conversation.objects.filter(members__in=[request.user.id])
+    # one row per conversation, kept up to date as messages are sent (see inbox.py)
+    entries = InboxEntry.objects.filter(user=request.user)
 
     return render(request, 'conversation/inbox.html', {
-        'conversations': conversations
+        'entries': entries
     })
 
 @login_required
@@ -63,11 +77,88 @@ def detail(request, pk):
 
             conversation.save()
 
+            if request.headers.get('X-Requested-With') == 'fetch':
+                # sent from the open chat, which gets the message back over its event stream
+                return JsonResponse({'id': conversation_message.id}, status=201)
             return redirect('conversation:detail', pk=pk)
     else:
         form = ConversationMessageForm()
+        mark_read(request.user, conversation)
+
+    conversation_messages, older_cursor = history_page(conversation, request.GET.get('cursor'))
 
     return render(request, 'conversation/detail.html', {
         'conversation': conversation,
+        'conversation_messages': conversation_messages,
+        'older_cursor': older_cursor,
+        # only ASGI keeps an event stream open; under WSGI the page keeps the plain form
+        'live': isinstance(request, ASGIRequest),
         'form': form
-    })
\ No newline at end of file
+    })
+
+
+@login_required
+def history(request, pk):
+    # the page of messages before `cursor`, for loading older messages as the reader scrolls up
+    conversation = get_object_or_404(Conversation, pk=pk, members=request.user)
+    conversation_messages, older_cursor = history_page(conversation, request.GET.get('cursor'))
+
+    return render(request, 'conversation/messages_page.html', {
+        'conversation': conversation,
+        'conversation_messages': conversation_messages,
+        'older_cursor': older_cursor,
+    })
+
+
+@login_required
+async def events(request, pk):
+    """Server-sent events with the conversation's messages newer than the client's last one.
+
+    The stream stays open and new messages are pushed as they are sent
+    (see pubsub.py). Under WSGI a worker cannot be held for it, so the
+    answer is 204, which tells EventSource not to reconnect; the chat page
+    does not open it there.
+    """
+    user = await request.auser()
+    if not await Conversation.objects.filter(pk=pk, members=user).aexists():
+        raise Http404
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or request.GET.get('after') or 0)
+    except ValueError:
+        last_id = 0
+
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(_event_stream(pk, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _event(payload):
+    return f'id: {payload["id"]}\nevent: message\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n'
+
+
+async def _messages_after(conversation_id, last_id):
+    messages = ConversationMessage.objects.filter(conversation_id=conversation_id, id__gt=last_id)
+    async for message in messages.select_related('created_by').order_by('id'):
+        yield message_payload(message)
+
+
+async def _event_stream(conversation_id, last_id):
+    # subscribe before reading the backlog, so nothing sent in between is missed
+    subscription = Subscription(get_broker(), channel_name(conversation_id))
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        async for payload in _messages_after(conversation_id, last_id):
+            last_id = payload['id']
+            yield _event(payload)
+        while True:
+            payload = await subscription.get(KEEPALIVE_INTERVAL)
+            if payload is None:
+                yield ': keepalive\n\n'
+            elif payload['id'] > last_id:
+                last_id = payload['id']
+                yield _event(payload)
+    finally:
+        subscription.close()
@@ -0,0 +1,101 @@
+"""Sends catalog reads to the read replica, everything else to the primary.
+
+Only the catalog (the `item` app: items, categories, tags, related
+items) is read from the replica: it is most of the read traffic and can
+be a little behind. Carts, conversations, inboxes, users and sessions are
+read from the primary, where the visitor's own writes are, and so is the
+queue of the related-items worker.
+
+Once a request has written anything, or while it is in a transaction, all
+its reads go to the primary too, so a view never reads back older data
+than it has just saved. The pin is cleared when the next request starts
+(core/signals.py), but `PrimaryPinMiddleware` keeps the visitor's next
+requests on the primary for `REPLICA_PIN_SECONDS` with a cookie, until the
+replica has caught up with their write.
+
+A page going into the page cache outlives the replica's lag, so it is
+rendered from the replica only if the replica already holds every change
+that made the old copy stale (core/pagecache.py): `sync_replica` notes
+on the primary when it takes each copy (`ReplicaSnapshot`), and that
+time is compared with the page's tag versions. Otherwise, or with a
+replica kept by another tool, the page is rendered from the primary.
+"""
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+
+REPLICA = 'replica'
+CATALOG_APPS = {'item'}
+# catalog-app models that are per visitor or worker state, not catalog
+PRIMARY_MODELS = {'item.storedcart', 'item.relatedupdate'}
+
+PIN_COOKIE = 'primary_pin'
+
+_pinned = ContextVar('pinned_to_primary', default=False)
+_wrote = ContextVar('wrote_to_primary', default=False)
+
+
+def pin():
+    _pinned.set(True)
+
+
+def unpin():
+    _pinned.set(False)
+    _wrote.set(False)
+
+
+def replica_snapshot_time():
+    """time.time_ns() of the primary as the replica holds it, or None if unknown."""
+    # no replica, or reads that go to the primary anyway
+    if REPLICA not in settings.DATABASES or _pinned.get() or connections['default'].in_atomic_block:
+        return None
+    from .models import ReplicaSnapshot
+    return ReplicaSnapshot.objects.using(REPLICA).values_list('taken_at', flat=True).first()
+
+
+def replica_covers(moment):
+    """Whether the replica holds every change committed before `moment` (a time.time_ns() value)."""
+    taken_at = replica_snapshot_time()
+    return taken_at is not None and taken_at >= moment
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in CATALOG_APPS or model._meta.label_lower in PRIMARY_MODELS or _pinned.get():
+            return 'default'
+        if connections['default'].in_atomic_block:
+            return 'default'
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        _pinned.set(True)
+        _wrote.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both databases hold the same rows
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # the replica is a copy of the primary
+        return db == 'default'
+
+
+class PrimaryPinMiddleware:
+    # before the session middleware, so a session save counts as a write
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.COOKIES.get(PIN_COOKIE):
+            pin()
+        response = self.get_response(request)
+        if _wrote.get():
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 10), httponly=True, samesite='Lax',
+            )
+        return response
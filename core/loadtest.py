@@ -0,0 +1,319 @@
+"""Load testing a running site.
+
+Virtual users walk through short scenarios (browse the catalog, fill a
+cart, read the inbox) from a pool of threads, each over its own keep-alive
+HTTP connection to `base_url` (runserver, gunicorn, uvicorn...), so the run
+measures the web server, the Django stack and the database together. The
+ids the scenarios pick from are read from the database in the settings,
+which must be the one the server uses; sessions for up to
+`LOGGED_IN_MEMBERS` members are created there before the run. For each endpoint it records latency percentiles,
+throughput, errors and SQL queries per request (those from the server's
+`X-SQL-Queries` header, so only with DEBUG on).
+
+With `base_url=None` requests go through `django.test.Client` in this
+process instead: no server and no network, but the query counts of every
+request, the read replica's included. That measures the Django stack
+only, and the threads share one interpreter.
+"""
+import http.client
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from conversation.models import Conversation
+from item.models import Item, Tag
+
+from .sqlstats import QueryRecorder
+
+
+# scenario -> endpoints a virtual user requests, in order
+SCENARIOS = {
+    'visitor': ['home', 'search', 'detail', 'detail'],
+    'shopper': ['search', 'detail', 'cart_add', 'cart_update', 'cart'],
+    'member': ['home', 'inbox', 'conversation'],
+}
+
+DEFAULT_MIX = {'visitor': 60, 'shopper': 25, 'member': 15}
+
+SEARCH_TERMS = ['диван', 'стол', 'кровать', 'лампа', 'ковер', 'шкаф', 'modern', 'classic']
+
+PERCENTILES = (50, 95, 99)
+
+# members the HTTP run logs in beforehand and picks from
+LOGGED_IN_MEMBERS = 50
+
+
+def parse_mix(text):
+    """'visitor=60,member=40' -> {'visitor': 60, 'member': 40}."""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f'Unknown scenario {name!r}, expected one of {", ".join(SCENARIOS)}')
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted `values`."""
+    if not values:
+        return None
+    return values[max(1, math.ceil(p / 100 * len(values))) - 1]
+
+
+class Fixtures:
+    """Ids the scenarios pick from, read once before the run."""
+
+    def __init__(self, sample=1000):
+        self.item_ids = list(Item.objects.filter(is_sold=False).values_list('pk', flat=True)[:sample])
+        if not self.item_ids:
+            raise ValueError('There are no items to request, seed the database first (manage.py seed_items)')
+        self.search_terms = SEARCH_TERMS + list(Tag.objects.values_list('name', flat=True)[:20])
+        self.conversations = {}
+        for pk, user_id in Conversation.objects.values_list('pk', 'members')[:sample]:
+            self.conversations.setdefault(user_id, []).append(pk)
+        self.member_ids = list(self.conversations) or list(User.objects.values_list('pk', flat=True)[:sample])
+        self.sessions = {}
+
+    def log_in_members(self, limit=LOGGED_IN_MEMBERS):
+        """Create session cookies for up to `limit` members, who are then the only ones picked."""
+        self.sessions = {user.pk: session_cookie(user) for user in User.objects.filter(pk__in=self.member_ids[:limit])}
+        self.member_ids = list(self.sessions)
+
+
+def session_cookie(user):
+    """A session cookie value logged in as `user`, saved in the session store the server reads."""
+    client = Client()
+    client.force_login(user)
+    return client.cookies[settings.SESSION_COOKIE_NAME].value
+
+
+class HTTPTransport:
+    """Requests to a running server over one keep-alive connection, with the cookies it sets."""
+
+    def __init__(self, base_url, sessions, host=None):
+        url = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(url.hostname, url.port, timeout=30)
+        self.prefix = url.path.rstrip('/')
+        self.host = host or url.netloc
+        self.origin = f'{url.scheme}://{self.host}'
+        self.sessions = sessions
+        self.cookies = {}
+
+    def login(self, user_id):
+        self.cookies[settings.SESSION_COOKIE_NAME] = self.sessions[user_id]
+
+    def request(self, method, path, data):
+        """(status, SQL queries or None) of one request."""
+        headers = {'Host': self.host}
+        body = None
+        if method == 'post':
+            # the token is checked against the cookie; a new client makes up its own, like a fresh page would get
+            token = self.cookies.setdefault(settings.CSRF_COOKIE_NAME, get_random_string(32))
+            headers.update({'X-CSRFToken': token, 'Origin': self.origin, 'Content-Type': 'application/x-www-form-urlencoded'})
+            body = urlencode(data or {})
+        elif data:
+            path = f'{path}?{urlencode(data)}'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        try:
+            response = self._send(method.upper(), self.prefix + path, body, headers)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # the server closed the idle connection
+            self.connection.close()
+            response = self._send(method.upper(), self.prefix + path, body, headers)
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                if morsel.value:
+                    self.cookies[name] = morsel.value
+                else:
+                    self.cookies.pop(name, None)
+        queries = response.headers.get('X-SQL-Queries', '').partition(';')[0]
+        return response.status, int(queries) if queries.isdigit() else None
+
+    def _send(self, method, path, body, headers):
+        self.connection.request(method, path, body, headers)
+        response = self.connection.getresponse()
+        response.read()
+        return response
+
+    def close(self):
+        self.connection.close()
+
+
+class InProcessTransport:
+    """Requests through `django.test.Client`, with their queries counted on every database."""
+
+    def __init__(self, host='localhost'):
+        self.client = Client(SERVER_NAME=host)
+
+    def login(self, user_id):
+        self.client.force_login(User.objects.get(pk=user_id))
+
+    def request(self, method, path, data):
+        with QueryRecorder() as queries:
+            response = getattr(self.client, method)(path, data)
+        return response.status_code, queries.count
+
+    def close(self):
+        pass
+
+
+class VirtualUser:
+
+    def __init__(self, scenario, fixtures, transport):
+        self.scenario = scenario
+        self.fixtures = fixtures
+        self.transport = transport
+        self.user_id = None
+        if scenario == 'member' and fixtures.member_ids:
+            self.user_id = random.choice(fixtures.member_ids)
+            transport.login(self.user_id)
+
+    def request(self, endpoint):
+        """(method, path, data) of one request to `endpoint`, or None if there is nothing to request."""
+        f = self.fixtures
+        item_id = random.choice(f.item_ids) if f.item_ids else None
+        if endpoint == 'home':
+            return 'get', reverse('home'), None
+        if endpoint == 'search':
+            return 'get', reverse('item:items'), {'query': random.choice(f.search_terms)}
+        if endpoint == 'cart':
+            return 'get', reverse('item:cart'), None
+        if endpoint == 'inbox':
+            return ('get', reverse('conversation:inbox'), None) if self.user_id else None
+        if endpoint == 'conversation':
+            conversations = f.conversations.get(self.user_id)
+            return ('get', reverse('conversation:detail', args=[random.choice(conversations)]), None) if conversations else None
+        if item_id is None:
+            return None
+        if endpoint == 'detail':
+            return 'get', reverse('item:detail', args=[item_id]), None
+        if endpoint == 'cart_add':
+            return 'get', reverse('item:cart_add', args=[item_id]), None
+        if endpoint == 'cart_update':
+            return 'post', reverse('item:cart_update', args=[item_id]), {'qty': random.randint(1, 3)}
+        raise ValueError(f'Unknown endpoint {endpoint!r}')
+
+
+class Recorder:
+    """Per-endpoint samples, shared by the worker threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, endpoint, seconds, queries, ok):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append((seconds, queries, ok))
+
+    def count(self):
+        with self.lock:
+            return sum(len(samples) for samples in self.samples.values())
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(seconds * 1000 for seconds, queries, ok in samples)
+    queries = [queries for seconds, queries, ok in samples if queries is not None]
+    stats = {
+        'requests': len(samples),
+        'errors': sum(not ok for seconds, queries, ok in samples),
+        'throughput': round(len(samples) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+        'queries_max': max(queries) if queries else None,
+    }
+    for p in PERCENTILES:
+        value = percentile(latencies, p)
+        stats[f'p{p}_ms'] = round(value, 2) if value is not None else None
+    return stats
+
+
+def run(base_url, requests=1000, concurrency=8, duration=None, mix=None, host=None, warmup=0, seed=None):
+    """Run the load test against `base_url` (None: in this process) and return its results record.
+
+    Stops after `requests` requests or `duration` seconds, whichever comes
+    first (either may be None). `warmup` requests per thread are made first
+    and not recorded. `host` is the Host header, by default the one in
+    `base_url` (or 'localhost' in process).
+    """
+    mix = mix or DEFAULT_MIX
+    if seed is not None:
+        random.seed(seed)
+    fixtures = Fixtures()
+    if base_url is not None:
+        fixtures.log_in_members()
+    recorder = Recorder()
+    names, weights = list(mix), list(mix.values())
+    deadline = None
+
+    def done():
+        if requests is not None and recorder.count() >= requests:
+            return True
+        return deadline is not None and time.monotonic() > deadline
+
+    def transport():
+        if base_url is None:
+            return InProcessTransport(host or 'localhost')
+        return HTTPTransport(base_url, fixtures.sessions, host)
+
+    def worker():
+        issued = 0
+        try:
+            while True:
+                user = VirtualUser(random.choices(names, weights)[0], fixtures, transport())
+                try:
+                    for endpoint in SCENARIOS[user.scenario]:
+                        if issued >= warmup and done():
+                            return
+                        request = user.request(endpoint)
+                        if request is None:
+                            continue
+                        method, path, data = request
+                        start = time.perf_counter()
+                        try:
+                            status, queries = user.transport.request(method, path, data)
+                            ok = status < 400
+                        except Exception:
+                            ok, queries = False, None
+                        seconds = time.perf_counter() - start
+                        issued += 1
+                        if issued > warmup:
+                            recorder.add(endpoint, seconds, queries, ok)
+                finally:
+                    user.transport.close()
+        finally:
+            connections.close_all()
+
+    started = time.monotonic()
+    if duration:
+        deadline = started + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(worker) for i in range(concurrency)]
+        for future in futures:
+            future.result()
+    elapsed = time.monotonic() - started
+
+    all_samples = [sample for samples in recorder.samples.values() for sample in samples]
+    return {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(time.time() - elapsed)),
+        'elapsed': round(elapsed, 2),
+        'options': {'requests': requests, 'concurrency': concurrency, 'duration': duration, 'mix': mix, 'warmup': warmup},
+        'target': base_url or 'in-process',
+        'database': {'vendor': connection.vendor, 'items': Item.objects.count()},
+        'total': summarize(all_samples, elapsed),
+        'endpoints': {endpoint: summarize(samples, elapsed) for endpoint, samples in sorted(recorder.samples.items())},
+    }
@@ -0,0 +1,94 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.loadtest import DEFAULT_MIX, PERCENTILES, parse_mix, run
+
+
+RESULTS_DIR = os.path.join(settings.BASE_DIR, 'loadtest_results')
+
+COLUMNS = ['requests', 'errors', 'throughput', 'mean_ms'] + [f'p{p}_ms' for p in PERCENTILES] + ['queries_mean', 'queries_max']
+
+
+class Command(BaseCommand):
+    help = 'Load test the site with concurrent virtual users and report latency, throughput and queries per endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000',
+                            help='Address of the running site to load (runserver, gunicorn...), using the same database as these settings')
+        parser.add_argument('--in-process', action='store_true',
+                            help='Make the requests with django.test.Client in this process instead of over HTTP: no web server, '
+                                 'but SQL queries counted on every database')
+        parser.add_argument('--requests', type=int, help='Requests to make in total (default: 1000, or unlimited with --duration)')
+        parser.add_argument('--duration', type=float, help='Stop after this many seconds')
+        parser.add_argument('--concurrency', type=int, default=8, help='Virtual users running at once')
+        parser.add_argument('--mix', default=','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items()),
+                            help='Scenario weights, e.g. visitor=60,shopper=25,member=15')
+        parser.add_argument('--warmup', type=int, default=5, help='Unrecorded requests per virtual user thread first')
+        parser.add_argument('--host', help='Host header of the requests, if not the one in --base-url (must be in ALLOWED_HOSTS)')
+        parser.add_argument('--seed', type=int, help='Random seed, to repeat the same request sequence')
+        parser.add_argument('--output', help=f'Results file (default: a new file in {RESULTS_DIR})')
+        parser.add_argument('--compare', help='Earlier results file to compare this run with')
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(e)
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        requests = options['requests']
+        if requests is None and not options['duration']:
+            requests = 1000
+        base_url = None if options['in_process'] else options['base_url']
+        self.stdout.write(self.style.NOTICE(
+            f'Running {options["concurrency"]} virtual users ({options["mix"]}) against {base_url or "this process"}...'
+        ))
+        try:
+            results = run(
+                base_url,
+                requests=requests,
+                concurrency=max(1, options['concurrency']),
+                duration=options['duration'],
+                mix=mix,
+                host=options['host'],
+                warmup=options['warmup'],
+                seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        self.report(results, baseline)
+        output = options['output'] or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f'Done. {results["total"]["requests"]} requests in {results["elapsed"]}s, results saved to {output}'))
+
+    def report(self, results, baseline=None):
+        rows = dict(results['endpoints'], total=results['total'])
+        previous = dict(baseline['endpoints'], total=baseline['total']) if baseline else {}
+        width = max(len(name) for name in rows)
+        self.stdout.write(' '.join([' ' * width] + [f'{column:>12}' for column in COLUMNS]))
+        for name, stats in rows.items():
+            self.stdout.write(' '.join([name.ljust(width)] + [f'{format_value(stats[column]):>12}' for column in COLUMNS]))
+            if name in previous:
+                changes = [change(stats[column], previous[name].get(column)) for column in COLUMNS]
+                self.stdout.write(' '.join([' ' * width] + [f'{value:>12}' for value in changes]))
+
+
+def format_value(value):
+    return '-' if value is None else str(value)
+
+
+def change(value, before):
+    """Relative change against the earlier run, e.g. '+12%'."""
+    if value is None or not before:
+        return ''
+    return f'{(value - before) / before * 100:+.0f}%'
@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.dbrouter import REPLICA
+from core.models import ReplicaSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the primary SQLite database into the read replica file (DATABASES["replica"]). '
+        'Each copy is the whole file: fine for a small database on the same machine; '
+        'use LiteFS or Litestream for a large or remote one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Keep copying, this many seconds apart, whenever the primary changed')
+
+    def handle(self, *args, **options):
+        if REPLICA not in settings.DATABASES:
+            raise CommandError('There is no replica database, set SQLITE_REPLICA_PATH with DB_PROFILE=production')
+        version = None
+        while True:
+            started = time.monotonic()
+            copied, version = self.sync(version)
+            if copied:
+                self.stdout.write(f'Replica updated in {time.monotonic() - started:.2f}s')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def sync(self, last_version):
+        """Copy the primary unless nothing was written to it since `last_version`; (copied, data version)."""
+        primary = connections['default']
+        primary.ensure_connection()
+        # changes whenever another connection commits, not for this one's own writes
+        version = primary.connection.execute('PRAGMA data_version').fetchone()[0]
+        if version == last_version:
+            return False, version
+        # the time goes into the copy with the rest, so the replica knows how recent it is
+        ReplicaSnapshot.objects.bulk_create(
+            [ReplicaSnapshot(pk=1, taken_at=time.time_ns())],
+            update_conflicts=True, unique_fields=['id'], update_fields=['taken_at'],
+        )
+        # the replica connection normally runs with query_only, so the copy is written over a connection of its own
+        replica = primary.Database.connect(settings.DATABASES[REPLICA]['NAME'], timeout=60)
+        try:
+            # one step: a snapshot of the primary, which WAL lets writers keep changing meanwhile. It
+            # waits for the reads open on the replica, and its time and I/O grow with the database
+            primary.connection.backup(replica)
+        finally:
+            replica.close()
+        return True, version
@@ -0,0 +1,249 @@
+"""Request metrics in the Prometheus text format, served at /metrics/.
+
+`MetricsMiddleware` records for every request, by resolved URL name
+(`item:detail`, `conversation:inbox`, ...): a latency histogram, request
+counts by status, SQL queries and database time (from core/sqlstats.py)
+and the time spent rendering templates (measured by the
+`TimedDjangoTemplates` backend). Caches report hits and misses with
+`count_cache`; the page cache is counted from its `X-Page-Cache` header.
+Per-route percentiles come from the histograms, e.g. in Prometheus:
+
+    histogram_quantile(0.99, sum by (view, le) (rate(http_request_duration_seconds_bucket[5m])))
+
+Metrics are aggregated in memory. With several worker processes each one
+only sees its own requests, so set `METRICS_DIR` to a directory shared by
+the workers: every process then writes its totals there (at most every
+`METRICS_FLUSH_INTERVAL` seconds, and on exit) and /metrics/ adds up the
+files of all processes. Clear the directory when the server restarts.
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+from .sqlstats import view_name
+
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    'http_requests_total': ('counter', 'Requests answered, by URL name, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'Time to answer a request, by URL name.'),
+    'db_queries_total': ('counter', 'SQL queries made by requests, by URL name.'),
+    'db_query_duration_seconds_total': ('counter', 'Time requests spent in SQL queries, by URL name.'),
+    'template_render_duration_seconds': ('histogram', 'Time requests spent rendering templates, by URL name.'),
+    'cache_requests_total': ('counter', 'Cache lookups, by cache and result.'),
+    'cache_hit_ratio': ('gauge', 'Share of cache lookups that were hits, by cache.'),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_flushed_at = 0.0
+
+# template render time of the request being answered
+_template_seconds = ContextVar('template_seconds', default=None)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, labels, value=1):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, labels, value):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # a count per bucket and one for +Inf, then the sum and the count of observations
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 3)
+        histogram[bisect.bisect_left(BUCKETS, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def count_cache(cache, hit):
+    inc('cache_requests_total', {'cache': cache, 'result': 'hit' if hit else 'miss'})
+
+
+def snapshot():
+    """This process's metrics as JSON-friendly lists."""
+    with _lock:
+        return {
+            'counters': [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, list(labels), list(values)] for (name, labels), values in _histograms.items()],
+        }
+
+
+def _metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def flush(force=False):
+    """Write this process's metrics to `METRICS_DIR`, unless it was done less than `METRICS_FLUSH_INTERVAL` ago."""
+    global _flushed_at
+    directory = _metrics_dir()
+    now = time.monotonic()
+    if not directory or (not force and now - _flushed_at < getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)):
+        return
+    _flushed_at = now
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    # written aside and renamed, so a reader never sees half a file
+    temporary = f'{path}.{threading.get_ident()}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(temporary, path)
+
+
+atexit.register(lambda: flush(force=True))
+
+
+def collect():
+    """(counters, histograms) of every process: from `METRICS_DIR` if set, else this process's own."""
+    directory = _metrics_dir()
+    if not directory:
+        snapshots = [snapshot()]
+    else:
+        flush(force=True)
+        snapshots = []
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # a process that is just writing its first file
+                continue
+
+    counters, histograms = {}, {}
+    for data in snapshots:
+        for name, labels, value in data['counters']:
+            key = name, tuple(tuple(label) for label in labels)
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in data['histograms']:
+            key = name, tuple(tuple(label) for label in labels)
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    counters, histograms = collect()
+
+    cache_totals = {}
+    for (name, labels), value in counters.items():
+        if name == 'cache_requests_total':
+            labels = dict(labels)
+            hits, total = cache_totals.get(labels['cache'], (0, 0))
+            cache_totals[labels['cache']] = (hits + value * (labels['result'] == 'hit'), total + value)
+    gauges = {_key('cache_hit_ratio', {'cache': cache}): hits / total for cache, (hits, total) in cache_totals.items() if total}
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if kind == 'histogram':
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), values):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {_number(values[-2])}')
+                lines.append(f'{name}_count{_labels(labels)} {values[-1]}')
+        else:
+            values = gauges if kind == 'gauge' else counters
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    # outermost, so the time covers the other middleware too
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        token = _template_seconds.set([0.0])
+        try:
+            response = self.get_response(request)
+            template_seconds = _template_seconds.get()[0]
+        finally:
+            _template_seconds.reset(token)
+        seconds = time.perf_counter() - start
+
+        view = view_name(request)
+        inc('http_requests_total', {'view': view, 'method': request.method, 'status': response.status_code})
+        observe('http_request_duration_seconds', {'view': view}, seconds)
+        recorder = getattr(request, 'sql_recorder', None)
+        if recorder is not None:
+            inc('db_queries_total', {'view': view}, recorder.count)
+            inc('db_query_duration_seconds_total', {'view': view}, recorder.seconds)
+        if template_seconds:
+            observe('template_render_duration_seconds', {'view': view}, template_seconds)
+        page_cache = response.get('X-Page-Cache')
+        if page_cache:
+            # a stale page is served from the cache too
+            count_cache('page', page_cache != 'miss')
+        flush()
+        return response
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            total = _template_seconds.get()
+            if total is not None:
+                total[0] += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, adding each render's time to the current request's metrics."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
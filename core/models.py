@@ -1,3 +1,14 @@
 from django.db import models
 
-# Create your models here.
+
+class ReplicaSnapshot(models.Model):
+    """When `sync_replica` last copied the primary (core/dbrouter.py).
+
+    One row, written on the primary just before each copy, so the replica
+    holds the time of its own snapshot.
+    """
+    # time.time_ns(), comparable with the page cache's tag versions
+    taken_at = models.BigIntegerField()
+
+    def __str__(self):
+        return str(self.taken_at)
@@ -0,0 +1,131 @@
+"""Full-page cache for anonymous catalog pages.
+
+Pages are cached per path and normalized query string and tagged with the
+models they show ("item", "category", ...). Saving one of those models
+bumps the tag's version (see core/signals.py), which makes every page
+carrying the tag stale at once without having to find its keys.
+
+Stale pages are not dropped: the first request that finds one takes a
+short lock with `cache.add` and renders the page again, while concurrent
+requests keep getting the stale copy, so an invalidation under load costs
+one render instead of one per waiting request.
+
+Only anonymous GET/HEAD requests without a cart cookie are cached;
+the CSRF token of cached forms is swapped for the visitor's own on every
+hit. With a read replica, a page is rendered for the cache from the
+replica once it holds the changes behind the page's tag versions, and
+from the primary before that (core/dbrouter.py).
+"""
+import functools
+import hashlib
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from item.cart import has_cart
+
+from .dbrouter import pin, replica_covers
+
+
+CSRF_PLACEHOLDER = '__pagecache_csrf_token__'
+CSRF_INPUT_RE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+# how long one request may spend rendering a stale page before another may try
+LOCK_TIMEOUT = 30
+
+
+def _tag_key(tag):
+    return f'pagecache:tag:{tag}'
+
+
+def tag_versions(tags):
+    keys = {_tag_key(tag): tag for tag in tags}
+    found = cache.get_many(list(keys))
+    missing = [key for key in keys if key not in found]
+    if missing:
+        # a fresh version rather than 0, so an evicted tag can never match an old page
+        for key in missing:
+            cache.add(key, time.time_ns(), None)
+        found.update(cache.get_many(missing))
+    return {tag: found.get(key) for key, tag in keys.items()}
+
+
+def invalidate(*tags):
+    """Mark every cached page carrying one of `tags` as stale."""
+    version = time.time_ns()
+    cache.set_many({_tag_key(tag): version for tag in tags}, None)
+
+
+def page_key(request):
+    # parameter order and blank values do not change the page
+    params = sorted((key, value) for key, values in request.GET.lists() for value in values if value != '')
+    raw = request.path + '?' + '&'.join(f'{key}={value}' for key, value in params)
+    return 'pagecache:page:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def is_cacheable(request):
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        and not has_cart(request)
+    )
+
+
+def _store(key, response, versions, timeout):
+    content = CSRF_INPUT_RE.sub(rb'\g<1>' + CSRF_PLACEHOLDER.encode() + rb'\g<2>', response.content)
+    entry = {
+        'content': content,
+        'content_type': response['Content-Type'],
+        'versions': versions,
+        'expires': time.time() + timeout,
+    }
+    cache.set(key, entry, timeout + getattr(settings, 'PAGE_CACHE_STALE', 300))
+
+
+def _respond(request, entry, status):
+    content = entry['content']
+    if CSRF_PLACEHOLDER.encode() in content:
+        content = content.replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode())
+    response = HttpResponse(content, content_type=entry['content_type'])
+    response['X-Page-Cache'] = status
+    return response
+
+
+def cache_anonymous_page(*tags, timeout=None):
+    """Cache a view's page for anonymous visitors; `tags` name the models it shows."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not is_cacheable(request):
+                return view(request, *args, **kwargs)
+
+            key = page_key(request)
+            # read before rendering: a change made meanwhile leaves the new copy stale
+            versions = tag_versions(tags)
+            entry = cache.get(key)
+            if entry is not None:
+                fresh = entry['expires'] > time.time() and entry['versions'] == versions
+                if fresh:
+                    return _respond(request, entry, 'hit')
+                if not cache.add(key + ':lock', 1, LOCK_TIMEOUT):
+                    # someone else is already rendering this page
+                    return _respond(request, entry, 'stale')
+
+            try:
+                # a copy outlives the replica's lag: the replica only renders it once it has the changes
+                if not replica_covers(max(versions.values())):
+                    pin()
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200 and not response.streaming and not response.cookies:
+                    _store(key, response, versions, timeout or getattr(settings, 'PAGE_CACHE_TIMEOUT', 60))
+                    response['X-Page-Cache'] = 'miss'
+            finally:
+                if entry is not None:
+                    cache.delete(key + ':lock')
+            return response
+        return wrapper
+    return decorator
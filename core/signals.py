@@ -0,0 +1,39 @@
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from dashboard.models import MediaToken
+from item.models import Category, Item, Tag
+
+from .dbrouter import unpin
+from .pagecache import invalidate
+
+
+# model -> page cache tag it invalidates
+PAGE_TAGS = {
+    Item: 'item',
+    Category: 'category',
+    Tag: 'tag',
+    MediaToken: 'media',
+}
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def catalog_changed(sender, raw=False, **kwargs):
+    tag = PAGE_TAGS.get(sender)
+    if tag and not raw:
+        transaction.on_commit(lambda: invalidate(tag))
+
+
+@receiver(m2m_changed, sender=Item.tags.through)
+def item_tags_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(lambda: invalidate('item', 'tag'))
+
+
+@receiver(request_started)
+def request_started_on_replica(sender, **kwargs):
+    # the previous request's writes no longer pin this thread to the primary
+    unpin()
@@ -0,0 +1,157 @@
+"""SQL statistics per request, to catch query regressions in production.
+
+`SQLStatsMiddleware` counts the queries every request makes and the time
+spent in the database, with a wrapper on the database connections (so it
+works with DEBUG off and costs a few microseconds per query). Queries are
+also grouped by shape, the SQL with its literals and IN-lists taken out:
+one shape run `SQL_REPEAT_THRESHOLD` times or more in a request is
+usually an N+1 and is reported.
+
+Every request is logged as one JSON line on the `core.sql` logger, at
+WARNING when it repeated a query shape or went over its budget and at
+INFO otherwise. Budgets are set per URL name in `SQL_QUERY_BUDGETS`
+(e.g. {'item:detail': 3}); with `SQL_BUDGET_RAISE` a request over its
+budget fails with `QueryBudgetExceeded` instead of only being logged.
+With DEBUG on, responses carry the counts in an `X-SQL-Queries` header
+and a `Server-Timing` entry.
+
+Totals per URL name since the process started are kept in `url_stats()`.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger('core.sql')
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LIST_RE = re.compile(r'\((?:\s*(?:%s|\?)\s*,)*\s*(?:%s|\?)\s*\)')
+
+# most repeated shapes written to a log line
+LOGGED_SHAPES = 3
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_shape(sql):
+    """`sql` with its literals replaced by ? and IN-lists collapsed, so repeats of one query look alike."""
+    shape = LITERAL_RE.sub('?', sql)
+    return IN_LIST_RE.sub('(...)', shape)
+
+
+def _repeat_threshold():
+    return getattr(settings, 'SQL_REPEAT_THRESHOLD', 5)
+
+
+class QueryRecorder:
+    """Counts the queries run on every database connection while it is entered."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self._wrapped = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+    def __enter__(self):
+        for connection in connections.all():
+            self._wrapped.append(connection)
+            connection.execute_wrappers.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        for connection in self._wrapped:
+            connection.execute_wrappers.remove(self)
+        self._wrapped = []
+
+    def repeated(self, threshold=None):
+        """{shape: times} of the shapes run at least `threshold` times, most repeated first."""
+        threshold = threshold or _repeat_threshold()
+        return {shape: times for shape, times in self.shapes.most_common() if times >= threshold}
+
+
+_lock = threading.Lock()
+_totals = {}
+
+
+def record(view, recorder, repeated):
+    with _lock:
+        totals = _totals.setdefault(view, {'requests': 0, 'queries': 0, 'db_seconds': 0.0, 'max_queries': 0, 'repeated': 0})
+        totals['requests'] += 1
+        totals['queries'] += recorder.count
+        totals['db_seconds'] += recorder.seconds
+        totals['max_queries'] = max(totals['max_queries'], recorder.count)
+        totals['repeated'] += bool(repeated)
+
+
+def url_stats():
+    """{url name: totals} of the requests this process has answered."""
+    with _lock:
+        return {view: dict(totals) for view, totals in _totals.items()}
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+class SQLStatsMiddleware:
+    # sync only: under ASGI async views then run their queries on this
+    # middleware's thread, where the recorder sees them
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        # read by core/metrics.py
+        request.sql_recorder = recorder
+        return self.finish(request, response, recorder)
+
+    def finish(self, request, response, recorder):
+        view = view_name(request)
+        repeated = recorder.repeated()
+        record(view, recorder, repeated)
+        budget = getattr(settings, 'SQL_QUERY_BUDGETS', {}).get(view)
+        over_budget = budget is not None and recorder.count > budget
+
+        level = logging.WARNING if repeated or over_budget else logging.INFO
+        entry = {
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'db_ms': round(recorder.seconds * 1000, 2),
+        }
+        if budget is not None:
+            entry['budget'] = budget
+        if repeated:
+            entry['repeated'] = [{'times': times, 'sql': shape[:300]} for shape, times in list(repeated.items())[:LOGGED_SHAPES]]
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps(entry, ensure_ascii=False))
+
+        if settings.DEBUG:
+            response['X-SQL-Queries'] = f'{recorder.count}; db={entry["db_ms"]}ms; repeated={len(repeated)}'
+            timing = f'db;dur={entry["db_ms"]};desc="{recorder.count} queries"'
+            response['Server-Timing'] = f'{response["Server-Timing"]}, {timing}' if response.has_header('Server-Timing') else timing
+        if over_budget and getattr(settings, 'SQL_BUDGET_RAISE', False):
+            raise QueryBudgetExceeded(f'{view} made {recorder.count} queries, over its budget of {budget}')
+        return response
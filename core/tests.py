@@ -1,3 +1,404 @@
-from django.test import TestCase
+import json
+import os
+import re
+import statistics
+import tempfile
+import time
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.utils import ConnectionHandler
+from django.http import HttpResponse
+from django.test import LiveServerTestCase, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from item import autocomplete, facets
+from conversation.models import Conversation, ConversationMessage
+from item.cart import CART_COOKIE
+from item.models import Category, Item, RelatedUpdate, StoredCart
+from puddle.database import sqlite_database
+
+from . import loadtest, metrics, views
+from .dbrouter import PIN_COOKIE, PrimaryPinMiddleware, ReplicaRouter, unpin
+from .pagecache import cache_anonymous_page, invalidate, page_key, tag_versions
+from .signals import PAGE_TAGS
+from .sqlstats import QueryBudgetExceeded, QueryRecorder, query_shape, url_stats
+
+
+# catalog sizes every view is measured at, e.g. BENCHMARK_SIZES=1000,10000,100000
+BENCHMARK_SIZES = [int(size) for size in os.environ.get('BENCHMARK_SIZES', '1000').split(',')]
+# scales the time limits for slower machines
+BENCHMARK_TIME_FACTOR = float(os.environ.get('BENCHMARK_TIME_FACTOR', '1'))
+# timed runs per measurement; the median is compared with the limit
+BENCHMARK_REPEAT = 5
+
+# small lookup tables that views read whole on purpose
+LOOKUP_TABLES = {'item_category', 'item_tag', 'dashboard_mediatoken'}
+# an SQLite query plan step reading a whole table, without an index
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+def grow_catalog(size):
+    """Seed unsold items until the catalog has `size` of them."""
+    missing = size - Item.objects.count()
+    if missing > 0:
+        call_command('seed_items', bulk=True, count=missing, no_images=True, stdout=StringIO())
+
+
+class ViewBudgetTestCase(TestCase):
+    """Query-count budgets and time limits for views, at every `BENCHMARK_SIZES` catalog size.
+
+    A view must stay within its query budget (so an N+1 fails the test as
+    soon as a page has more than one row) and its median time within its
+    limit, without the page cache.
+    """
+
+    def setUp(self):
+        # the in-memory indexes are reloaded from this test's catalog
+        facets._index = None
+        autocomplete._index = None
+
+    def catalog_sizes(self):
+        for size in BENCHMARK_SIZES:
+            grow_catalog(size)
+            facets._index = None
+            autocomplete._index = None
+            yield size
+
+    def assertViewBudget(self, request, queries, ms):
+        """`request()` makes one request and returns the response."""
+        invalidate(*PAGE_TAGS.values())
+        request()
+        timings = []
+        for i in range(BENCHMARK_REPEAT):
+            # a stale page is rendered again, as without the cache
+            invalidate(*PAGE_TAGS.values())
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = request()
+                timings.append((time.perf_counter() - start) * 1000)
+            self.assertLess(response.status_code, 400)
+        sql = '\n'.join(query['sql'] for query in captured.captured_queries)
+        self.assertLessEqual(len(captured), queries, f'{len(captured)} queries over the budget of {queries}:\n{sql}')
+        median = statistics.median(timings)
+        limit = ms * BENCHMARK_TIME_FACTOR
+        self.assertLessEqual(median, limit, f'median {median:.1f}ms over the limit of {limit:.0f}ms')
+
+    def assertGetBudget(self, url, data=None, *, queries, ms):
+        self.assertViewBudget(lambda: self.client.get(url, data), queries, ms)
+
+
+class IndexBudgetTests(ViewBudgetTestCase):
+
+    def test_index(self):
+        # the core landing page, rendered directly: '' is routed to the Cozy YU home
+        factory = RequestFactory()
+        user = User.objects.create_user('visitor')
+
+        def request():
+            request = factory.get('/')
+            request.user = user
+            return views.index(request)
+
+        for size in self.catalog_sizes():
+            with self.subTest(items=size):
+                self.assertViewBudget(request, queries=3, ms=100)
+
+
+def query_plan(sql, params=()):
+    """The steps of SQLite's EXPLAIN QUERY PLAN for a query."""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[3] for row in cursor.fetchall()]
+
+
+@skipUnless(connection.vendor == 'sqlite', 'query plans are read in the SQLite EXPLAIN format')
+class QueryPlanTestCase(TestCase):
+    """Checks that the hot queries are answered from indexes."""
+
+    # catalog the plans are taken on
+    catalog_size = 200
+
+    def setUp(self):
+        grow_catalog(self.catalog_size)
+
+    def assertUsesIndex(self, queryset, index):
+        sql, params = queryset.query.sql_with_params()
+        plan = query_plan(sql, params)
+        self.assertTrue(any(f'INDEX {index}' in step for step in plan), f'{index} is not used:\n{sql}\n' + '\n'.join(plan))
+
+    def assertNoFullScan(self, request):
+        """No query made by `request()` scans a whole table, other than the `LOOKUP_TABLES`."""
+        with CaptureQueriesContext(connection) as captured:
+            response = request()
+        self.assertLess(response.status_code, 400)
+        for query in captured.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            plan = query_plan(query['sql'])
+            scans = [step for step in plan if FULL_SCAN.match(step) and FULL_SCAN.match(step)[1] not in LOOKUP_TABLES]
+            self.assertFalse(scans, f'full scan in:\n{query["sql"]}\n' + '\n'.join(plan))
+
+    def assertGetNoFullScan(self, url, data=None):
+        self.assertNoFullScan(lambda: self.client.get(url, data))
+
+
+class IndexQueryPlanTests(QueryPlanTestCase):
+
+    def test_index(self):
+        request = RequestFactory().get('/')
+        request.user = User.objects.create_user('visitor')
+        self.assertNoFullScan(lambda: views.index(request))
+
+
+class SQLStatsTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('seller'))
+
+    def test_query_shape(self):
+        self.assertEqual(
+            query_shape("SELECT * FROM item_item WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 21"),
+            query_shape("SELECT * FROM item_item WHERE id IN (%s, %s) AND name = 'it''s' LIMIT 5"),
+        )
+
+    def test_repeated_shapes(self):
+        with QueryRecorder() as recorder:
+            for pk in range(6):
+                Item.objects.filter(pk=pk).exists()
+            User.objects.count()
+        self.assertEqual(recorder.count, 7)
+        self.assertEqual(list(recorder.repeated().values()), [6])
+
+    @override_settings(DEBUG=True)
+    def test_debug_header(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('dashboard:index'))
+        self.assertTrue(response['X-SQL-Queries'].startswith(f'{len(captured)};'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertGreaterEqual(url_stats()['dashboard:index']['max_queries'], len(captured))
+
+    def test_budget(self):
+        with override_settings(SQL_QUERY_BUDGETS={'dashboard:index': 1}):
+            with self.assertLogs('core.sql', 'WARNING') as logs:
+                self.client.get(reverse('dashboard:index'))
+            self.assertIn('"budget": 1', logs.output[0])
+        with override_settings(SQL_QUERY_BUDGETS={'dashboard:index': 1}, SQL_BUDGET_RAISE=True):
+            # still logged before it fails
+            with self.assertLogs('core.sql', 'WARNING') as logs, self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('dashboard:index'))
+            self.assertIn('"budget": 1', logs.output[0])
+
+
+@override_settings(DEBUG=True)
+class LoadTestTests(LiveServerTestCase):
+    # the server's catalog reads may go to the replica (mirroring the primary in tests)
+    databases = '__all__'
+
+    def test_run_over_http(self):
+        grow_catalog(50)
+        buyer = User.objects.create_user('buyer')
+        item = Item.objects.select_related('created_by').first()
+        conversation = Conversation.objects.create(item=item)
+        conversation.members.add(buyer, item.created_by)
+        ConversationMessage.objects.create(conversation=conversation, content='Здравствуйте', created_by=buyer)
+
+        # every request is also logged by the server
+        with self.assertLogs('core.sql'):
+            results = loadtest.run(self.live_server_url, requests=40, concurrency=2, seed=1, mix={'shopper': 1, 'member': 1})
+        self.assertEqual(results['target'], self.live_server_url)
+        self.assertGreaterEqual(results['total']['requests'], 40)
+        # the cart's POST passes the CSRF check and the members their login
+        self.assertEqual(results['total']['errors'], 0)
+        self.assertIn('cart_update', results['endpoints'])
+        self.assertIn('conversation', results['endpoints'])
+        # read from the server's X-SQL-Queries header
+        self.assertGreater(results['endpoints']['detail']['queries_mean'], 0)
+
+        with self.assertLogs('core.sql'):
+            results = loadtest.run(None, requests=10, concurrency=1, mix={'member': 1})
+        self.assertEqual(results['target'], 'in-process')
+        self.assertEqual(results['total']['errors'], 0)
+
+
+class MetricsTests(TestCase):
+
+    def sample(self, name):
+        """The value of one exported sample, e.g. 'db_queries_total{view="core:contact"}' (0 if absent)."""
+        for line in self.client.get(reverse('core:metrics')).content.decode().splitlines():
+            if line.startswith(name + ' '):
+                return float(line.split()[-1])
+        return 0
+
+    def test_requests_by_url_name(self):
+        names = [
+            'http_requests_total{method="GET",status="200",view="core:contact"}',
+            'http_request_duration_seconds_bucket{view="core:contact",le="+Inf"}',
+            'template_render_duration_seconds_count{view="core:contact"}',
+        ]
+        before = [self.sample(name) for name in names]
+        self.client.get(reverse('core:contact'))
+        self.client.get(reverse('core:contact'))
+        self.assertEqual([self.sample(name) for name in names], [value + 2 for value in before])
+
+    def test_cache_hit_ratio(self):
+        metrics.count_cache('test', True)
+        metrics.count_cache('test', True)
+        metrics.count_cache('test', False)
+        hits = self.sample('cache_requests_total{cache="test",result="hit"}')
+        misses = self.sample('cache_requests_total{cache="test",result="miss"}')
+        self.assertAlmostEqual(self.sample('cache_hit_ratio{cache="test"}'), hits / (hits + misses))
+
+    def test_processes_are_added_up(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            own = self.sample('db_queries_total{view="core:contact"}')
+            # what another worker process wrote
+            with open(os.path.join(directory, '1.json'), 'w') as f:
+                json.dump({'counters': [['db_queries_total', [['view', 'core:contact']], 7]], 'histograms': []}, f)
+            self.assertEqual(self.sample('db_queries_total{view="core:contact"}'), own + 7)
+
+    def test_only_allowed_addresses(self):
+        # at the address the settings and README give
+        self.assertEqual(self.client.get('/metrics/').status_code, 200)
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 404)
+
+
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        invalidate(*PAGE_TAGS.values())
+        self.url = reverse('item:items')
+        self.seller = User.objects.create_user('seller', password='password')
+        self.category = Category.objects.create(name='Диваны')
+        self.add_item('Диван угловой')
+
+    def add_item(self, name):
+        # the page tags are bumped once the save commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return Item.objects.create(category=self.category, name=name, created_by=self.seller)
+
+    def get(self, **extra):
+        response = self.client.get(self.url, **extra)
+        return response.get('X-Page-Cache'), response.content.decode()
+
+    def test_hit_after_miss(self):
+        self.assertEqual(self.get()[0], 'miss')
+        status, content = self.get()
+        self.assertEqual(status, 'hit')
+        self.assertIn('Диван угловой', content)
+
+    def test_changes_make_the_page_stale(self):
+        self.get()
+        self.add_item('Кресло мягкое')
+
+        # while another request renders the page again, the old copy is served
+        key = page_key(RequestFactory().get(self.url))
+        cache.add(key + ':lock', 1)
+        status, content = self.get()
+        self.assertEqual(status, 'stale')
+        self.assertNotIn('Кресло мягкое', content)
+
+        cache.delete(key + ':lock')
+        status, content = self.get()
+        self.assertEqual(status, 'miss')
+        self.assertIn('Кресло мягкое', content)
+        self.assertEqual(self.get()[0], 'hit')
+
+    def test_signed_in_and_cart_visitors_are_not_cached(self):
+        self.get()
+        self.client.cookies[CART_COOKIE] = 'cart-id'
+        self.assertIsNone(self.get()[0])
+        del self.client.cookies[CART_COOKIE]
+        self.client.login(username='seller', password='password')
+        self.assertIsNone(self.get()[0])
+
+
+class ProductionDatabaseTests(SimpleTestCase):
+    # connections of their own, on a temporary file
+    databases = {'default'}
+
+    def pragmas(self, database):
+        handler = ConnectionHandler({'default': database})
+        try:
+            with handler['default'].cursor() as cursor:
+                return {
+                    pragma: cursor.execute(f'PRAGMA {pragma}').fetchone()[0]
+                    for pragma in ('journal_mode', 'synchronous', 'cache_size', 'busy_timeout', 'query_only')
+                }
+        finally:
+            handler.close_all()
+
+    def test_pragmas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'db.sqlite3')
+            self.assertEqual(
+                self.pragmas(sqlite_database(path)),
+                {'journal_mode': 'wal', 'synchronous': 1, 'cache_size': -65536, 'busy_timeout': 5000, 'query_only': 0},
+            )
+            self.assertEqual(self.pragmas(sqlite_database(path, replica=True))['query_only'], 1)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        unpin()
+        self.addCleanup(unpin)
+        self.router = ReplicaRouter()
+
+    def test_catalog_reads_go_to_the_replica(self):
+        self.assertEqual(self.router.db_for_read(Item), 'replica')
+        self.assertEqual(self.router.db_for_read(Conversation), 'default')
+        self.assertEqual(self.router.db_for_read(User), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'item'))
+
+    def test_writes_pin_reads_to_the_primary(self):
+        self.assertEqual(self.router.db_for_write(Item), 'default')
+        self.assertEqual(self.router.db_for_read(Item), 'default')
+        # the next request starts unpinned
+        self.client.get(reverse('core:contact'))
+        self.assertEqual(self.router.db_for_read(Item), 'replica')
+
+    def read_item(self, request):
+        self.reads.append(self.router.db_for_read(Item))
+        return HttpResponse('page')
+
+    @override_settings(REPLICA_PIN_SECONDS=10)
+    def test_writers_stay_on_the_primary(self):
+        def write(request):
+            self.router.db_for_write(Item)
+            return HttpResponse()
+
+        response = PrimaryPinMiddleware(write)(RequestFactory().post('/'))
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 10)
+
+        # the pinned visitor's next request reads the primary, another visitor's the replica
+        self.reads = []
+        for cookies in ({PIN_COOKIE: '1'}, {}):
+            unpin()
+            request = RequestFactory().get('/')
+            request.COOKIES.update(cookies)
+            response = PrimaryPinMiddleware(self.read_item)(request)
+            self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.reads, ['default', 'replica'])
+
+    def test_visitor_state_is_read_from_the_primary(self):
+        self.assertEqual(self.router.db_for_read(StoredCart), 'default')
+        self.assertEqual(self.router.db_for_read(RelatedUpdate), 'default')
+
+    def test_page_cache_fills_read_the_replica_once_it_has_the_changes(self):
+        self.reads = []
+        request = RequestFactory().get('/replica-router-test/')
+        request.user = AnonymousUser()
+        invalidate('item')
+        changed_at = tag_versions(['item'])['item']
+        for taken_at in (None, changed_at - 1, changed_at):
+            unpin()
+            cache.delete(page_key(request))
+            with mock.patch('core.dbrouter.replica_snapshot_time', return_value=taken_at):
+                cache_anonymous_page('item')(self.read_item)(request)
+        self.assertEqual(self.reads, ['default', 'default', 'replica'])
@@ -1,15 +1,19 @@
+from django.conf import settings
+from django.db.models import Count
+from django.http import Http404, HttpResponse
 from django.shortcuts import render, redirect
 from item.models import Category, Item
+from item.recommendations import attach_category_matches
 from .forms import SignupForm
+from .metrics import render as render_metrics
 
 def index(request):
     items = Item.objects.filter(is_sold=False).select_related('category')[:6]
     
-    # Простой алгоритм сочетаемости — похожие товары по категории
-    for item in items:
-        item.matches = Item.objects.filter(category=item.category).exclude(id=item.id)[:3]
+    # Простой алгоритм сочетаемости — похожие товары по категории (одним запросом)
+    items = attach_category_matches(items, limit=3)
     
-    categories = Category.objects.all()
+    categories = Category.objects.annotate(item_count=Count('items'))
 
     return render(request, 'core/index.html', {
         'categories': categories,
@@ -29,3 +33,10 @@ def signup(request):
         form = SignupForm()
 
     return render(request, 'core/signup.html', {'form': form})
+
+
+def metrics(request):
+    # scraped by Prometheus, see core/metrics.py
+    if not settings.DEBUG and request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', []):
+        raise Http404
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from dashboard.media import update_manifest
+
+
+class Command(BaseCommand):
+    help = 'Scan MEDIA_ROOT and update the media manifest used for the homepage category cards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Parse every file again, not only changed ones')
+
+    def handle(self, *args, **options):
+        updated, removed = update_manifest(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Done. {updated} files added or updated, {removed} removed.'))
@@ -0,0 +1,125 @@
+"""Manifest of the images under MEDIA_ROOT for the homepage category cards.
+
+Category tokens are parsed from image file names once, when a file is
+added or changes, and stored with one representative image per token, so
+the homepage reads a small table instead of walking MEDIA_ROOT on every
+request. `build_media_manifest` brings the manifest up to date (only files
+whose mtime changed are parsed again) and uploads through `Item.image` are
+recorded as they are saved.
+"""
+import os
+import re
+
+from django.conf import settings
+from django.db import transaction
+
+from item.images import DERIVATIVES_DIR
+
+from .models import MediaFile, MediaToken
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.svg')
+
+
+def media_token(filename):
+    """Category token of an image file name, e.g. "детям4 кровать модерн.jpg" -> "детям"."""
+    name = os.path.splitext(os.path.basename(filename))[0].lower()
+    # normalize: remove digits and punctuation, split on non-letters
+    cleaned = re.sub(r'[^\w\s\-а-яё]', ' ', name)
+    cleaned = re.sub(r'\d+', '', cleaned)
+    parts = re.split(r'[\s_\-]+', cleaned.strip())
+    return parts[0][:100]
+
+
+def _walk(media_root):
+    """(relative path, mtime) of every image under `media_root`."""
+    for root, dirs, files in os.walk(media_root):
+        # resized copies of item images are not separate pictures
+        dirs[:] = [d for d in dirs if d != DERIVATIVES_DIR]
+        for fn in files:
+            if not fn.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            full = os.path.join(root, fn)
+            try:
+                mtime = os.stat(full).st_mtime
+            except OSError:
+                continue
+            yield os.path.relpath(full, media_root).replace('\\', '/'), mtime
+
+
+def refresh_tokens(tokens):
+    """Re-pick the representative image of `tokens`; tokens without files are dropped."""
+    tokens = set(tokens)
+    best = {}
+    for token, path in MediaFile.objects.filter(token__in=tokens).values_list('token', 'path'):
+        key = (path.count('/'), path)
+        if token not in best or key < best[token]:
+            best[token] = key
+
+    MediaToken.objects.filter(token__in=tokens - set(best)).delete()
+    for token, (depth, path) in best.items():
+        MediaToken.objects.update_or_create(token=token, defaults={'image': path, 'depth': depth})
+
+
+def update_manifest(media_root=None, full=False):
+    """Sync the manifest with MEDIA_ROOT; returns (added or changed, removed) file counts.
+
+    Files whose mtime is unchanged are not parsed again unless `full` is set.
+    """
+    media_root = media_root or settings.MEDIA_ROOT
+    known = {path: (pk, mtime, token) for pk, path, mtime, token in MediaFile.objects.values_list('id', 'path', 'mtime', 'token')}
+    seen = set()
+    changed, created, affected = [], [], set()
+
+    if os.path.isdir(media_root):
+        for path, mtime in _walk(media_root):
+            seen.add(path)
+            old = known.get(path)
+            if old is not None and old[1] == mtime and not full:
+                continue
+            token = media_token(path)
+            if old is None:
+                created.append(MediaFile(path=path, mtime=mtime, token=token))
+            else:
+                changed.append(MediaFile(id=old[0], path=path, mtime=mtime, token=token))
+                affected.add(old[2])
+            affected.add(token)
+
+    removed = [(pk, token) for path, (pk, mtime, token) in known.items() if path not in seen]
+    affected.update(token for pk, token in removed)
+
+    with transaction.atomic():
+        MediaFile.objects.bulk_create(created, batch_size=500)
+        MediaFile.objects.bulk_update(changed, ['mtime', 'token'], batch_size=500)
+        removed_ids = [pk for pk, token in removed]
+        for start in range(0, len(removed_ids), 500):
+            MediaFile.objects.filter(id__in=removed_ids[start:start + 500]).delete()
+        refresh_tokens(token for token in affected if token)
+    return len(created) + len(changed), len(removed)
+
+
+def record_media_file(name):
+    """Add or refresh one uploaded file (a storage name relative to MEDIA_ROOT)."""
+    if not name or not name.lower().endswith(IMAGE_EXTENSIONS):
+        return
+    path = name.replace('\\', '/')
+    if DERIVATIVES_DIR in path.split('/'):
+        return
+    try:
+        mtime = os.stat(os.path.join(settings.MEDIA_ROOT, path)).st_mtime
+    except OSError:
+        return
+    old = MediaFile.objects.filter(path=path).values_list('mtime', 'token').first()
+    if old is not None and old[0] == mtime:
+        return
+    token = media_token(path)
+    MediaFile.objects.update_or_create(path=path, defaults={'mtime': mtime, 'token': token})
+    refresh_tokens(token for token in (token, old and old[1]) if token)
+
+
+def category_cards():
+    """Homepage category cards from the manifest: token, display name and image url."""
+    return [
+        {'token': token, 'name': token.capitalize(), 'image_url': settings.MEDIA_URL + image}
+        for token, image in MediaToken.objects.values_list('token', 'image')
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500, unique=True)),
+                ('mtime', models.FloatField()),
+                ('token', models.CharField(db_index=True, max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MediaToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=100, unique=True)),
+                ('image', models.CharField(max_length=500)),
+                ('depth', models.PositiveSmallIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('depth', 'image'),
+            },
+        ),
+    ]
@@ -1,3 +1,26 @@
 from django.db import models
 
-# Create your models here.
+
+class MediaFile(models.Model):
+    """An image under MEDIA_ROOT as last seen by `build_media_manifest`."""
+    # relative to MEDIA_ROOT, '/'-separated
+    path = models.CharField(max_length=500, unique=True)
+    mtime = models.FloatField()
+    token = models.CharField(max_length=100, db_index=True)
+
+    def __str__(self):
+        return self.path
+
+
+class MediaToken(models.Model):
+    """Category token parsed from media file names and the image shown for it on the homepage."""
+    token = models.CharField(max_length=100, unique=True)
+    image = models.CharField(max_length=500)
+    # directory depth of `image`; cards list top-level files first, like os.walk did
+    depth = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        ordering = ('depth', 'image')
+
+    def __str__(self):
+        return self.token
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from item.models import Item
+
+from .media import record_media_file
+
+
+@receiver(post_save, sender=Item)
+def item_image_saved(sender, instance, raw=False, **kwargs):
+    # uploads land in the media manifest right away, no rescan needed
+    if not raw and instance.image:
+        record_media_file(instance.image.name)
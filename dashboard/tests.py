@@ -1,3 +1,107 @@
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
+
+from core.pagecache import invalidate
+from core.tests import QueryPlanTestCase, ViewBudgetTestCase
+from item.models import Category, Item
+
+from .media import category_cards, media_token, record_media_file, update_manifest
+from .models import MediaFile, MediaToken
+
+
+class DashboardBudgetTests(ViewBudgetTestCase):
+
+    def test_home(self):
+        for size in self.catalog_sizes():
+            with self.subTest(items=size):
+                self.assertGetBudget(reverse('home'), queries=7, ms=150)
+                self.assertGetBudget(reverse('home'), {'q': 'диван'}, queries=7, ms=300)
+
+    def test_dashboard(self):
+        seller = User.objects.create_user('seller')
+        category = Category.objects.create(name='Декор')
+        Item.objects.bulk_create([Item(category=category, name=f'Ваза {i}', created_by=seller) for i in range(30)])
+        self.client.force_login(seller)
+        for size in self.catalog_sizes():
+            with self.subTest(items=size):
+                self.assertGetBudget(reverse('dashboard:index'), queries=3, ms=100)
+
+
+class MediaManifestTests(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = self.settings(MEDIA_ROOT=self.media, MEDIA_URL='/media/')
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def write(self, path, mtime=None):
+        full = os.path.join(self.media, path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, 'wb') as f:
+            f.write(b'image')
+        if mtime is not None:
+            os.utime(full, (mtime, mtime))
+
+    def tokens(self):
+        return dict(MediaToken.objects.values_list('token', 'image'))
+
+    def test_media_token(self):
+        self.assertEqual(media_token('детям4 кровать модерн.jpg'), 'детям')
+        self.assertEqual(media_token('item_images/Диваны_угловые-2.PNG'), 'диваны')
+        self.assertEqual(media_token('Ёлка, новогодняя.webp'), 'ёлка')
+
+    def test_update_manifest(self):
+        self.write('item_images/диван угловой.jpg', 1000)
+        self.write('диван 2.png', 1000)
+        self.write('ковер.jpg', 1000)
+        self.write('notes.txt')
+        # resized copies are not pictures of their own
+        self.write('item_images/derivatives/кресло-320w.jpg')
+
+        self.assertEqual(update_manifest(), (3, 0))
+        # a top-level file represents its token, as the os.walk order did
+        self.assertEqual(self.tokens(), {'диван': 'диван 2.png', 'ковер': 'ковер.jpg'})
+        self.assertEqual(update_manifest(), (0, 0))
+
+        # a changed file is parsed again, a removed one drops out with its token
+        os.rename(os.path.join(self.media, 'ковер.jpg'), os.path.join(self.media, 'торшер.jpg'))
+        os.remove(os.path.join(self.media, 'диван 2.png'))
+        self.assertEqual(update_manifest(), (1, 2))
+        self.assertEqual(self.tokens(), {'диван': 'item_images/диван угловой.jpg', 'торшер': 'торшер.jpg'})
+        self.assertEqual(category_cards(), [
+            {'token': 'торшер', 'name': 'Торшер', 'image_url': '/media/торшер.jpg'},
+            {'token': 'диван', 'name': 'Диван', 'image_url': '/media/item_images/диван угловой.jpg'},
+        ])
+
+    def test_record_media_file(self):
+        self.write('item_images/стол.jpg', 1000)
+        record_media_file('item_images/стол.jpg')
+        self.assertEqual(self.tokens(), {'стол': 'item_images/стол.jpg'})
+        self.write('item_images/derivatives/стол-320w.jpg')
+        record_media_file('item_images/derivatives/стол-320w.jpg')
+        record_media_file('item_images/missing.jpg')
+        self.assertEqual(MediaFile.objects.count(), 1)
+
+        # the homepage cards come from the manifest
+        invalidate('media')
+        self.assertEqual(self.client.get(reverse('home')).context['category_cards'], category_cards())
+
+
+class DashboardQueryPlanTests(QueryPlanTestCase):
+
+    def test_home(self):
+        self.assertGetNoFullScan(reverse('home'))
+        self.assertGetNoFullScan(reverse('home'), {'q': 'диван'})
 
-# Create your tests here.
+    def test_dashboard(self):
+        seller = Item.objects.first().created_by
+        self.assertUsesIndex(Item.objects.filter(created_by=seller), 'item_seller_recent_idx')
+        self.client.force_login(seller)
+        self.assertGetNoFullScan(reverse('dashboard:index'))
@@ -2,12 +2,13 @@ from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login as auth_login
-from django.db.models import Q
+from django.db.models import OuterRef, Subquery
 
+from core.pagecache import cache_anonymous_page
 from item.models import Item, Category
-from django.conf import settings
-import os
-import re
+from item.search import search_items
+
+from . import media
 
 
 @login_required
@@ -19,6 +20,7 @@ def index(request):
     })
 
 
+@cache_anonymous_page('item', 'category', 'tag', 'media')
 def cozy_index(request):
     """Public homepage for Cozy YU. Supports search (?q=) and category (?category=).
 
@@ -28,42 +30,21 @@ def cozy_index(request):
     category_id = request.GET.get('category')
 
     categories = Category.objects.all()
-    # build category cards: prefer using MEDIA_ROOT filenames (user-provided images)
-    category_cards = []
-    media_root = getattr(settings, 'MEDIA_ROOT', None)
-    if media_root and os.path.isdir(media_root):
-        tokens = {}
-        for root, dirs, files in os.walk(media_root):
-            for fn in files:
-                if not fn.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.svg')):
-                    continue
-                name = os.path.splitext(fn)[0].lower()
-                # normalize: remove digits and punctuation, split on non-letters
-                cleaned = re.sub(r'[^\w\s\-а-яё]', ' ', name)
-                cleaned = re.sub(r'\d+', '', cleaned)
-                parts = re.split(r'[\s_\-]+', cleaned.strip())
-                if not parts:
-                    continue
-                key = parts[0]
-                rel = os.path.relpath(os.path.join(root, fn), media_root).replace('\\', '/')
-                url = settings.MEDIA_URL + rel
-                if key not in tokens:
-                    tokens[key] = url
-        for k, url in tokens.items():
-            label = k.capitalize()
-            category_cards.append({'token': k, 'name': label, 'image_url': url})
-    else:
-        # fallback to categories from DB with representative images
+    # build category cards: prefer user-provided images from the media manifest
+    # (kept up to date by `build_media_manifest` and on upload, see dashboard/media.py)
+    category_cards = media.category_cards()
+    if not category_cards:
+        # fallback to categories from DB with representative images (newest item image, one query)
+        rep_images = Item.objects.filter(category=OuterRef('pk'), image__isnull=False).exclude(image='').values('image')[:1]
+        categories = categories.annotate(rep_image=Subquery(rep_images))
+        storage = Item._meta.get_field('image').storage
         for cat in categories:
-            rep = cat.items.filter(image__isnull=False).first()
-            img_url = rep.image.url if rep and getattr(rep, 'image') else None
+            img_url = storage.url(cat.rep_image) if cat.rep_image else None
             category_cards.append({'token': str(cat.id), 'name': cat.name, 'image_url': img_url})
     # optimize queries: select_related for FK and prefetch tags to avoid N+1
     products_qs = Item.objects.filter(is_sold=False).select_related('category', 'created_by').prefetch_related('tags')
     if q:
-        products_qs = products_qs.filter(
-            Q(name__icontains=q) | Q(description__icontains=q) | Q(tags__name__icontains=q)
-        ).distinct()
+        products_qs = search_items(products_qs, q)
     if category_id:
         try:
             products_qs = products_qs.filter(category_id=int(category_id))
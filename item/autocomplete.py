@@ -0,0 +1,191 @@
+"""Search-as-you-type suggestions from an in-process prefix index.
+
+Item names, tag names and category names are kept in one sorted list of
+keys, one key per word start ("обеденный стол" is found by "обе" and by
+"сто"), so a lookup is a bisect plus a short scan and never touches the
+database. Suggestions are weighted by how many unsold items they lead to.
+
+The index is updated from the item signals after each commit and rebuilt
+in a background thread every `AUTOCOMPLETE_INDEX_MAX_AGE` seconds to pick
+up writes made by other processes; requests keep using the old index
+while the new one loads.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q
+
+from .models import Category, Item, Tag
+
+
+SUGGESTIONS_LIMIT = 8
+
+# matches looked at before ranking; bounds the work for one-letter prefixes
+SCAN_LIMIT = 300
+
+
+def normalize(text):
+    return ' '.join((text or '').lower().replace('ё', 'е').split())
+
+
+def _keys(label):
+    words = normalize(label).split(' ')
+    return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+class PrefixIndex:
+
+    def __init__(self):
+        self.keys = []      # sorted normalized keys
+        self.sources = []   # (kind, id) of each key, aligned with `keys`
+        self.entries = {}   # (kind, id) -> (label, weight)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls):
+        index = cls()
+        names = (
+            Item.objects.filter(is_sold=False)
+            .values('name').annotate(weight=Count('id')).values_list('name', 'weight')
+        )
+        rows = [(('item', name), name, weight) for name, weight in names]
+        rows += [(('tag', pk), name, weight) for pk, name, weight in index._tag_rows()]
+        rows += [(('category', pk), name, weight) for pk, name, weight in index._category_rows()]
+
+        pairs = []
+        for source, label, weight in rows:
+            index.entries[source] = (label, weight)
+            pairs.extend((key, source) for key in _keys(label))
+        pairs.sort(key=lambda pair: pair[0])
+        index.keys = [key for key, source in pairs]
+        index.sources = [source for key, source in pairs]
+        return index
+
+    @staticmethod
+    def _tag_rows(tag_ids=None):
+        tags = Tag.objects.all() if tag_ids is None else Tag.objects.filter(pk__in=tag_ids)
+        return tags.annotate(weight=Count('items', filter=Q(items__is_sold=False))).values_list('pk', 'name', 'weight')
+
+    @staticmethod
+    def _category_rows(category_ids=None):
+        categories = Category.objects.all() if category_ids is None else Category.objects.filter(pk__in=category_ids)
+        return categories.annotate(weight=Count('items', filter=Q(items__is_sold=False))).values_list('pk', 'name', 'weight')
+
+    def _set(self, source, label, weight):
+        old = self.entries.pop(source, None)
+        if old is not None:
+            for key in _keys(old[0]):
+                start = bisect_left(self.keys, key)
+                for i in range(start, len(self.keys)):
+                    if self.keys[i] != key:
+                        break
+                    if self.sources[i] == source:
+                        del self.keys[i], self.sources[i]
+                        break
+        if label is None:
+            return
+        self.entries[source] = (label, weight)
+        for key in _keys(label):
+            i = bisect_left(self.keys, key)
+            self.keys.insert(i, key)
+            self.sources.insert(i, source)
+
+    def update(self, names=(), tag_ids=(), category_ids=()):
+        """Reload the weights and labels of these item names, tags and categories."""
+        names, tag_ids, category_ids = set(names), set(tag_ids), set(category_ids)
+        rows = []
+        if names:
+            weights = dict(
+                Item.objects.filter(name__in=names, is_sold=False)
+                .values('name').annotate(weight=Count('id')).values_list('name', 'weight')
+            )
+            rows += [(('item', name), name, weights.get(name, 0)) for name in names]
+        if tag_ids:
+            found = {pk: (name, weight) for pk, name, weight in self._tag_rows(tag_ids)}
+            rows += [(('tag', pk),) + found.get(pk, (None, 0)) for pk in tag_ids]
+        if category_ids:
+            found = {pk: (name, weight) for pk, name, weight in self._category_rows(category_ids)}
+            rows += [(('category', pk),) + found.get(pk, (None, 0)) for pk in category_ids]
+
+        with self.lock:
+            for source, label, weight in rows:
+                # item names without unsold items lead nowhere, drop them
+                if source[0] == 'item' and not weight:
+                    label = None
+                self._set(source, label, weight)
+
+    def suggest(self, prefix, limit=SUGGESTIONS_LIMIT):
+        """Best (kind, id, label) matches for `prefix`, most items first."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self.lock:
+            start = bisect_left(self.keys, prefix)
+            found = {}
+            for i in range(start, min(start + SCAN_LIMIT, len(self.keys))):
+                if not self.keys[i].startswith(prefix):
+                    break
+                source = self.sources[i]
+                found[source] = self.entries[source]
+        ranked = sorted(found.items(), key=lambda entry: (-entry[1][1], entry[1][0]))
+        return [(kind, pk, label) for (kind, pk), (label, weight) in ranked[:limit]]
+
+
+_index = None
+_index_loaded_at = 0
+_index_lock = threading.Lock()
+_reloading = False
+
+
+def _reload():
+    global _index, _index_loaded_at, _reloading
+    try:
+        index = PrefixIndex.load()
+        with _index_lock:
+            _index, _index_loaded_at = index, time.monotonic()
+    finally:
+        _reloading = False
+
+
+def _background_reload():
+    try:
+        _reload()
+    finally:
+        connection.close()
+
+
+def get_index():
+    """The loaded index; only the very first call waits for the database."""
+    global _reloading
+    max_age = getattr(settings, 'AUTOCOMPLETE_INDEX_MAX_AGE', 300)
+    with _index_lock:
+        if _index is not None:
+            if time.monotonic() - _index_loaded_at > max_age and not _reloading:
+                _reloading = True
+                threading.Thread(target=_background_reload, daemon=True).start()
+            return _index
+    _reload()
+    return _index
+
+
+_pending = threading.local()
+
+
+def schedule_autocomplete_update(names=(), tag_ids=(), category_ids=()):
+    """Update the loaded index for these sources once the current transaction commits."""
+    if not hasattr(_pending, 'names'):
+        _pending.names, _pending.tag_ids, _pending.category_ids = set(), set(), set()
+    _pending.names.update(name for name in names if name)
+    _pending.tag_ids.update(tag_ids)
+    _pending.category_ids.update(pk for pk in category_ids if pk)
+    transaction.on_commit(_flush_autocomplete_updates)
+
+
+def _flush_autocomplete_updates():
+    names, tag_ids, category_ids = _pending.names, _pending.tag_ids, _pending.category_ids
+    _pending.names, _pending.tag_ids, _pending.category_ids = set(), set(), set()
+    if _index is not None and (names or tag_ids or category_ids):
+        _index.update(names, tag_ids, category_ids)
@@ -0,0 +1,240 @@
+"""Shopping carts kept in their own table instead of the session.
+
+A cart is a small {item id: quantity} dict stored in a `StoredCart` row
+under a random id that the visitor carries in a signed cookie, so reading
+a cart is one query by primary key and saving it one upsert: no session
+row is saved and pages without a cart cookie stay cacheable
+(core/pagecache.py). Carts untouched for `CART_TIMEOUT` (30 days by
+default) are ignored and removed by `manage.py clear_expired_carts`. A
+cart still kept in the session, as before the table, is carried over
+the first time the visitor opens or changes their cart. The JSON endpoint
+`item:cart_api` applies several line changes in one request and answers
+with the new totals.
+
+Prices are worked out by the database: one query returns the cart's
+items with their line subtotals and the cart total. The result is cached
+as a snapshot next to the cart and reused until the cart's lines change
+or one of its items changes price, sells or is deleted; each item has a
+price version for that, bumped from item/signals.py. Snapshots and
+versions go in the `carts` cache, kept apart from the page cache; losing
+them only means pricing a cart again.
+"""
+import secrets
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Case, F, FloatField, IntegerField, Sum, Value, When, Window
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core.metrics import count_cache
+
+from .models import Item, StoredCart
+
+
+CART_COOKIE = 'cart'
+CART_COOKIE_SALT = 'item.cart'
+
+# alias in CACHES of the cache holding the priced snapshots
+CART_CACHE = 'carts'
+
+# where carts were kept before StoredCart
+SESSION_KEY = 'cart'
+
+# most units of one item a cart may hold
+MAX_QTY = 99
+
+# what the cart page and API show of an item
+PRICED_FIELDS = ('id', 'name', 'price_tg', 'image', 'image_variants', 'is_sold')
+
+
+def _cache():
+    return caches[CART_CACHE]
+
+
+def _timeout():
+    return getattr(settings, 'CART_TIMEOUT', 60 * 60 * 24 * 30)
+
+
+class Cart:
+    """The visitor's cart; `lines` are loaded on first use."""
+
+    def __init__(self, request):
+        self.request = request
+        self.cart_id = request.get_signed_cookie(CART_COOKIE, None, salt=CART_COOKIE_SALT)
+        self.carried_over = False
+        self._lines = None
+
+    @property
+    def id(self):
+        if self.cart_id is None:
+            # a new cart; `save` hands the id to the visitor
+            self.cart_id = secrets.token_urlsafe(16)
+        return self.cart_id
+
+    @property
+    def key(self):
+        return f'cart:{self.id}'
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            if self.cart_id:
+                cutoff = timezone.now() - timedelta(seconds=_timeout())
+                stored = StoredCart.objects.filter(pk=self.cart_id, updated_at__gte=cutoff).values_list('lines', flat=True)
+                self._lines = stored.first() or {}
+            else:
+                self._lines = self._session_lines()
+        return self._lines
+
+    def _session_lines(self):
+        # only a visitor with a session cookie can have a cart in the session
+        if settings.SESSION_COOKIE_NAME not in self.request.COOKIES:
+            return {}
+        lines = {}
+        for pk, qty in (self.request.session.get(SESSION_KEY) or {}).items():
+            try:
+                if int(qty) > 0:
+                    lines[str(int(pk))] = min(int(qty), MAX_QTY)
+            except (TypeError, ValueError):
+                pass
+        self.carried_over = bool(lines)
+        return lines
+
+    def __len__(self):
+        return len(self.lines)
+
+    def set(self, item_id, qty):
+        qty = min(int(qty), MAX_QTY)
+        if qty <= 0:
+            self.lines.pop(str(item_id), None)
+        else:
+            self.lines[str(item_id)] = qty
+
+    def add(self, item_id, qty=1):
+        self.set(item_id, self.lines.get(str(item_id), 0) + int(qty))
+
+    def apply(self, changes):
+        """Apply [{'item': id, 'qty': n} or {'item': id, 'add': n}, ...] in order.
+
+        Items that are not in the catalog can only be removed. Raises
+        ValueError on malformed changes, leaving the cart untouched.
+        """
+        try:
+            changes = [
+                (int(change['item']), 'qty' in change, int(change['qty'] if 'qty' in change else change.get('add', 1)))
+                for change in changes
+            ]
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            raise ValueError(f'Malformed cart change: {e}')
+        known = set(Item.objects.filter(pk__in=[item_id for item_id, is_set, qty in changes]).values_list('pk', flat=True))
+        for item_id, is_set, qty in changes:
+            if item_id not in known:
+                self.lines.pop(str(item_id), None)
+            elif is_set:
+                self.set(item_id, qty)
+            else:
+                self.add(item_id, qty)
+
+    def save(self, response):
+        """Store the cart and keep the visitor's cookie in step with it."""
+        if self.carried_over:
+            self.request.session.pop(SESSION_KEY, None)
+            self.carried_over = False
+        if not self.lines:
+            if self.cart_id:
+                StoredCart.objects.filter(pk=self.cart_id).delete()
+                _cache().delete(self.key + ':priced')
+                response.delete_cookie(CART_COOKIE)
+            return
+        StoredCart.objects.bulk_create(
+            [StoredCart(id=self.id, lines=self.lines, updated_at=timezone.now())],
+            update_conflicts=True, unique_fields=['id'], update_fields=['lines', 'updated_at'],
+        )
+        response.set_signed_cookie(
+            CART_COOKIE, self.cart_id, salt=CART_COOKIE_SALT,
+            max_age=_timeout(), httponly=True, samesite='Lax',
+        )
+
+    def rows(self):
+        """([{'item', 'qty', 'subtotal'}], total, ids of lines whose item is gone).
+
+        Sold items stay in the rows with a subtotal of 0.
+        """
+        if not self.lines:
+            return [], 0, []
+        # read before pricing: a change made meanwhile leaves the new snapshot stale
+        versions = price_versions(self.lines)
+        snapshot = _cache().get(self.key + ':priced')
+        stale = snapshot is None or snapshot['lines'] != self.lines or snapshot['versions'] != versions
+        count_cache('cart_prices', not stale)
+        if stale:
+            rows, total = price_lines(self.lines)
+            snapshot = {'lines': dict(self.lines), 'versions': versions, 'rows': rows, 'total': total}
+            _cache().set(self.key + ':priced', snapshot, _timeout())
+        found = {str(row['item'].pk) for row in snapshot['rows']}
+        return snapshot['rows'], snapshot['total'], [pk for pk in self.lines if pk not in found]
+
+
+def get_cart(request):
+    """The request's cart, one per request, so the view and its templates read it once."""
+    if not hasattr(request, '_cart'):
+        request._cart = Cart(request)
+    return request._cart
+
+
+def price_lines(lines):
+    """Rows and total of the {item id: qty} `lines`, in the order of `lines`, from one query."""
+    qty = Case(*[When(pk=int(pk), then=Value(qty)) for pk, qty in lines.items()], output_field=IntegerField())
+    subtotal = Case(
+        When(is_sold=False, then=Coalesce(F('price_tg'), Value(0.0)) * qty),
+        default=Value(0.0), output_field=FloatField(),
+    )
+    items = (
+        Item.objects.filter(pk__in=[int(pk) for pk in lines])
+        .only(*PRICED_FIELDS)
+        .annotate(qty=qty, subtotal=subtotal, total=Window(Sum(subtotal)))
+        .order_by()
+    )
+    position = {int(pk): i for i, pk in enumerate(lines)}
+    items = sorted(items, key=lambda item: position[item.pk])
+    rows = [{'item': item, 'qty': item.qty, 'subtotal': item.subtotal} for item in items]
+    return rows, items[0].total if items else 0
+
+
+def _price_key(item_id):
+    return f'cart:price:{item_id}'
+
+
+def price_versions(item_ids):
+    keys = {_price_key(pk): str(pk) for pk in item_ids}
+    found = _cache().get_many(list(keys))
+    # an item not repriced lately has no version: 0, without a write per item.
+    # A version is set after the snapshots it outdates and expires after them,
+    # so a snapshot taken at 0 is gone before its item can read 0 again
+    return {pk: found.get(key, 0) for key, pk in keys.items()}
+
+
+def reprice(item_ids):
+    """Make every cached cart snapshot holding one of these items stale."""
+    version = time.time_ns()
+    _cache().set_many({_price_key(pk): version for pk in item_ids}, _timeout())
+
+
+def schedule_reprice(item_ids):
+    item_ids = list(item_ids)
+    transaction.on_commit(lambda: reprice(item_ids))
+
+
+def clear_expired():
+    """Delete the carts untouched for `CART_TIMEOUT`; returns how many."""
+    cutoff = timezone.now() - timedelta(seconds=_timeout())
+    return StoredCart.objects.filter(updated_at__lt=cutoff).delete()[0]
+
+
+def has_cart(request):
+    """Whether the request carries a cart cookie (without reading the cart)."""
+    return bool(request.COOKIES.get(CART_COOKIE))
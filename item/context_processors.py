@@ -0,0 +1,6 @@
+from .cart import get_cart
+
+
+def cart(request):
+    # the cart is only read from the cache if a template uses it
+    return {'cart': get_cart(request)}
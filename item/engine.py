@@ -0,0 +1,345 @@
+"""Vectorized scoring for the complementary-item recommender.
+
+The catalog is kept as column arrays so a base item can be scored against
+every candidate in one batched NumPy pass. The rules are the same as
+`recommendations.score_pair`; only the evaluation strategy differs.
+"""
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # recommendations.py falls back to the pure-Python scorer
+    np = None
+
+from django.conf import settings
+
+from .models import Category, Item, RelatedItem
+from .recommendations import COMPLEMENTARY, RELATED_ITEMS_LIMIT, SIZE_PREF, color_compat_score
+
+
+def _popcount(words):
+    """Number of set bits in each element of a uint64 array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    # NumPy < 2.0: classic SWAR bit count, still one vectorized pass per step
+    words = words - ((words >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    words = (words & np.uint64(0x3333333333333333)) + ((words >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    words = (words + (words >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (words * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+def _size_score(a, b):
+    if not a or not b:
+        return 0
+    return SIZE_PREF.get((a, b), 0)
+
+
+class CatalogEngine:
+    """Every item as column arrays, oldest first.
+
+    Rows are ordered by (created_at, id), so a higher row index means a newer
+    item; this is the tie-break the detail page has always used for equal
+    scores. Sold and deleted items keep their row with `live` cleared: they
+    still have a list of their own but are never recommended. Strings are
+    stored as small integer codes into per-column vocabularies, and tags as
+    one bit per tag in `tags`, stored word-major (one contiguous uint64 row
+    per 64 tags) so each word is a single pass.
+
+    `floor_score`/`floor_pos` describe the last entry of each stored list and
+    `indexed` whether a list was stored at all; they let `entering` tell
+    which lists a changed item now belongs to without reading them.
+    """
+
+    def __init__(self, categories, rows, item_tags, floors=(), indexed=()):
+        # held by callers that mutate the engine while requests may be reading it
+        self.lock = threading.RLock()
+        self.categories = []
+        self.category_codes = {}
+        for pk, name in categories:
+            self._add_category(pk, name)
+
+        # code 0 is reserved for "no value" in every string column
+        self.styles = {'': 0}
+        self.colors = {'': 0}
+        self.sizes = {'': 0}
+        self.tag_bits = {tag_id: bit for bit, tag_id in enumerate(sorted({t for tags in item_tags.values() for t in tags}))}
+        self._tables = {}
+
+        n = len(rows)
+        words = max(1, (len(self.tag_bits) + 63) // 64)
+        self.ids = np.empty(n, dtype=np.int64)
+        self.category = np.empty(n, dtype=np.int32)
+        self.style = np.empty(n, dtype=np.int16)
+        self.color = np.empty(n, dtype=np.int16)
+        self.size = np.empty(n, dtype=np.int16)
+        self.price = np.empty(n, dtype=np.float64)
+        self.live = np.empty(n, dtype=bool)
+        self.tags = np.zeros((words, n), dtype=np.uint64)
+        self.positions = {}
+
+        for pos, (pk, category_id, style, color, size, price, is_sold) in enumerate(rows):
+            self.positions[pk] = pos
+            self.ids[pos] = pk
+            self._set_row(pos, category_id, style, color, size, price, is_sold, item_tags.get(pk, ()))
+
+        self.floor_score = np.zeros(n, dtype=np.int32)
+        self.floor_pos = np.full(n, -1, dtype=np.int64)
+        self.indexed = np.zeros(n, dtype=bool)
+        for pk in indexed:
+            if pk in self.positions:
+                self.indexed[self.positions[pk]] = True
+        for pk, score, related_id in floors:
+            if pk in self.positions:
+                self.floor_score[self.positions[pk]] = score
+                self.floor_pos[self.positions[pk]] = self.positions.get(related_id, -1)
+
+    @classmethod
+    def load(cls):
+        categories = list(Category.objects.order_by('id').values_list('id', 'name'))
+        rows = list(
+            Item.objects.order_by('created_at', 'id')
+            .values_list('id', 'category_id', 'style', 'color', 'size_category', 'price_tg', 'is_sold')
+        )
+        item_tags = {}
+        for item_id, tag_id in Item.tags.through.objects.values_list('item_id', 'tag_id'):
+            item_tags.setdefault(item_id, []).append(tag_id)
+        floors = RelatedItem.objects.filter(rank=RELATED_ITEMS_LIMIT - 1).values_list('item_id', 'score', 'related_id')
+        indexed = RelatedItem.objects.filter(rank=0).values_list('item_id', flat=True)
+        return cls(categories, rows, item_tags, floors, indexed)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _code(vocabulary, value):
+        if value not in vocabulary:
+            vocabulary[value] = len(vocabulary)
+        return vocabulary[value]
+
+    def _add_category(self, pk, name):
+        # comp[a, b] is True when category b complements category a
+        self.category_codes[pk] = len(self.categories)
+        self.categories.append(name)
+        names = self.categories
+        self.comp = np.array(
+            [[b in COMPLEMENTARY.get(a, []) for b in names] for a in names], dtype=bool,
+        )
+
+    def _category_code(self, item):
+        if item.category_id not in self.category_codes:
+            self._add_category(item.category_id, item.category.name)
+        return self.category_codes[item.category_id]
+
+    def _mask(self, tag_ids, grow=False):
+        """Tag bitmask, one uint64 per word; unknown tags are ignored unless `grow`."""
+        if grow:
+            for tag_id in tag_ids:
+                self._code(self.tag_bits, tag_id)
+            words = max(1, (len(self.tag_bits) + 63) // 64)
+            if words > len(self.tags):
+                extra = np.zeros((words - len(self.tags), len(self)), dtype=np.uint64)
+                self.tags = np.concatenate([self.tags, extra])
+
+        mask = np.zeros(len(self.tags), dtype=np.uint64)
+        for tag_id in tag_ids:
+            bit = self.tag_bits.get(tag_id)
+            if bit is not None:
+                mask[bit // 64] |= np.uint64(1) << np.uint64(bit % 64)
+        return mask
+
+    def _table(self, name, vocabulary, func):
+        """`func` over every pair of codes of `vocabulary`, rebuilt when it grows."""
+        table = self._tables.get(name)
+        if table is None or len(table) != len(vocabulary):
+            values = sorted(vocabulary, key=vocabulary.get)
+            table = np.array([[func(a, b) for b in values] for a in values], dtype=np.int32)
+            self._tables[name] = table
+        return table
+
+    def _set_row(self, pos, category_id, style, color, size, price, is_sold, tag_ids):
+        self.category[pos] = self.category_codes[category_id]
+        self.style[pos] = self._code(self.styles, style or '')
+        self.color[pos] = self._code(self.colors, (color or '').lower())
+        self.size[pos] = self._code(self.sizes, size or '')
+        self.price[pos] = price or 0
+        self.live[pos] = not is_sold
+        self.tags[:, pos] = self._mask(tag_ids)
+
+    def _row(self, pos):
+        return {
+            'category': self.category[pos],
+            'style': self.style[pos],
+            'color': self.color[pos],
+            'size': self.size[pos],
+            'price': self.price[pos],
+            'tags': self.tags[:, pos],
+        }
+
+    def _columns(self):
+        return {
+            'category': self.category,
+            'style': self.style,
+            'color': self.color,
+            'size': self.size,
+            'price': self.price,
+            'tags': self.tags,
+        }
+
+    def _score(self, base, cand):
+        """Score `cand` as a complement of `base`.
+
+        One side holds scalars (a single item) and the other whole columns,
+        so this scores one base against every candidate or every base against
+        one candidate with the same code.
+        """
+        in_comp = self.comp[base['category'], cand['category']]
+
+        # complementary category bonus
+        score = in_comp.astype(np.int32) * 40
+
+        # style match
+        score += ((base['style'] == cand['style']) & (base['style'] != 0)) * 20
+
+        # shared tags: skip words where the single item has no tags at all
+        for base_word, cand_word in zip(base['tags'], cand['tags']):
+            if (np.ndim(base_word) == 0 and not base_word) or (np.ndim(cand_word) == 0 and not cand_word):
+                continue
+            score += _popcount(base_word & cand_word).astype(np.int32) * 8
+
+        # color compatibility
+        score += self._table('color', self.colors, color_compat_score)[base['color'], cand['color']]
+
+        # size compatibility
+        score += self._table('size', self.sizes, _size_score)[base['size'], cand['size']]
+
+        # price proximity
+        base_price = base['price']
+        diff = np.abs(cand['price'] - base_price)
+        priced = (cand['price'] != 0) & (base_price > 0)
+        near = priced & (diff < np.maximum(1, base_price * 0.1))
+        close = priced & ~near & (diff < np.maximum(1, base_price * 0.25))
+        score += near * 8 + close * 4
+
+        # minor boost if different category (but not complementary)
+        score += ((base['category'] != cand['category']) & ~in_comp) * 5
+
+        return score
+
+    def score(self, item, tag_ids):
+        """Scores of `item` against every row, aligned with `self.ids`."""
+        base = {
+            'category': self._category_code(item),
+            'style': self._code(self.styles, item.style or ''),
+            'color': self._code(self.colors, (item.color or '').lower()),
+            'size': self._code(self.sizes, item.size_category or ''),
+            'price': float(item.price_tg or 0),
+            'tags': self._mask(tag_ids),
+        }
+        return self._score(base, self._columns())
+
+    def _top(self, score, exclude, limit):
+        score = np.where(self.live, score, 0)
+        if exclude is not None:
+            score[exclude] = 0
+
+        # fold the recency tie-break into one integer key: newer rows win equal scores
+        n = len(self)
+        key = np.where(score > 0, score.astype(np.int64) * (n + 1) + np.arange(n), -1)
+        if n > limit:
+            top = np.argpartition(key, n - limit)[n - limit:]
+        else:
+            top = np.arange(n)
+        top = top[np.argsort(key[top])[::-1]]
+        return [(int(score[i]), int(self.ids[i])) for i in top if key[i] >= 0]
+
+    def top_related(self, item, tag_ids, limit):
+        """The best `limit` live rows for `item` as (score, item id) pairs, best first."""
+        return self._top(self.score(item, tag_ids), self.positions.get(item.id), limit)
+
+    def top_related_for(self, pk, limit):
+        """Like `top_related`, for an item already loaded in the engine."""
+        pos = self.positions[pk]
+        return self._top(self._score(self._row(pos), self._columns()), pos, limit)
+
+    def upsert(self, item, tag_ids):
+        """Load the current state of `item` (category loaded) into its row."""
+        self._category_code(item)
+        tag_ids = list(tag_ids)
+        self._mask(tag_ids, grow=True)
+        pos = self.positions.get(item.id)
+        if pos is None:
+            # new items are the newest, so they go last
+            pos = len(self)
+            self.positions[item.id] = pos
+            self.ids = np.append(self.ids, item.id)
+            self.category = np.append(self.category, np.int32(0))
+            self.style = np.append(self.style, np.int16(0))
+            self.color = np.append(self.color, np.int16(0))
+            self.size = np.append(self.size, np.int16(0))
+            self.price = np.append(self.price, 0.0)
+            self.live = np.append(self.live, False)
+            self.tags = np.concatenate([self.tags, np.zeros((len(self.tags), 1), dtype=np.uint64)], axis=1)
+            self.floor_score = np.append(self.floor_score, np.int32(0))
+            self.floor_pos = np.append(self.floor_pos, -1)
+            self.indexed = np.append(self.indexed, False)
+        self._set_row(pos, item.category_id, item.style, item.color, item.size_category,
+                      item.price_tg, item.is_sold, tag_ids)
+
+    def remove(self, pk):
+        pos = self.positions.get(pk)
+        if pos is not None:
+            self.live[pos] = False
+            self.indexed[pos] = False
+
+    def entering(self, pk):
+        """Items whose stored list `pk` now belongs in, as (item id, score) pairs.
+
+        A list admits the item when it is not full yet or when the item beats
+        its last entry (a higher score, or an equal score and newer).
+        """
+        pos = self.positions.get(pk)
+        if pos is None or not self.live[pos]:
+            return []
+        score = self._score(self._columns(), self._row(pos))
+        full = self.floor_pos >= 0
+        beats = (score > self.floor_score) | ((score == self.floor_score) & (pos > self.floor_pos))
+        hits = np.flatnonzero(self.indexed & (score > 0) & (~full | beats))
+        return [(int(self.ids[i]), int(score[i])) for i in hits if i != pos]
+
+    def stored(self, pk, scored, limit):
+        """Record the list just stored for `pk` so `entering` stays accurate."""
+        pos = self.positions.get(pk)
+        if pos is None:
+            return
+        self.indexed[pos] = True
+        if len(scored) >= limit:
+            score, related_id = scored[limit - 1]
+            self.floor_score[pos] = score
+            self.floor_pos[pos] = self.positions.get(related_id, -1)
+        else:
+            self.floor_score[pos] = 0
+            self.floor_pos[pos] = -1
+
+
+_engine = None
+_engine_loaded_at = 0
+_engine_lock = threading.RLock()
+
+
+def get_engine():
+    """The engine of the `process_related_updates` worker, or None without NumPy.
+
+    Queued changes keep it current; it is reloaded once it is older than
+    `RELATED_ENGINE_MAX_AGE` seconds to pick up what bypassed the queue
+    (bulk imports, `build_related_items`). Requests never load it.
+    """
+    global _engine, _engine_loaded_at
+    if np is None:
+        return None
+    max_age = getattr(settings, 'RELATED_ENGINE_MAX_AGE', 300)
+    with _engine_lock:
+        if _engine is None or time.monotonic() - _engine_loaded_at > max_age:
+            _engine = CatalogEngine.load()
+            _engine_loaded_at = time.monotonic()
+        return _engine
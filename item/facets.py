@@ -0,0 +1,254 @@
+"""Faceted filtering for the catalog page.
+
+Facet counts come from an in-process bitmap index instead of a COUNT ...
+GROUP BY per request: every facet value owns a bitmap of unsold item ids
+(a Python int, bit N set for item N), so counting a drill-down is a few
+ANDs and popcounts. The index is kept current by the item signals and
+reloaded after `FACET_INDEX_MAX_AGE` seconds to pick up writes made by
+other processes.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Category, Item, Tag
+
+
+# (GET parameter, model field) for every facet, in display order
+FACETS = (
+    ('category', 'category_id'),
+    ('style', 'style'),
+    ('color', 'color'),
+    ('size', 'size_category'),
+    ('age', 'age_group'),
+    ('tag', 'tags'),
+    ('price', 'price_tg'),
+)
+
+FACET_LABELS = {
+    'category': 'Categories',
+    'style': 'Style',
+    'color': 'Color',
+    'size': 'Size',
+    'age': 'Age',
+    'tag': 'Tags',
+    'price': 'Price',
+}
+
+# (value, label, lower bound exclusive, upper bound inclusive) in KZT
+PRICE_BANDS = (
+    ('cheap', 'Up to 50 000 ₸', None, 50000),
+    ('medium', '50 000 – 200 000 ₸', 50000, 200000),
+    ('expensive', 'Over 200 000 ₸', 200000, None),
+)
+PRICE_BAND_VALUES = [band[0] for band in PRICE_BANDS]
+
+
+def price_band(price):
+    for value, label, low, high in PRICE_BANDS:
+        if (low is None or price > low) and (high is None or price <= high):
+            return value
+
+
+def _bitmap(ids):
+    if not ids:
+        return 0
+    bits = bytearray(max(ids) // 8 + 1)
+    for pk in ids:
+        bits[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(bits, 'little')
+
+
+class FacetIndex:
+
+    def __init__(self, rows, item_tags):
+        """`rows` are (id, category id, style, color, size, age, price) of unsold items."""
+        members = {param: {} for param, field in FACETS}
+        for pk, category_id, style, color, size, age, price in rows:
+            for param, value in self._values(category_id, style, color, size, age, price, item_tags.get(pk, ())):
+                members[param].setdefault(value, []).append(pk)
+
+        self.bitmaps = {
+            param: {value: _bitmap(ids) for value, ids in values.items()}
+            for param, values in members.items()
+        }
+        self.all = _bitmap([row[0] for row in rows])
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls):
+        rows = list(
+            Item.objects.filter(is_sold=False)
+            .values_list('id', 'category_id', 'style', 'color', 'size_category', 'age_group', 'price_tg')
+        )
+        item_tags = {}
+        through = Item.tags.through.objects.filter(item__is_sold=False).values_list('item_id', 'tag_id')
+        for item_id, tag_id in through:
+            item_tags.setdefault(item_id, []).append(tag_id)
+        return cls(rows, item_tags)
+
+    @staticmethod
+    def _values(category_id, style, color, size, age, price, tag_ids):
+        yield 'category', str(category_id)
+        for param, value in (('style', style), ('color', color), ('size', size), ('age', age)):
+            if value:
+                yield param, value
+        for tag_id in tag_ids:
+            yield 'tag', str(tag_id)
+        yield 'price', price_band(price or 0)
+
+    def update(self, item_ids):
+        """Reload the bits of `item_ids` (sold and deleted items simply drop out)."""
+        rows = list(
+            Item.objects.filter(pk__in=item_ids, is_sold=False)
+            .values_list('id', 'category_id', 'style', 'color', 'size_category', 'age_group', 'price_tg')
+        )
+        item_tags = {}
+        for item_id, tag_id in Item.tags.through.objects.filter(item_id__in=item_ids).values_list('item_id', 'tag_id'):
+            item_tags.setdefault(item_id, []).append(tag_id)
+
+        clear = ~_bitmap(list(item_ids))
+        with self.lock:
+            for values in self.bitmaps.values():
+                for value in values:
+                    values[value] &= clear
+            self.all &= clear
+            for pk, category_id, style, color, size, age, price in rows:
+                bit = 1 << pk
+                self.all |= bit
+                for param, value in self._values(category_id, style, color, size, age, price, item_tags.get(pk, ())):
+                    values = self.bitmaps[param]
+                    values[value] = values.get(value, 0) | bit
+
+    def _selected(self, param, values):
+        bitmap = 0
+        for value in values:
+            bitmap |= self.bitmaps[param].get(value, 0)
+        return bitmap
+
+    def counts(self, selection, base=None):
+        """Count of matching items per facet value.
+
+        Values of one facet are OR-ed and facets AND-ed, and each facet is
+        counted against the other facets' selections only, so picking
+        "modern" still shows how many "loft" items there are. `base`
+        optionally restricts everything further (e.g. text search hits).
+        """
+        with self.lock:
+            scope = self.all if base is None else self.all & base
+            selected = {param: self._selected(param, values) for param, values in selection.items() if values}
+            result = {}
+            for param, field in FACETS:
+                mask = scope
+                for other, bitmap in selected.items():
+                    if other != param:
+                        mask &= bitmap
+                result[param] = {
+                    value: count
+                    for value, count in ((value, (mask & bitmap).bit_count()) for value, bitmap in self.bitmaps[param].items())
+                    if count
+                }
+            return result
+
+
+_index = None
+_index_loaded_at = 0
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index, _index_loaded_at
+    max_age = getattr(settings, 'FACET_INDEX_MAX_AGE', 60)
+    with _index_lock:
+        if _index is None or time.monotonic() - _index_loaded_at > max_age:
+            _index = FacetIndex.load()
+            _index_loaded_at = time.monotonic()
+        return _index
+
+
+def schedule_facet_update(item_ids):
+    """Update the loaded index once the current transaction commits."""
+    item_ids = list(item_ids)
+
+    def update():
+        if _index is not None:
+            _index.update(item_ids)
+
+    transaction.on_commit(update)
+
+
+def selection_from(params):
+    """Selected facet values from the request's GET parameters."""
+    selection = {}
+    for param, field in FACETS:
+        values = [value for value in params.getlist(param) if value]
+        if param in ('category', 'tag'):
+            values = [value for value in values if value.isdigit()]
+        elif param == 'price':
+            values = [value for value in values if value in PRICE_BAND_VALUES]
+        selection[param] = values
+    return selection
+
+
+def filter_items(queryset, selection):
+    """Apply a facet selection to an `Item` queryset."""
+    for param, field in FACETS:
+        values = selection.get(param)
+        if not values:
+            continue
+        if param == 'price':
+            bands = Q()
+            for value, label, low, high in PRICE_BANDS:
+                if value in values:
+                    band = Q()
+                    if low is not None:
+                        band &= Q(price_tg__gt=low)
+                    if high is not None:
+                        band &= Q(price_tg__lte=high)
+                    bands |= band
+            queryset = queryset.filter(bands) if bands else queryset.none()
+        elif param == 'tag':
+            queryset = queryset.filter(tags__in=values).distinct()
+        else:
+            queryset = queryset.filter(**{f'{field}__in': values})
+    return queryset
+
+
+def facet_groups(selection, base_ids=None):
+    """Facets for the template: label, GET parameter and values with counts.
+
+    `base_ids` restricts the counts to these items, e.g. text search hits.
+    """
+    base = None if base_ids is None else _bitmap(list(base_ids))
+    counts = get_index().counts(selection, base)
+    labels = {
+        'category': {str(pk): name for pk, name in Category.objects.values_list('pk', 'name')},
+        'style': dict(Item.STYLE_CHOICES),
+        'size': dict(Item.SIZE_CHOICES),
+        'age': dict(Item.AGE_CHOICES),
+        'tag': {str(pk): name for pk, name in Tag.objects.filter(pk__in=list(counts['tag'])).values_list('pk', 'name')},
+        'price': {value: label for value, label, low, high in PRICE_BANDS},
+    }
+    groups = []
+    for param, field in FACETS:
+        # keep selected values visible (with 0) so they can be unticked
+        for value in selection.get(param, ()):
+            counts[param].setdefault(value, 0)
+        values = [
+            {
+                'value': value,
+                'label': labels.get(param, {}).get(value, value),
+                'count': count,
+                'selected': value in selection.get(param, ()),
+            }
+            for value, count in counts[param].items()
+        ]
+        if param == 'price':
+            values.sort(key=lambda v: PRICE_BAND_VALUES.index(v['value']))
+        else:
+            values.sort(key=lambda v: (-v['count'], str(v['label'])))
+        groups.append({'param': param, 'label': FACET_LABELS[param], 'values': values})
+    return groups
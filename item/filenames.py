@@ -0,0 +1,144 @@
+"""Item attributes encoded in media file names.
+
+Photos are named like "диван1 неоклассик красный.jpg" or
+"детям4 кровать модерн зеленый.jpg": a furniture word, a style, a color
+and "детям" for children's furniture. `parse_filename` maps those words
+to the values used on `Item` by their Russian stems (item/stemmer.py):
+furniture and style words also match longer forms of the stem ("диваны",
+"столик", "модерновый"), colors and "детям" any inflection ("красная"), and `ImageIndex` files every image under
+each combination of attributes once, so finding the best-fitting image
+for an item is a few dictionary lookups instead of a scan of all files.
+"""
+import os
+import random
+import re
+
+from .models import Item
+from .stemmer import stem
+
+
+# furniture words in file names, per category name
+CATEGORY_KEYWORDS = {
+    'Диваны и кресла': ['диван', 'кресло', 'кресла', 'секция'],
+    'Ковры и текстиль': ['ковер', 'ковры', 'плед', 'подушка'],
+    'Столы и стулья': ['стол', 'стулья', 'стул'],
+    'Шкафы и стеллажи': ['шкаф', 'стелаж', 'стеллаж', 'тумбочка', 'комод'],
+    'Кровати и матрасы': ['кровать', 'матрас'],
+    'Освещение': ['лампа', 'светильник', 'торшер', 'люстра'],
+    'Декор': ['картина', 'ваза', 'полка', 'декор'],
+}
+
+STYLE_WORDS = {
+    'модерн': 'modern',
+    'модер': 'modern',
+    'классик': 'classic',
+    'классика': 'classic',
+    'неоклассик': 'classic',
+    'неоклассика': 'classic',
+    'аристократ': 'classic',
+    'рустик': 'ethnic',
+    'стандарт': 'minimal',
+}
+STYLE_WORDS.update({value: value for value, label in Item.STYLE_CHOICES})
+
+COLOR_WORDS = {
+    'белый': 'white',
+    'черный': 'black',
+    'серый': 'gray',
+    'бежевый': 'beige',
+    'коричневый': 'brown',
+    'оранжевый': 'orange',
+    'желтый': 'yellow',
+    'жертый': 'yellow',
+    'зеленый': 'green',
+    'синий': 'blue',
+    'голубой': 'blue',
+    'красный': 'red',
+    'бордовый': 'red',
+    'розовый': 'red',
+}
+COLOR_WORDS.update({value: value for value in set(COLOR_WORDS.values())})
+
+KID_WORDS = {'детям', 'детский', 'детская', 'kid', 'kids'}
+
+CATEGORY_WORDS = {word: category for category, words in CATEGORY_KEYWORDS.items() for word in words}
+
+# (stem, value), longest first so "стеллаж" wins over a shorter stem it starts with
+CATEGORY_STEMS = sorted({(stem(word), category) for word, category in CATEGORY_WORDS.items()}, key=lambda pair: -len(pair[0]))
+STYLE_STEMS = sorted({(stem(word), style) for word, style in STYLE_WORDS.items()}, key=lambda pair: -len(pair[0]))
+COLOR_STEMS = {stem(word): color for word, color in COLOR_WORDS.items()}
+KID_STEMS = {stem(word) for word in KID_WORDS}
+
+# attribute combinations tried from the best fit down; the category matters most
+MATCH_ORDER = (
+    ('category', 'style', 'color', 'age'),
+    ('category', 'style', 'color'),
+    ('category', 'style', 'age'),
+    ('category', 'color', 'age'),
+    ('category', 'style'),
+    ('category', 'color'),
+    ('category', 'age'),
+    ('category',),
+    ('style', 'color'),
+    ('style',),
+    ('color',),
+    (),
+)
+
+WORD_RE = re.compile(r'[^\W\d_]+')
+
+
+def _prefixed(word_stem, stems):
+    for prefix, value in stems:
+        if word_stem.startswith(prefix):
+            return value
+    return None
+
+
+def parse_filename(path):
+    """{'category', 'style', 'color', 'age'} read from a file name; None where not found."""
+    name = os.path.splitext(os.path.basename(path))[0].lower().replace('ё', 'е')
+    attrs = {'category': None, 'style': None, 'color': None, 'age': 'adult'}
+    for word in WORD_RE.findall(name):
+        word_stem = stem(word)
+        category, style = _prefixed(word_stem, CATEGORY_STEMS), _prefixed(word_stem, STYLE_STEMS)
+        if category and attrs['category'] is None:
+            attrs['category'] = category
+        elif style and attrs['style'] is None:
+            attrs['style'] = style
+        elif word_stem in COLOR_STEMS and attrs['color'] is None:
+            attrs['color'] = COLOR_STEMS[word_stem]
+        elif word_stem in KID_STEMS:
+            attrs['age'] = 'kid'
+    return attrs
+
+
+def item_attributes(item):
+    return {
+        'category': item.category.name,
+        'style': item.style or None,
+        'color': (item.color or '').lower() or None,
+        'age': item.age_group or None,
+    }
+
+
+class ImageIndex:
+    """Image paths bucketed by every attribute combination in `MATCH_ORDER`."""
+
+    def __init__(self, paths):
+        self.buckets = {combination: {} for combination in MATCH_ORDER}
+        for path in paths:
+            attrs = parse_filename(path)
+            for combination, bucket in self.buckets.items():
+                if all(attrs[name] is not None for name in combination):
+                    bucket.setdefault(tuple(attrs[name] for name in combination), []).append(path)
+
+    def match(self, attrs, choice=random.choice):
+        """A random image among those sharing the most attributes with `attrs`, or None."""
+        for combination, bucket in self.buckets.items():
+            if any(attrs.get(name) is None for name in combination):
+                continue
+            paths = bucket.get(tuple(attrs[name] for name in combination))
+            if paths:
+                return choice(paths)
+        return None
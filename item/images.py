@@ -0,0 +1,116 @@
+"""Resized JPEG and WebP copies of item images for responsive `srcset`s.
+
+For `item_images/sofa.jpg` the copies are written next to it as
+`item_images/derivatives/sofa-320w.jpg`, `sofa-320w.webp`, ... for every
+width in `WIDTHS` below the original's, plus a full-width WebP. What was
+generated is recorded on `Item.image_variants`, so templates can build the
+`srcset` without touching the disk.
+
+Copies are not made in the upload request: saving a new or replaced
+image clears `image_variants`, and `build_image_derivatives --interval`
+picks those items up in the background.
+
+The image work runs on plain file paths and the module does not import
+models at load time, so the backfill command can use it in worker
+processes.
+"""
+import logging
+import os
+import posixpath
+
+from django.dispatch import Signal
+from PIL import ExifTags, Image, ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = (160, 320, 640, 1280)
+
+# directory of the copies, next to the originals; media scans skip it
+DERIVATIVES_DIR = 'derivatives'
+
+JPEG_OPTIONS = {'format': 'JPEG', 'quality': 80, 'optimize': True, 'progressive': True}
+WEBP_OPTIONS = {'format': 'WEBP', 'quality': 75, 'method': 4}
+
+# sent with `item_ids` once the `image_variants` of these items are written,
+# which update() does without a post_save
+variants_saved = Signal()
+
+
+def variant_name(name, width, ext):
+    """Storage name of the `width`-pixel `ext` copy of the image `name`."""
+    stem = posixpath.splitext(name.replace('\\', '/'))[0]
+    directory, base = posixpath.split(stem)
+    return posixpath.join(directory, DERIVATIVES_DIR, f'{base}-{width}w.{ext}')
+
+
+def _save(image, path, options, force):
+    if not force and os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    image.save(path, **options)
+
+
+def generate_derivatives(name, media_root, force=False):
+    """Write the copies of one image and return its variants record, or None.
+
+    The record is what goes into `Item.image_variants`: the image name, its
+    width and the smaller widths that have a JPEG copy. Existing files are
+    kept unless `force` is set; when all of them exist only the image's
+    header is read, for its width.
+    """
+    if name.lower().endswith('.svg'):
+        return None
+
+    def paths(w, width):
+        exts = ('jpg', 'webp') if w < width else ('webp',)
+        return [os.path.join(media_root, variant_name(name, w, ext)) for ext in exts]
+
+    try:
+        with Image.open(os.path.join(media_root, name)) as source:
+            width, height = source.size
+            if source.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+                # exif_transpose below turns it a quarter
+                width = height
+            widths = [w for w in WIDTHS if w < width]
+            missing = [w for w in widths + [width] if force or not all(map(os.path.exists, paths(w, width)))]
+            if missing:
+                image = ImageOps.exif_transpose(source)
+                for w in missing:
+                    resized = image if w == width else image.resize((w, max(1, round(image.height * w / width))), Image.LANCZOS)
+                    if w < width:
+                        _save(resized.convert('RGB'), paths(w, width)[0], JPEG_OPTIONS, force)
+                    webp = resized if resized.mode in ('RGB', 'RGBA') else resized.convert('RGBA')
+                    _save(webp, paths(w, width)[-1], WEBP_OPTIONS, force)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning('Could not make derivatives of %s: %s', name, e)
+        return None
+    return {'name': name, 'width': width, 'widths': widths}
+
+
+def srcsets(image, variants):
+    """(jpeg srcset, webp srcset) for an `ImageFieldFile`, or None if it has no current copies."""
+    # an image that could not be read is recorded with its name only
+    if not variants or variants.get('name') != image.name or not variants.get('width'):
+        return None
+    storage = image.storage
+    width = variants['width']
+    jpeg = [f'{storage.url(variant_name(image.name, w, "jpg"))} {w}w' for w in variants['widths']]
+    jpeg.append(f'{image.url} {width}w')
+    webp = [f'{storage.url(variant_name(image.name, w, "webp"))} {w}w' for w in variants['widths'] + [width]]
+    return ', '.join(jpeg), ', '.join(webp)
+
+
+def thumbnail_url(image, variants):
+    """URL of the smallest copy of an `ImageFieldFile` (the image itself without copies), or ''."""
+    if not image:
+        return ''
+    if variants and variants.get('name') == image.name and variants.get('widths'):
+        return image.storage.url(variant_name(image.name, variants['widths'][0], 'jpg'))
+    return image.url
+
+
+def clear_stale_variants(item):
+    """Drop the `image_variants` of an item whose image changed, before it is saved."""
+    if (item.image_variants or {}).get('name') != (item.image.name if item.image else None):
+        item.image_variants = None
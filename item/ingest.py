@@ -0,0 +1,45 @@
+"""Bulk import of local image files into item image storage.
+
+Used by `seed_items` and `attach_images`: every distinct source file is
+read, hashed and stored once (see item/storage.py) by a pool of threads,
+and the resulting storage names are then assigned to any number of items.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.files import File
+
+from .models import Item
+
+
+# file copying and hashing mostly wait on disk, so threads beyond the core count still help
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+
+def store_image(path):
+    """Store one local image file for `Item.image`; returns its storage name."""
+    field = Item._meta.get_field('image')
+    name = field.generate_filename(None, os.path.basename(path))
+    with open(path, 'rb') as f:
+        return field.storage.save(name, File(f), max_length=field.max_length)
+
+
+def ingest_images(paths, workers=DEFAULT_WORKERS, progress=None):
+    """Store every distinct file of `paths` concurrently.
+
+    Returns ({path: storage name}, {path: error}). `progress(done, total)` is
+    called from the calling thread as files finish.
+    """
+    paths = list(dict.fromkeys(paths))
+    stored, failed = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(store_image, path): path for path in paths}
+        for done, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                stored[path] = future.result()
+            except (OSError, ValueError) as e:
+                failed[path] = e
+            if progress is not None:
+                progress(done, len(paths))
+    return stored, failed
@@ -1,28 +1,20 @@
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from django.core.files import File
+from django.db import transaction
 import os
-import random
 
+from item.filenames import ImageIndex, item_attributes
+from item.images import DERIVATIVES_DIR
+from item.ingest import DEFAULT_WORKERS, ingest_images
 from item.models import Item
 
 
-CATEGORY_KEYWORDS = {
-    'Диваны и кресла': ['диван', 'кресло', 'кресла', 'кресло'],
-    'Ковры и текстиль': ['ковер', 'плед', 'подушка'],
-    'Столы и стулья': ['стол', 'стулья', 'стул'],
-    'Шкафы и стеллажи': ['шкаф', 'стелаж', 'стеллаж'],
-    'Кровати и матрасы': ['кровать', 'матрас'],
-    'Освещение': ['лампа', 'светильник', 'торшер', 'люстра'],
-    'Декор': ['картина', 'ваза', 'полка', 'декор'],
-}
-
-
 class Command(BaseCommand):
-    help = 'Attach images from MEDIA_ROOT to items without images by matching filenames to category keywords.'
+    help = 'Attach images from MEDIA_ROOT to items without images, matching the category, style, color and age in filenames.'
 
     def add_arguments(self, parser):
         parser.add_argument('--dry-run', action='store_true', help='Do not modify files, only report')
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Threads copying image files')
 
     def handle(self, *args, **options):
         media_root = getattr(settings, 'MEDIA_ROOT', None)
@@ -33,6 +25,7 @@ class Command(BaseCommand):
         # collect all image files under media_root
         candidates = []
         for root, dirs, files in os.walk(media_root):
+            dirs[:] = [d for d in dirs if d != DERIVATIVES_DIR]
             for f in files:
                 if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.svg')):
                     candidates.append(os.path.join(root, f))
@@ -40,31 +33,37 @@ class Command(BaseCommand):
         if not candidates:
             self.stdout.write(self.style.WARNING('No image files found under MEDIA_ROOT'))
 
+        # filenames are parsed once; each item is then matched with dictionary lookups
+        index = ImageIndex(candidates)
+
         items = Item.objects.filter(image='') | Item.objects.filter(image__isnull=True)
-        items = items.distinct()
-        attached = 0
+        items = items.distinct().select_related('category')
+        chosen_by_item = {}
         for item in items:
-            # try to find by category keywords
-            chosen = None
-            keywords = CATEGORY_KEYWORDS.get(item.category.name, []) if item.category else []
-            if keywords:
-                lower_candidates = [p for p in candidates if any(kw in os.path.basename(p).lower() for kw in keywords)]
-                if lower_candidates:
-                    chosen = random.choice(lower_candidates)
-
-            if not chosen and candidates:
-                chosen = random.choice(candidates)
-
+            chosen = index.match(item_attributes(item))
             if chosen:
                 self.stdout.write(f'Attaching {os.path.basename(chosen)} to item {item.id} ({item.name})')
-                if not options.get('dry_run'):
-                    try:
-                        with open(chosen, 'rb') as f:
-                            django_f = File(f)
-                            fname = f'bulk_{item.id}_' + os.path.basename(chosen)
-                            item.image.save(fname, django_f, save=True)
-                        attached += 1
-                    except Exception as e:
-                        self.stdout.write(self.style.WARNING(f'Failed to attach {chosen}: {e}'))
+                chosen_by_item[item] = chosen
+
+        if options.get('dry_run') or not chosen_by_item:
+            self.stdout.write(self.style.SUCCESS('Done. Attached images to 0 items.'))
+            return
+
+        # each distinct file is copied once (identical files are stored once) by a pool of threads
+        stored, failed = ingest_images(chosen_by_item.values(), workers=options['workers'], progress=self.progress)
+        for path, error in failed.items():
+            self.stdout.write(self.style.WARNING(f'Failed to attach {path}: {error}'))
+
+        attached = 0
+        with transaction.atomic():
+            for item, chosen in chosen_by_item.items():
+                if chosen in stored:
+                    item.image = stored[chosen]
+                    item.save(update_fields=['image'])
+                    attached += 1
 
         self.stdout.write(self.style.SUCCESS(f'Done. Attached images to {attached} items.'))
+
+    def progress(self, done, total):
+        if done % 100 == 0 or done == total:
+            self.stdout.write(self.style.SUCCESS(f'Stored {done}/{total} image files...'))
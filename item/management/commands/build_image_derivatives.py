@@ -0,0 +1,67 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.dbrouter import pin
+from item.images import generate_derivatives, variants_saved
+from item.models import Item
+
+
+class Command(BaseCommand):
+    help = 'Make the resized JPEG and WebP copies of item images, in parallel across CPU cores.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes (default: CPU count)')
+        parser.add_argument('--force', action='store_true', help='Regenerate copies that already exist')
+        parser.add_argument('--interval', type=float, help='Keep picking up new uploads, this many seconds apart')
+        parser.add_argument('--batch-size', type=int, default=500, help='Items read per query')
+
+    def handle(self, *args, **options):
+        # pending items are read from the primary, not from a lagging replica
+        pin()
+        workers = max(1, options['workers'])
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            while True:
+                done, failed = self.build(pool, options['force'], options['batch_size'])
+                if done or not options['interval']:
+                    self.stdout.write(self.style.SUCCESS(f'Done. Processed {done} images with {workers} workers ({failed} skipped).'))
+                if not options['interval']:
+                    return
+                # a forced rebuild is done once; then only new uploads are picked up
+                options['force'] = False
+                time.sleep(options['interval'])
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def build(self, pool, force, batch_size):
+        items = Item.objects.filter(image__gt='')
+        if not force:
+            # new and replaced images (see item/images.py), through item_pending_variants_idx
+            items = items.filter(image_variants__isnull=True)
+        done = failed = last = 0
+        while True:
+            batch = list(items.filter(pk__gt=last).order_by('pk').values_list('pk', 'image')[:batch_size])
+            if not batch:
+                return done, failed
+            last = batch[-1][0]
+            # several items may share one file; each file is processed once per batch
+            items_by_name = {}
+            for pk, name in batch:
+                items_by_name.setdefault(name, []).append(pk)
+            names = list(items_by_name)
+            args = (names, repeat(settings.MEDIA_ROOT), repeat(force))
+            results = pool.map(generate_derivatives, *args, chunksize=4) if pool else map(generate_derivatives, *args)
+            for name, variants in zip(names, results):
+                # an image that could not be read keeps its name only, so it is not picked up again
+                Item.objects.filter(pk__in=items_by_name[name]).update(image_variants=variants or {'name': name})
+                variants_saved.send(sender=Item, item_ids=items_by_name[name])
+                done += 1
+                failed += variants is None
+                if done % 50 == 0:
+                    self.stdout.write(self.style.SUCCESS(f'Processed {done} images...'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from item.models import Item
+from item.recommendations import compute_related, load_candidates, store_related
+
+
+class Command(BaseCommand):
+    help = 'Precompute the related items shown on item detail pages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--item', type=int, action='append', dest='items', help='Only rebuild these item ids')
+        parser.add_argument('--batch-size', type=int, default=500, help='Lists written per transaction')
+
+    def handle(self, *args, **options):
+        items = Item.objects.select_related('category').order_by('id')
+        if options.get('items'):
+            items = items.filter(id__in=options['items'])
+        batch_size = options['batch_size']
+
+        # candidates (and their tags) are loaded once and shared by every item
+        candidates = load_candidates()
+        lists = {}
+        done = 0
+        for item in items.iterator():
+            lists[item.id] = compute_related(item, candidates)
+            done += 1
+            if len(lists) >= batch_size:
+                store_related(lists)
+                lists = {}
+                self.stdout.write(self.style.SUCCESS(f'Indexed {done} items...'))
+        store_related(lists)
+
+        self.stdout.write(self.style.SUCCESS(f'Done. Indexed related items for {done} items.'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from item.cart import clear_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete the carts nobody has touched for CART_TIMEOUT seconds. Run it daily, like clearsessions.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Deleted {clear_expired()} expired carts')
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.dbrouter import pin
+from item.recommendations import process_related_updates
+
+
+class Command(BaseCommand):
+    help = 'Apply queued item changes to the stored related-item lists. Run one instance at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Keep polling the queue, this many seconds apart')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Queued changes applied per pass')
+
+    def handle(self, *args, **options):
+        # the changed rows are read from the primary, never from a lagging replica
+        pin()
+        while True:
+            done = 0
+            while applied := process_related_updates(options['batch_size']):
+                done += applied
+            if done:
+                self.stdout.write(f'Applied {done} queued changes')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from item.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over item names, descriptions and tags.'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Done. Rebuilt search index ({type(backend).__name__}).'))
@@ -2,13 +2,14 @@ from django.core.management.base import BaseCommand
 from django.db import transaction
 from django.contrib.auth import get_user_model
 from django.conf import settings
-from django.core.files import File
 
 import random
 import os
 import glob
 
+from item.ingest import DEFAULT_WORKERS, ingest_images
 from item.models import Category, Tag, Item
+from item.search import get_backend as get_search_backend
 
 
 COLORS = ['black', 'white', 'blue', 'green', 'red', 'gray', 'beige', 'brown', 'orange', 'yellow']
@@ -40,6 +41,10 @@ ITEM_NAMES = {
 }
 
 
+# items generated, inserted and committed at a time by --bulk
+BULK_CHUNK_SIZE = 5000
+
+
 def random_price(group):
     if group == 'cheap':
         return random.randint(10000, 50000)
@@ -48,13 +53,37 @@ def random_price(group):
     return random.randint(200001, 800000)
 
 
+def random_spec(codes, media_pool, media_by_cat):
+    code = random.choice(codes)
+    name = f"{random.choice(ADJECTIVES)} {random.choice(ITEM_NAMES.get(code, ['Товар']))}"
+    price_group = random.choices(PRICE_GROUPS, weights=(50, 35, 15), k=1)[0]
+    price = random_price(price_group)
+    style = random.choice(STYLES)
+    color = random.choice(COLORS)
+    size = random.choice(list(SIZE_MAP.keys()))
+    age = random.choice(AGE)
+
+    # pick an image: prefer category pool, else global pool
+    chosen_img = None
+    cat_pool = media_by_cat.get(code) if media_by_cat else None
+    if cat_pool:
+        chosen_img = random.choice(cat_pool)
+    if not chosen_img and media_pool:
+        chosen_img = random.choice(media_pool)
+
+    return (code, name, price_group, price, style, color, size, age, chosen_img)
+
+
 class Command(BaseCommand):
     help = 'Seed database with many items, categories and tags for Cozy YU (for dev)'
 
     def add_arguments(self, parser):
         parser.add_argument('--count', type=int, default=300, help='Number of items to create')
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Threads copying image files')
+        parser.add_argument('--bulk', action='store_true', help='Insert items and tags with bulk_create, in chunks (for very large counts)')
+        parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE, help='Items per bulk insert and transaction')
+        parser.add_argument('--no-images', action='store_true', help='Leave items without images')
 
-    @transaction.atomic
     def handle(self, *args, **options):
         count = options.get('count') or 300
         User = get_user_model()
@@ -90,7 +119,7 @@ class Command(BaseCommand):
         # prepare media images pool if exists; also map images by category code folder
         media_pool = []
         media_by_cat = {}
-        media_dir = getattr(settings, 'MEDIA_ROOT', None)
+        media_dir = None if options['no_images'] else getattr(settings, 'MEDIA_ROOT', None)
         if media_dir:
             base_search = os.path.join(media_dir, 'item_images')
             if os.path.isdir(base_search):
@@ -119,56 +148,100 @@ class Command(BaseCommand):
                                     media_by_cat.setdefault(code, []).append(full)
 
         codes = list(category_objs.keys())
-        for i in range(count):
-            code = random.choice(codes)
-            cat = category_objs[code]
-            name = f"{random.choice(ADJECTIVES)} {random.choice(ITEM_NAMES.get(code, ['Товар']))}"
-            price_group = random.choices(PRICE_GROUPS, weights=(50, 35, 15), k=1)[0]
-            price = random_price(price_group)
-            style = random.choice(STYLES)
-            color = random.choice(COLORS)
-            size = random.choice(list(SIZE_MAP.keys()))
-            age = random.choice(AGE)
-
-            item = Item.objects.create(
-                category=cat,
-                name=name,
-                description=f"{style} стиль, цвет {color}, размер {SIZE_MAP[size]}.",
-                price_tg=price,
-                created_by=user,
-                style=style,
-                color=color,
-                size_category=size,
-                age_group=age,
-            )
-
-            # attach an image: prefer category pool, else global pool
-            chosen_img = None
-            cat_pool = media_by_cat.get(code) if media_by_cat else None
-            if cat_pool:
-                if len(cat_pool) > 0:
-                    chosen_img = random.choice(cat_pool)
-            if not chosen_img and media_pool:
-                chosen_img = random.choice(media_pool)
-
-            if chosen_img:
-                try:
-                    with open(chosen_img, 'rb') as f:
-                        django_file = File(f)
-                        fname = f'seed_{i}_' + os.path.basename(chosen_img)
-                        item.image.save(fname, django_file, save=True)
-                except Exception as e:
-                    self.stdout.write(self.style.WARNING(f'Could not attach image {chosen_img}: {e}'))
-
-            # attach tags: color, style, price_group, age
-            item.tags.add(tag_objs[color])
-            item.tags.add(tag_objs[style])
-            item.tags.add(tag_objs[price_group])
-            item.tags.add(tag_objs[age])
-
-            created_items += 1
-
-            if created_items % 50 == 0:
-                self.stdout.write(self.style.SUCCESS(f'Created {created_items} items...'))
+        if options['bulk']:
+            self.seed_bulk(count, options, user, codes, category_objs, tag_objs, media_pool, media_by_cat)
+            return
+
+        specs = [random_spec(codes, media_pool, media_by_cat) for i in range(count)]
+
+        # each distinct image file is stored once (items share it) by a pool of threads
+        images = [spec[-1] for spec in specs if spec[-1]]
+        stored = self.store_images(images, options['workers'])
+
+        with transaction.atomic():
+            for code, name, price_group, price, style, color, size, age, chosen_img in specs:
+                item = Item.objects.create(
+                    category=category_objs[code],
+                    name=name,
+                    description=f"{style} стиль, цвет {color}, размер {SIZE_MAP[size]}.",
+                    price_tg=price,
+                    created_by=user,
+                    style=style,
+                    color=color,
+                    size_category=size,
+                    age_group=age,
+                    image=stored.get(chosen_img, ''),
+                )
+
+                # attach tags: color, style, price_group, age
+                item.tags.add(tag_objs[color])
+                item.tags.add(tag_objs[style])
+                item.tags.add(tag_objs[price_group])
+                item.tags.add(tag_objs[age])
+
+                created_items += 1
+
+                if created_items % 50 == 0:
+                    self.stdout.write(self.style.SUCCESS(f'Created {created_items} items...'))
+
+        self.stdout.write(self.style.SUCCESS(f'Done. Created {created_items} items.'))
+
+    def seed_bulk(self, count, options, user, codes, category_objs, tag_objs, media_pool, media_by_cat):
+        """Insert items and their tag rows chunk by chunk with bulk_create.
+
+        Only one chunk is held in memory and each is its own transaction. Model
+        signals do not fire for bulk inserts, so the search index is updated
+        here and the other derived data is left to its build commands.
+        """
+        # the image pools are small: store every file up front, items then only get names
+        pools = list(media_pool)
+        for pool in media_by_cat.values():
+            pools.extend(pool)
+        stored = self.store_images(pools, options['workers'])
+
+        Through = Item.tags.through
+        search = get_search_backend()
+        chunk_size = max(1, options['chunk_size'])
+        created_items = 0
+        while created_items < count:
+            specs = [random_spec(codes, media_pool, media_by_cat) for i in range(min(chunk_size, count - created_items))]
+            with transaction.atomic():
+                items = Item.objects.bulk_create([
+                    Item(
+                        category_id=category_objs[code].pk,
+                        name=name,
+                        description=f"{style} стиль, цвет {color}, размер {SIZE_MAP[size]}.",
+                        price_tg=price,
+                        created_by_id=user.pk,
+                        style=style,
+                        color=color,
+                        size_category=size,
+                        age_group=age,
+                        image=stored.get(chosen_img, ''),
+                    )
+                    for code, name, price_group, price, style, color, size, age, chosen_img in specs
+                ])
+                Through.objects.bulk_create([
+                    Through(item_id=item.pk, tag_id=tag_objs[key].pk)
+                    for item, (code, name, price_group, price, style, color, size, age, chosen_img) in zip(items, specs)
+                    for key in (color, style, price_group, age)
+                ])
+                search.update([item.pk for item in items])
+            created_items += len(items)
+            self.stdout.write(self.style.SUCCESS(f'Created {created_items}/{count} items...'))
 
         self.stdout.write(self.style.SUCCESS(f'Done. Created {created_items} items.'))
+        self.stdout.write(self.style.NOTICE(
+            'Bulk inserts skip model signals: run build_related_items, build_image_derivatives '
+            'and build_media_manifest to fill in related items, image copies and category cards.'
+        ))
+
+    def store_images(self, paths, workers):
+        stored, failed = ingest_images(paths, workers=workers, progress=self.progress)
+        for path, error in failed.items():
+            self.stdout.write(self.style.WARNING(f'Could not attach image {path}: {error}'))
+        return stored
+
+    def progress(self, done, total):
+        if done % 100 == 0 or done == total:
+            self.stdout.write(self.style.SUCCESS(f'Stored {done}/{total} image files...'))
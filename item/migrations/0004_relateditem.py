@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0003_tag_alter_item_options_remove_item_price_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_items', to='item.item')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_to', to='item.item')),
+            ],
+            options={
+                'ordering': ('item', 'rank'),
+                'constraints': [models.UniqueConstraint(fields=('item', 'rank'), name='item_relateditem_item_rank')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0005_item_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='item',
+            options={'ordering': ('-created_at', '-id')},
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_sold', False)), fields=['-created_at', '-id'], name='item_listing_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0006_item_listing_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='image_variants',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:40
+
+import item.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0007_item_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=item.storage.ContentHashStorage(), upload_to='item_images'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0008_item_image_storage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['category', '-created_at', '-id'], name='item_category_recent_idx'),
+        ),
+    ]
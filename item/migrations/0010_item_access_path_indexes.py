@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0009_item_category_recent_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_sold', False)), fields=['category', '-created_at', '-id'], name='item_unsold_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_sold', False)), fields=['style', '-created_at', '-id'], name='item_unsold_style_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_sold', False)), fields=['price_tg'], name='item_unsold_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['created_by', '-created_at', '-id'], name='item_seller_recent_idx'),
+        ),
+    ]
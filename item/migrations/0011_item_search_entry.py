@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0010_item_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('item', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='item.item')),
+                ('document', models.TextField(db_column='item_search')),
+            ],
+            options={
+                'db_table': 'item_search',
+                'managed': False,
+            },
+        ),
+    ]
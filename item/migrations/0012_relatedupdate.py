@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0011_item_search_entry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedUpdate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_id', models.BigIntegerField()),
+                ('list_only', models.BooleanField(default=False)),
+            ],
+        ),
+    ]
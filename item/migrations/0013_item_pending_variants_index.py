@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0012_relatedupdate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('image__gt', ''), ('image_variants__isnull', True)), fields=['id'], name='item_pending_variants_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0013_item_pending_variants_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredCart',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('lines', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['updated_at'], name='stored_cart_updated_idx')],
+            },
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.auth.models import User
 from django.db import models
 
+from .storage import ContentHashStorage
+
 
 class Category(models.Model):
     name = models.CharField(max_length=255)
@@ -49,7 +51,10 @@ class Item(models.Model):
     description = models.TextField(blank=True, null=True)
     # price in Tenge
     price_tg = models.FloatField(verbose_name='Price (KZT)', default=0.0)
-    image = models.ImageField(upload_to='item_images', blank=True, null=True)
+    # stored once per distinct content, see item/storage.py
+    image = models.ImageField(upload_to='item_images', storage=ContentHashStorage(), blank=True, null=True)
+    # resized copies of `image` (see item/images.py)
+    image_variants = models.JSONField(blank=True, null=True, editable=False)
     is_sold = models.BooleanField(default=False)
     created_by = models.ForeignKey(User, related_name='items', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -62,7 +67,97 @@ class Item(models.Model):
     age_group = models.CharField(max_length=10, choices=AGE_CHOICES, blank=True, null=True)
 
     class Meta:
-        ordering = ('-created_at',)
+        ordering = ('-created_at', '-id')
+        indexes = [
+            # catalog listing and its keyset pagination (item/pagination.py);
+            # partial, since Django filters `is_sold=False` as `NOT is_sold`
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_sold=False), name='item_listing_idx'),
+            # newest items of a category, for the landing page matches (item/recommendations.py)
+            models.Index(fields=['category', '-created_at', '-id'], name='item_category_recent_idx'),
+            # the listing narrowed to a category or a style (facets, home page recommendations)
+            models.Index(fields=['category', '-created_at', '-id'], condition=models.Q(is_sold=False), name='item_unsold_category_idx'),
+            models.Index(fields=['style', '-created_at', '-id'], condition=models.Q(is_sold=False), name='item_unsold_style_idx'),
+            # price bands of the listing
+            models.Index(fields=['price_tg'], condition=models.Q(is_sold=False), name='item_unsold_price_idx'),
+            # a seller's items on the dashboard, newest first
+            models.Index(fields=['created_by', '-created_at', '-id'], name='item_seller_recent_idx'),
+            # images still waiting for their resized copies (item/images.py)
+            models.Index(
+                fields=['id'], condition=models.Q(image_variants__isnull=True, image__gt=''), name='item_pending_variants_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class RelatedItem(models.Model):
+    """Precomputed recommendation: `related` is the `rank`-th best match for `item`."""
+    item = models.ForeignKey(Item, related_name='related_items', on_delete=models.CASCADE)
+    related = models.ForeignKey(Item, related_name='related_to', on_delete=models.CASCADE)
+    score = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ('item', 'rank')
+        constraints = [
+            models.UniqueConstraint(fields=('item', 'rank'), name='item_relateditem_item_rank'),
+        ]
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return f'{self.item_id} -> {self.related_id} ({self.score})'
+
+
+class RelatedUpdate(models.Model):
+    """A change waiting for `process_related_updates`: an item to rescore, or a list to refill.
+
+    `item_id` is not a foreign key, so a deleted item stays queued.
+    """
+    item_id = models.BigIntegerField()
+    list_only = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'{self.item_id} ({"list" if self.list_only else "item"})'
+
+
+class StoredCart(models.Model):
+    """A visitor's cart lines, {item id: quantity}, under the id in their `cart` cookie (see item/cart.py)."""
+    id = models.CharField(primary_key=True, max_length=32)
+    lines = models.JSONField(default=dict)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # expired carts (clear_expired_carts)
+            models.Index(fields=['updated_at'], name='stored_cart_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.id} ({len(self.lines)} lines)'
+
+
+class Match(models.Lookup):
+    """`field__match=expression`: an FTS5 full-text match."""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class SearchEntry(models.Model):
+    """A row of the SQLite `item_search` FTS5 table (migration 0005), joined by item/search.py."""
+    item = models.OneToOneField(
+        Item, primary_key=True, db_column='rowid', db_constraint=False,
+        related_name='search_entry', on_delete=models.DO_NOTHING,
+    )
+    # FTS5's hidden column named after the table: matching it searches every column
+    document = models.TextField(db_column='item_search')
+
+    class Meta:
+        managed = False
+        db_table = 'item_search'
+
+
+SearchEntry._meta.get_field('document').register_lookup(Match)
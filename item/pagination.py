@@ -0,0 +1,78 @@
+"""Keyset (cursor) pagination for the catalog listing.
+
+Pages are cut with a WHERE on the last row shown instead of OFFSET, so
+page 50 costs the same as page 1: the listing is walked newest first on
+(created_at, id), matching `Item.Meta.ordering` and the listing index.
+Ranked search results are walked on (search_rank, id) the same way.
+
+Cursors are opaque url-safe base64 strings; a broken or stale cursor
+simply starts from the first page.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+
+ITEMS_PER_PAGE = 24
+
+
+def _encode(value):
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def _decode(cursor):
+    try:
+        return base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def encode_cursor(item):
+    """Cursor pointing just past `item`."""
+    rank = getattr(item, 'search_rank', None)
+    if rank is not None:
+        # repr keeps every digit, so the cursor compares equal to the recomputed rank
+        return _encode(f'r|{rank!r}|{item.pk}')
+    return _encode(f'k|{item.created_at.isoformat()}|{item.pk}')
+
+
+def decode_cursor(cursor):
+    """('rank', (search_rank, id)) or ('key', (created_at, id)); None if unreadable."""
+    parts = (_decode(cursor or '') or '').split('|')
+    try:
+        if parts[0] == 'r' and len(parts) == 3:
+            return 'rank', (float(parts[1]), int(parts[2]))
+        if parts[0] == 'k' and len(parts) == 3:
+            return 'key', (datetime.fromisoformat(parts[1]), int(parts[2]))
+    except ValueError:
+        pass
+    return None
+
+
+def paginate(queryset, cursor=None, per_page=ITEMS_PER_PAGE):
+    """One page of `queryset` after `cursor` and the cursor of the next page (or None)."""
+    ranked = 'search_rank' in queryset.query.annotations
+    if not ranked:
+        queryset = queryset.order_by('-created_at', '-id')
+
+    position = decode_cursor(cursor)
+    if position is not None:
+        kind, value = position
+        if kind == 'rank' and ranked:
+            rank, pk = value
+            queryset = queryset.filter(Q(search_rank__gt=rank) | Q(search_rank=rank, id__gt=pk))
+        elif kind == 'key' and not ranked:
+            created_at, pk = value
+            # the redundant `created_at <=` lets the database seek the index to the cursor
+            queryset = queryset.filter(
+                Q(created_at__lte=created_at), Q(created_at__lt=created_at) | Q(id__lt=pk),
+            )
+
+    # one extra row tells whether there is a next page without a COUNT
+    items = list(queryset[:per_page + 1])
+    if len(items) <= per_page:
+        return items, None
+    items = items[:per_page]
+    return items, encode_cursor(items[-1])
@@ -0,0 +1,311 @@
+import threading
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Item, RelatedItem, RelatedUpdate
+
+
+# number of related items shown on the detail page
+RELATED_ITEMS_LIMIT = 6
+
+# mapping of category code/name to complementary categories (by name)
+COMPLEMENTARY = {
+    'Диваны и кресла': ['Столы и стулья', 'Ковры и текстиль', 'Декор'],
+    'Ковры и текстиль': ['Диваны и кресла', 'Кровати и матрасы', 'Декор'],
+    'Столы и стулья': ['Диваны и кресла', 'Освещение', 'Декор'],
+    'Шкафы и стеллажи': ['Декор', 'Освещение'],
+    'Кровати и матрасы': ['Ковры и текстиль', 'Декор'],
+    'Освещение': ['Столы и стулья', 'Декор'],
+    'Декор': ['Диваны и кресла', 'Столы и стулья', 'Кровати и матрасы'],
+}
+
+# color complementarity
+NEUTRALS = {'black', 'white', 'gray', 'beige', 'brown'}
+COMPLEMENTS = {
+    'blue': ['orange', 'beige'],
+    'orange': ['blue', 'beige'],
+    'red': ['green', 'beige'],
+    'green': ['red', 'beige'],
+    'yellow': ['blue', 'beige'],
+    'beige': ['blue', 'orange', 'brown'],
+}
+
+# size compatibility: same size preferred, adjacent size OK
+SIZE_PREF = {
+    ('S', 'S'): 8,
+    ('M', 'M'): 8,
+    ('L', 'L'): 8,
+    ('S', 'M'): 4,
+    ('M', 'S'): 4,
+    ('M', 'L'): 4,
+    ('L', 'M'): 4,
+}
+
+
+def color_compat_score(a, b):
+    if not a or not b:
+        return 0
+    a = a.lower(); b = b.lower()
+    if a == b:
+        return 10
+    if a in NEUTRALS or b in NEUTRALS:
+        return 6
+    if b in COMPLEMENTS.get(a, []):
+        return 7
+    return 0
+
+
+def score_pair(item, item_tags, cand, cand_tags):
+    """Score how well `cand` complements `item`.
+
+    Both items need `category` loaded; tags are passed in as sets of tag names
+    so callers can prefetch them instead of querying per candidate.
+    """
+    score = 0
+    comp = COMPLEMENTARY.get(item.category.name, [])
+
+    # complementary category bonus
+    if cand.category.name in comp:
+        score += 40
+
+    # style match
+    if item.style and cand.style == item.style:
+        score += 20
+
+    # shared tags
+    score += len(item_tags & cand_tags) * 8
+
+    # color compatibility
+    score += color_compat_score((item.color or '').lower(), cand.color)
+
+    # size compatibility
+    if item.size_category and cand.size_category:
+        score += SIZE_PREF.get((item.size_category, cand.size_category), 0)
+
+    # price proximity
+    base_price = item.price_tg or 0
+    if cand.price_tg and base_price > 0:
+        diff = abs(cand.price_tg - base_price)
+        if diff < max(1, base_price * 0.1):
+            score += 8
+        elif diff < max(1, base_price * 0.25):
+            score += 4
+
+    # minor boost if different category (but not complementary)
+    if cand.category_id != item.category_id and cand.category.name not in comp:
+        score += 5
+
+    return score
+
+
+def attach_category_matches(items, limit=3):
+    """Set `item.matches` to the newest `limit` other items of the same category.
+
+    One query for all `items`: the ids of each category's newest few rows
+    come from a LIMITed subquery on the category index, so no category is
+    read or ranked whole. (SQLite allows no LIMIT inside a UNION.)
+    """
+    items = list(items)
+    featured = {}
+    for item in items:
+        featured[item.category_id] = featured.get(item.category_id, 0) + 1
+    if not items:
+        return items
+
+    # each category needs `limit` rows beyond the featured items it may have to skip
+    newest = Q()
+    for category_id, count in featured.items():
+        newest |= Q(pk__in=Item.objects.filter(category_id=category_id).order_by('-created_at', '-id').values('pk')[:limit + count])
+    by_category = {}
+    for match in Item.objects.filter(newest).order_by('-created_at', '-id'):
+        by_category.setdefault(match.category_id, []).append(match)
+    for item in items:
+        item.matches = [match for match in by_category.get(item.category_id, []) if match.id != item.id][:limit]
+    return items
+
+
+def load_candidates():
+    """Everything needed to score candidates, loaded once and reused across items.
+
+    With NumPy installed this is a `CatalogEngine`; otherwise a list of
+    (unsold item, tag names) pairs, newest first (ties broken by id).
+    """
+    from .engine import CatalogEngine, np
+
+    if np is not None:
+        return CatalogEngine.load()
+
+    candidates = list(
+        Item.objects.filter(is_sold=False)
+        .select_related('category')
+        .order_by('-created_at', '-id')
+    )
+    tags = {}
+    through = Item.tags.through.objects.filter(item__is_sold=False).values_list('item_id', 'tag__name')
+    for item_id, tag_name in through:
+        tags.setdefault(item_id, set()).add(tag_name)
+    return [(cand, tags.get(cand.id, set())) for cand in candidates]
+
+
+def compute_related(item, candidates, limit=RELATED_ITEMS_LIMIT):
+    """Return the top `limit` (score, item id) pairs for `item`.
+
+    `candidates` is the output of `load_candidates()`. Among equal scores the
+    newest item comes first.
+    """
+    if not isinstance(candidates, list):
+        if item.id in candidates.positions:
+            return candidates.top_related_for(item.id, limit)
+        return candidates.top_related(item, item.tags.values_list('id', flat=True), limit)
+
+    item_tags = set(item.tags.values_list('name', flat=True))
+    scored = []
+    for cand, cand_tags in candidates:
+        if cand.id == item.id:
+            continue
+        score = score_pair(item, item_tags, cand, cand_tags)
+        if score > 0:
+            scored.append((score, cand.id))
+
+    # candidates are newest first, so the stable sort keeps recency among equal scores
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return scored[:limit]
+
+
+def store_related(lists, batch_size=500):
+    """Replace stored lists; `lists` maps item id -> [(score, related id), ...]."""
+    item_ids = list(lists)
+    with transaction.atomic():
+        for start in range(0, len(item_ids), batch_size):
+            batch = item_ids[start:start + batch_size]
+            RelatedItem.objects.filter(item_id__in=batch).delete()
+            RelatedItem.objects.bulk_create([
+                RelatedItem(item_id=item_id, related_id=related_id, score=score, rank=rank)
+                for item_id in batch
+                for rank, (score, related_id) in enumerate(lists[item_id])
+            ])
+
+
+def get_related_items(item):
+    """Related items for the detail page, read from the precomputed table.
+
+    Items without a stored list (bulk-seeded ones before `build_related_items`
+    has run) show none: scoring them here would load the whole catalog.
+    """
+    return list(
+        Item.objects.filter(related_to__item=item, is_sold=False)
+        .order_by('related_to__rank')
+    )
+
+
+def update_related(item_ids, list_ids=()):
+    """Rescore only the stored lists affected by changes to `item_ids`.
+
+    Those are each changed item's own list, every list it appeared in (it may
+    have dropped out or moved; `list_ids` carries these for deleted items,
+    whose rows are already gone) and every list it now enters. Entering an
+    untouched list is a merge with the stored rows, not a rescore.
+    """
+    from .engine import get_engine
+
+    item_ids = set(item_ids)
+    items = list(Item.objects.filter(pk__in=item_ids).select_related('category'))
+    rescore = set(list_ids) | {item.id for item in items}
+    rescore |= set(RelatedItem.objects.filter(related_id__in=item_ids).values_list('item_id', flat=True))
+    rescore = set(Item.objects.filter(pk__in=rescore).values_list('pk', flat=True))
+
+    engine = get_engine()
+    if engine is None:
+        # without NumPy only lists that contained the item are refreshed;
+        # lists it would newly enter catch up on the next build_related_items
+        candidates = load_candidates()
+        store_related({
+            item.id: compute_related(item, candidates)
+            for item in Item.objects.filter(pk__in=rescore).select_related('category')
+        })
+        return
+
+    item_tags = {}
+    for item_id, tag_id in Item.tags.through.objects.filter(item_id__in=item_ids).values_list('item_id', 'tag_id'):
+        item_tags.setdefault(item_id, []).append(tag_id)
+
+    with engine.lock:
+        for item in items:
+            engine.upsert(item, item_tags.get(item.id, ()))
+        for pk in item_ids - {item.id for item in items}:
+            engine.remove(pk)
+
+        lists = {pk: engine.top_related_for(pk, RELATED_ITEMS_LIMIT) for pk in rescore if pk in engine.positions}
+
+        entering = {}
+        for item in items:
+            for list_id, score in engine.entering(item.id):
+                if list_id not in rescore:
+                    entering.setdefault(list_id, []).append((score, item.id))
+
+        stored = {}
+        for list_id, score, related_id in (
+            RelatedItem.objects.filter(item_id__in=list(entering)).values_list('item_id', 'score', 'related_id')
+        ):
+            stored.setdefault(list_id, []).append((score, related_id))
+        for list_id, entries in entering.items():
+            merged = dict((related_id, score) for score, related_id in stored.get(list_id, []) + entries)
+            lists[list_id] = sorted(
+                ((score, related_id) for related_id, score in merged.items()),
+                key=lambda x: (x[0], engine.positions.get(x[1], -1)),
+                reverse=True,
+            )[:RELATED_ITEMS_LIMIT]
+
+        store_related(lists)
+        for list_id, scored in lists.items():
+            engine.stored(list_id, scored, RELATED_ITEMS_LIMIT)
+
+
+_pending = threading.local()
+
+
+def _pending_sets():
+    if not hasattr(_pending, 'items'):
+        _pending.items, _pending.lists = set(), set()
+    return _pending
+
+
+def schedule_related_update(item_ids, list_ids=()):
+    """Queue these items for `process_related_updates` once the current transaction commits.
+
+    Changes within one transaction (an item save followed by tag edits, or a
+    whole seeding run) are coalesced into a single insert.
+    """
+    pending = _pending_sets()
+    pending.items.update(item_ids)
+    pending.lists.update(list_ids)
+    transaction.on_commit(_flush_related_updates)
+
+
+def _flush_related_updates():
+    pending = _pending_sets()
+    item_ids, list_ids = pending.items, pending.lists - pending.items
+    pending.items, pending.lists = set(), set()
+    RelatedUpdate.objects.bulk_create(
+        [RelatedUpdate(item_id=pk) for pk in item_ids] + [RelatedUpdate(item_id=pk, list_only=True) for pk in list_ids]
+    )
+
+
+def process_related_updates(batch_size=1000):
+    """Apply up to `batch_size` queued changes to the stored lists; returns how many were applied.
+
+    Run by the `process_related_updates` command, one instance at a time: it
+    is the only writer of the lists besides `build_related_items`, so its
+    engine, updated from the queued items' current rows, stays in step with
+    what is stored.
+    """
+    queued = list(RelatedUpdate.objects.order_by('id').values_list('id', 'item_id', 'list_only')[:batch_size])
+    if not queued:
+        return 0
+    update_related(
+        {pk for _, pk, list_only in queued if not list_only},
+        {pk for _, pk, list_only in queued if list_only},
+    )
+    RelatedUpdate.objects.filter(id__lte=queued[-1][0]).delete()
+    return len(queued)
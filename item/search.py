@@ -0,0 +1,119 @@
+"""Catalog full-text search.
+
+The backend is chosen by the `SEARCH_BACKEND` setting (a dotted path). By
+default SQLite databases get a ranked FTS5 index over item name,
+description and tag names; other databases fall back to the old
+`icontains` filters until a native backend is written for them.
+"""
+from django.conf import settings
+from django.db import connection, connections, router
+from django.db.models import F, FloatField, Func, Q, Value
+from django.utils.module_loading import import_string
+
+from .models import Item
+from .stemmer import index_terms, query_terms
+
+
+class DatabaseSearchBackend:
+    """Unindexed substring search; works on every database."""
+
+    def filter(self, queryset, query):
+        return queryset.filter(
+            Q(name__icontains=query) | Q(description__icontains=query) | Q(tags__name__icontains=query)
+        ).distinct()
+
+    def match_ids(self, query, limit):
+        return list(self.filter(Item.objects.all(), query).values_list('pk', flat=True)[:limit])
+
+    def update(self, item_ids):
+        pass
+
+    def remove(self, item_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class SQLiteFTSBackend:
+    """Ranked search through the `item_search` FTS5 table (see migration 0005).
+
+    Each column holds the words of the field plus their Russian stems, and
+    query words are matched as stem prefixes, so "диваны" finds "Диван".
+    Results are ordered by bm25 with the name weighted highest.
+    """
+
+    table = 'item_search'
+    weights = (10.0, 1.0, 4.0)  # name, description, tags
+
+    def match_expression(self, query):
+        return ' '.join(f'"{term}"*' for term in query_terms(query))
+
+    def filter(self, queryset, query):
+        # the FTS table is joined into the queryset's own statement, so its other
+        # filters, ordering and LIMIT apply to every match
+        match = self.match_expression(query)
+        if not match:
+            return queryset.none()
+        rank = Func(F('search_entry__document'), *map(Value, self.weights), function='bm25', output_field=FloatField())
+        return queryset.filter(search_entry__document__match=match).annotate(search_rank=rank).order_by('search_rank', 'id')
+
+    def match_ids(self, query, limit):
+        """Ids of up to `limit` matching items (sold ones too), read from the index alone."""
+        match = self.match_expression(query)
+        if not match:
+            return []
+        with connections[router.db_for_read(Item)].cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s LIMIT %s', [match, limit])
+            return [pk for pk, in cursor.fetchall()]
+
+    def documents(self, item_ids):
+        tags = {}
+        through = Item.tags.through.objects.filter(item_id__in=item_ids).values_list('item_id', 'tag__name')
+        for item_id, tag_name in through:
+            tags.setdefault(item_id, []).append(tag_name)
+        for pk, name, description in Item.objects.filter(pk__in=item_ids).values_list('pk', 'name', 'description'):
+            yield pk, index_terms(name), index_terms(description), index_terms(' '.join(tags.get(pk, [])))
+
+    def update(self, item_ids):
+        item_ids = list(item_ids)
+        self.remove(item_ids)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, name, description, tags) VALUES (%s, %s, %s, %s)',
+                list(self.documents(item_ids)),
+            )
+
+    def remove(self, item_ids):
+        item_ids = list(item_ids)
+        with connection.cursor() as cursor:
+            for start in range(0, len(item_ids), 500):
+                batch = item_ids[start:start + 500]
+                cursor.execute(
+                    f'DELETE FROM {self.table} WHERE rowid IN ({", ".join(["%s"] * len(batch))})', batch,
+                )
+
+    def rebuild(self, batch_size=1000):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+        ids = list(Item.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(ids), batch_size):
+            self.update(ids[start:start + batch_size])
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'SEARCH_BACKEND', None)
+        if path is None:
+            path = 'item.search.SQLiteFTSBackend' if connection.vendor == 'sqlite' else 'item.search.DatabaseSearchBackend'
+        _backend = import_string(path)()
+    return _backend
+
+
+def search_items(queryset, query):
+    """Restrict an `Item` queryset to matches for `query`, best match first when ranked."""
+    return get_backend().filter(queryset, query)
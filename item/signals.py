@@ -0,0 +1,103 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .autocomplete import schedule_autocomplete_update
+from .cart import schedule_reprice
+from .facets import schedule_facet_update
+from .images import clear_stale_variants
+from .models import Category, Item, RelatedItem, Tag
+from .recommendations import schedule_related_update
+from .search import get_backend as get_search_backend
+
+
+@receiver(pre_save, sender=Item)
+def item_saving(sender, instance, raw=False, **kwargs):
+    # a rename or a category change also takes an item away from the old suggestion,
+    # and a new price or a sale changes the carts holding it
+    if not raw and instance.pk:
+        instance._previous = Item.objects.filter(pk=instance.pk).values_list('name', 'category_id', 'price_tg', 'is_sold').first()
+    if not raw:
+        # a new or replaced image waits for build_image_derivatives
+        clear_stale_variants(instance)
+
+
+@receiver(post_save, sender=Item)
+def item_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_related_update([instance.pk])
+        schedule_facet_update([instance.pk])
+        get_search_backend().update([instance.pk])
+        old_name, old_category_id, old_price, old_is_sold = getattr(instance, '_previous', None) or (None, None, None, None)
+        if old_name is not None and (old_price != instance.price_tg or old_is_sold != instance.is_sold):
+            schedule_reprice([instance.pk])
+        schedule_autocomplete_update(
+            [instance.name, old_name],
+            instance.tags.values_list('pk', flat=True),
+            [instance.category_id, old_category_id],
+        )
+
+
+@receiver(pre_delete, sender=Item)
+def item_deleting(sender, instance, **kwargs):
+    # rows pointing at the item cascade away with it; remember whose lists to refill
+    instance._related_lists = list(RelatedItem.objects.filter(related=instance).values_list('item_id', flat=True))
+    instance._tag_ids = list(instance.tags.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Item)
+def item_deleted(sender, instance, **kwargs):
+    schedule_related_update([instance.pk], getattr(instance, '_related_lists', ()))
+    schedule_facet_update([instance.pk])
+    get_search_backend().remove([instance.pk])
+    schedule_autocomplete_update([instance.name], getattr(instance, '_tag_ids', ()), [instance.category_id])
+    schedule_reprice([instance.pk])
+
+
+@receiver(m2m_changed, sender=Item.tags.through)
+def item_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # clear() does not provide pk_set, so collect what is being cleared first
+        if reverse:
+            instance._cleared_item_ids = list(instance.items.values_list('pk', flat=True))
+        else:
+            instance._cleared_tag_ids = list(instance.tags.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        if action != 'post_clear' and not pk_set:
+            return
+        item_ids = [instance.pk]
+        tag_ids = getattr(instance, '_cleared_tag_ids', ()) if action == 'post_clear' else pk_set
+    else:
+        if action == 'post_clear':
+            item_ids = getattr(instance, '_cleared_item_ids', ())
+        else:
+            item_ids = pk_set
+        tag_ids = [instance.pk]
+    schedule_related_update(item_ids)
+    schedule_facet_update(item_ids)
+    get_search_backend().update(item_ids)
+    schedule_autocomplete_update(tag_ids=tag_ids)
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, raw=False, **kwargs):
+    # a renamed tag changes the search text of every item carrying it
+    if not raw and not created:
+        get_search_backend().update(instance.items.values_list('pk', flat=True))
+    if not raw:
+        schedule_autocomplete_update(tag_ids=[instance.pk])
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    schedule_autocomplete_update(tag_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_autocomplete_update(category_ids=[instance.pk])
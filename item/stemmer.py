@@ -0,0 +1,160 @@
+"""Russian stemming for the catalog search index.
+
+An implementation of the Snowball Russian stemmer, so that "Диваны",
+"дивана" and "диван" all index to the same stem. Words in other scripts
+are only lowercased.
+"""
+import re
+from functools import lru_cache
+
+VOWELS = 'аеиоуыэюя'
+
+# (endings, must follow а/я) groups, as in the Snowball algorithm
+PERFECTIVE_GERUND = (
+    (('в', 'вши', 'вшись'), True),
+    (('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'), False),
+)
+ADJECTIVE = (
+    (('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+      'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею'), False),
+)
+PARTICIPLE = (
+    (('ем', 'нн', 'вш', 'ющ', 'щ'), True),
+    (('ивш', 'ывш', 'ующ'), False),
+)
+REFLEXIVE = (
+    (('ся', 'сь'), False),
+)
+VERB = (
+    (('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть',
+      'ешь', 'нно'), True),
+    (('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им',
+      'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть',
+      'ишь', 'ую', 'ю'), False),
+)
+NOUN = (
+    (('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой',
+      'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь',
+      'ию', 'ью', 'ю', 'ия', 'ья', 'я'), False),
+)
+SUPERLATIVE = (
+    (('ейш', 'ейше'), False),
+)
+DERIVATIONAL = (
+    (('ост', 'ость'), False),
+)
+
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+
+def _regions(word):
+    """Start of RV, R1 and R2 as defined by Snowball."""
+    rv = len(word)
+    for i, ch in enumerate(word):
+        if ch in VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in VOWELS and word[i - 1] in VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = next_region(0)
+    return rv, r1, next_region(r1)
+
+
+def _strip(word, start, groups):
+    """`word` without its longest ending from `groups` lying after `start`, or None."""
+    best = None
+    for endings, after_a in groups:
+        for ending in endings:
+            if word.endswith(ending) and len(word) - len(ending) >= start:
+                if best is None or len(ending) > len(best[0]):
+                    best = (ending, after_a)
+    if best is None:
+        return None
+
+    ending, after_a = best
+    cut = len(word) - len(ending)
+    if after_a and not (cut - 1 >= start and word[cut - 1] in 'ая'):
+        return None
+    return word[:cut]
+
+
+# catalog text repeats a small vocabulary, so bulk indexing mostly hits the cache
+@lru_cache(maxsize=65536)
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC_RE.search(word):
+        return word
+    rv, r1, r2 = _regions(word)
+
+    # step 1: gerund, else reflexive followed by adjectival, verb or noun
+    stripped = _strip(word, rv, PERFECTIVE_GERUND)
+    if stripped is None:
+        reflexive = _strip(word, rv, REFLEXIVE)
+        if reflexive is not None:
+            word = reflexive
+        stripped = _strip(word, rv, ADJECTIVE)
+        if stripped is not None:
+            participle = _strip(stripped, rv, PARTICIPLE)
+            if participle is not None:
+                stripped = participle
+        else:
+            stripped = _strip(word, rv, VERB)
+            if stripped is None:
+                stripped = _strip(word, rv, NOUN)
+    if stripped is not None:
+        word = stripped
+
+    # step 2
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # step 3: derivational endings must lie in R2
+    stripped = _strip(word, r2, DERIVATIONAL)
+    if stripped is not None:
+        word = stripped
+
+    # step 4: undouble н, drop a superlative or a soft sign
+    stripped = _strip(word, rv, SUPERLATIVE)
+    if stripped is not None:
+        word = stripped
+    if word.endswith('нн') and len(word) - 2 >= rv:
+        word = word[:-1]
+    elif stripped is None and word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    return WORD_RE.findall((text or '').lower().replace('ё', 'е'))
+
+
+def index_terms(text):
+    """Words of `text` plus their stems, for the search index.
+
+    Snowball does not always give inflections of one word a common stem
+    ("кровать" -> "крова", "кровати" -> "кроват"); indexing the words as
+    well lets a prefix query on either stem still find the other form.
+    """
+    terms = []
+    seen = set()
+    for word in tokenize(text):
+        for term in (word, stem(word)):
+            if term not in seen:
+                seen.add(term)
+                terms.append(term)
+    return ' '.join(terms)
+
+
+def query_terms(text):
+    """Stems of the words in a search query; short stems keep the full word."""
+    terms = []
+    for word in tokenize(text):
+        stemmed = stem(word)
+        terms.append(stemmed if len(stemmed) >= 3 else word)
+    return terms
@@ -0,0 +1,64 @@
+"""Content-addressed storage for item images.
+
+A file is stored under a directory named after the SHA-256 of its bytes,
+`item_images/3f/9a0c.../sofa.jpg`, keeping its original file name (the
+media manifest and filename parsers read tokens from it). Saving bytes that
+are already stored returns the existing name instead of writing a copy, so
+seeding thousands of items from a handful of photos stores each photo once.
+Files are never deleted with an item, so sharing them is safe.
+"""
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+# hex digits of the digest used for the directory names (128 bits)
+DIGEST_LENGTH = 32
+
+
+def file_digest(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()[:DIGEST_LENGTH]
+
+
+@deconstructible
+class ContentHashStorage(FileSystemStorage):
+
+    def hashed_name(self, name, digest, max_length=None):
+        directory, filename = posixpath.split(name.replace('\\', '/'))
+        directory = posixpath.join(directory, digest[:2], digest[2:])
+        if max_length is not None:
+            # keep the extension, shorten the stem to fit the field
+            stem, ext = posixpath.splitext(filename)
+            room = max_length - len(directory) - 1 - len(ext)
+            filename = stem[:max(room, 1)] + ext
+        return posixpath.join(directory, filename)
+
+    def existing_name(self, directory):
+        """Name of the file already stored in a digest directory, if any."""
+        try:
+            files = sorted(os.listdir(self.path(directory)))
+        except FileNotFoundError:
+            return None
+        for filename in files:
+            if os.path.isfile(self.path(posixpath.join(directory, filename))):
+                return posixpath.join(directory, filename)
+        return None
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, file_digest(content), max_length)
+        existing = self.existing_name(posixpath.dirname(name))
+        if existing is not None:
+            return existing
+        return super().save(name, content, max_length)
@@ -0,0 +1,38 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from item.images import srcsets
+
+register = template.Library()
+
+
+@register.filter
+def spaced(value):
+    """Group thousands with spaces: 1204 -> "1 204"."""
+    try:
+        return f'{int(value):,}'.replace(',', ' ')
+    except (TypeError, ValueError):
+        return value
+
+
+@register.simple_tag
+def responsive_image(item, sizes='100vw', **attrs):
+    """<img> of an item's image with WebP and resized JPEG `srcset`s when available.
+
+    Extra keyword arguments become attributes of the <img>, e.g.
+    {% responsive_image item sizes="80px" class="w-20 rounded-xl" %}.
+    Renders nothing for an item without an image.
+    """
+    if not item.image:
+        return ''
+    attrs.setdefault('alt', item.name)
+    extra = format_html_join('', ' {}="{}"', attrs.items())
+    sets = srcsets(item.image, item.image_variants)
+    if sets is None:
+        return format_html('<img src="{}"{}>', item.image.url, extra)
+    jpeg, webp = sets
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" loading="lazy"{}></picture>',
+        webp, sizes, item.image.url, jpeg, sizes, extra,
+    )
@@ -1,3 +1,562 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.templatetags.static import static
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from core.pagecache import invalidate
+from core.tests import QueryPlanTestCase, ViewBudgetTestCase, grow_catalog
+
+from . import autocomplete, engine, facets, images
+from .autocomplete import PrefixIndex
+from .cart import CART_COOKIE, clear_expired
+from .engine import CatalogEngine
+from .facets import FacetIndex, filter_items
+from .filenames import ImageIndex, parse_filename
+from .images import generate_derivatives, variant_name
+from .models import Category, Item, RelatedItem, RelatedUpdate, StoredCart, Tag
+from .pagination import decode_cursor, encode_cursor, paginate
+from .recommendations import (
+    attach_category_matches, compute_related, load_candidates, process_related_updates, score_pair, store_related,
+)
+from .search import search_items
+from .stemmer import index_terms, query_terms, stem
+
+
+class ItemBudgetTests(ViewBudgetTestCase):
+
+    def test_items(self):
+        for size in self.catalog_sizes():
+            with self.subTest(items=size):
+                self.assertGetBudget(reverse('item:items'), queries=5, ms=150)
+                self.assertGetBudget(reverse('item:items'), {'style': 'modern', 'price': 'cheap'}, queries=3, ms=150)
+                self.assertGetBudget(reverse('item:items_page'), queries=2, ms=100)
+
+    def test_search(self):
+        for size in self.catalog_sizes():
+            with self.subTest(items=size):
+                self.assertGetBudget(reverse('item:items'), {'query': 'диван'}, queries=5, ms=250)
+                self.assertGetBudget(reverse('item:autocomplete'), {'q': 'ди'}, queries=0, ms=20)
+
+    def test_detail(self):
+        for size in self.catalog_sizes():
+            item = Item.objects.filter(is_sold=False).select_related('category').first()
+            store_related({item.pk: compute_related(item, load_candidates())})
+            with self.subTest(items=size):
+                self.assertGetBudget(reverse('item:detail', args=[item.pk]), queries=3, ms=100)
+
+    def test_cart(self):
+        for size in self.catalog_sizes():
+            pks = list(Item.objects.values_list('pk', flat=True)[:20])
+            for pk in pks:
+                self.client.get(reverse('item:cart_add', args=[pk]))
+            lines = json.dumps({'lines': [{'item': pk, 'qty': 2} for pk in pks]})
+            # reading a cart is one query by id, saving it one upsert; the priced
+            # snapshot comes from the carts cache, or pricing is one query
+            with self.subTest(items=size):
+                self.assertGetBudget(reverse('item:cart'), queries=2, ms=100)
+                # the item, the cart, saving it
+                self.assertGetBudget(reverse('item:cart_add', args=[pk]), queries=3, ms=50)
+                self.assertViewBudget(lambda: self.client.post(reverse('item:cart_update', args=[pk]), {'qty': 2}), queries=2, ms=50)
+                # the items checked, the cart, pricing, saving
+                self.assertViewBudget(
+                    lambda: self.client.post(reverse('item:cart_api'), lines, content_type='application/json'), queries=4, ms=50,
+                )
+
+
+class ItemPageTests(TestCase):
+
+    def test_autocomplete_assets(self):
+        # the search box's data-autocomplete-url is wired up by main.js and styled by suggest.css,
+        # each loaded once by the layout
+        response = self.client.get(reverse('item:items'))
+        self.assertContains(response, f'data-autocomplete-url="{reverse("item:autocomplete")}"')
+        self.assertContains(response, f'src="{static("cozyyu/js/main.js")}"', count=1)
+        self.assertContains(response, f'href="{static("cozyyu/css/suggest.css")}"', count=1)
+
+
+class AutocompleteTests(TestCase):
+
+    def setUp(self):
+        seller = User.objects.create_user('seller')
+        self.tables = Category.objects.create(name='Столы и стулья')
+        self.decor = Category.objects.create(name='Декор')
+        self.add = lambda name, category: Item.objects.create(category=category, name=name, created_by=seller)
+        self.dining = [self.add('Обеденный стол', self.tables), self.add('Обеденный стол', self.tables)]
+        self.add('Стул', self.tables)
+        self.tag = Tag.objects.create(name='столешница')
+        self.add('Ваза', self.decor).tags.add(self.tag)
+
+        # the signals update the process-wide index
+        self.index = autocomplete._index = PrefixIndex.load()
+        self.addCleanup(setattr, autocomplete, '_index', None)
+
+    def test_suggest(self):
+        # every word start is a key; most items first
+        self.assertEqual(self.index.suggest('СТО'), [
+            ('category', self.tables.pk, 'Столы и стулья'),
+            ('item', 'Обеденный стол', 'Обеденный стол'),
+            ('tag', self.tag.pk, 'столешница'),
+        ])
+        self.assertEqual(self.index.suggest('стул'), [('category', self.tables.pk, 'Столы и стулья'), ('item', 'Стул', 'Стул')])
+        self.assertEqual(self.index.suggest('  '), [])
+        self.assertEqual(self.index.suggest('сто', limit=1), [('category', self.tables.pk, 'Столы и стулья')])
+
+    def test_updates_match_a_reload(self):
+        prefixes = ['сто', 'обе', 'жур', 'ва', 'ст', 'де']
+        with self.captureOnCommitCallbacks(execute=True):
+            for item in self.dining:
+                item.is_sold = True
+                item.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add('Стол журнальный', self.decor)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = 'вазон'
+            self.tag.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.decor.name = 'Декор для дома'
+            self.decor.save()
+
+        self.assertNotIn('Обеденный стол', [label for kind, pk, label in self.index.suggest('обе')])
+        self.assertEqual(self.index.suggest('жур'), [('item', 'Стол журнальный', 'Стол журнальный')])
+        fresh = PrefixIndex.load()
+        for prefix in prefixes:
+            with self.subTest(prefix=prefix):
+                self.assertEqual(self.index.suggest(prefix), fresh.suggest(prefix))
+
+
+class RelatedItemsTests(TestCase):
+
+    def setUp(self):
+        grow_catalog(60)
+
+    def test_detail_reads_the_stored_list(self):
+        item, *others = Item.objects.filter(is_sold=False).select_related('category')[:4]
+        url = reverse('item:detail', args=[item.pk])
+        # no list yet (a bulk-seeded item): nothing is scored on the spot
+        with mock.patch('item.engine.CatalogEngine.load') as load:
+            self.assertEqual(self.client.get(url).context['related_items'], [])
+        load.assert_not_called()
+
+        store_related({item.pk: [(30, others[2].pk), (20, others[0].pk), (10, others[1].pk)]})
+        Item.objects.filter(pk=others[1].pk).update(is_sold=True)
+        invalidate('item')
+        self.assertEqual(self.client.get(url).context['related_items'], [others[2], others[0]])
+
+    def stored_lists(self):
+        lists = {}
+        for item_id, score, related_id in RelatedItem.objects.values_list('item_id', 'score', 'related_id'):
+            lists.setdefault(item_id, []).append((score, related_id))
+        return lists
+
+    def test_queued_changes_match_a_rebuild(self):
+        # the worker's engine is loaded from this test's catalog
+        engine._engine = None
+        self.addCleanup(setattr, engine, '_engine', None)
+        call_command('build_related_items', stdout=StringIO())
+        items = list(Item.objects.filter(is_sold=False).select_related('category').order_by('id'))
+        changed = [item.pk for item in items[:6]]
+        listed = Item.objects.get(pk=RelatedItem.objects.exclude(related_id__in=changed).values_list('related_id', flat=True).first())
+        sofa_tag = Tag.objects.create(name='диван-кровать')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            items[0].style, items[0].price_tg = 'loft', items[1].price_tg
+            items[0].save()
+        with self.captureOnCommitCallbacks(execute=True):
+            items[2].tags.add(sofa_tag, *items[3].tags.all())
+        with self.captureOnCommitCallbacks(execute=True):
+            items[4].is_sold = True
+            items[4].save()
+        with self.captureOnCommitCallbacks(execute=True):
+            listed.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            new = Item.objects.create(
+                category=items[5].category, name='Новый диван', style=items[5].style, color=items[5].color,
+                size_category=items[5].size_category, price_tg=items[5].price_tg, created_by=items[5].created_by,
+            )
+            new.tags.add(*items[5].tags.all())
+
+        # saving only queues the change; the worker applies it
+        self.assertFalse(RelatedItem.objects.filter(item=new).exists())
+        queued = RelatedUpdate.objects.count()
+        self.assertEqual(process_related_updates(), queued)
+        self.assertFalse(RelatedUpdate.objects.exists())
+
+        candidates = load_candidates()
+        rebuilt = {item.id: compute_related(item, candidates) for item in Item.objects.select_related('category')}
+        self.assertEqual(self.stored_lists(), {pk: scored for pk, scored in rebuilt.items() if scored})
+
+    def tag_names(self):
+        names = {}
+        for item_id, name in Item.tags.through.objects.values_list('item_id', 'tag__name'):
+            names.setdefault(item_id, set()).add(name)
+        return names
+
+    def test_engine_matches_score_pair(self):
+        catalog = CatalogEngine.load()
+        tags = self.tag_names()
+        candidates = list(Item.objects.select_related('category'))
+        for item in candidates[::10]:
+            expected = {cand.id: score_pair(item, tags.get(item.id, set()), cand, tags.get(cand.id, set())) for cand in candidates}
+            scores = catalog.score(item, item.tags.values_list('id', flat=True))
+            self.assertEqual(dict(zip(catalog.ids.tolist(), scores.tolist())), expected)
+
+        # the same lists as the pure-Python scorer, ties going to the newest item
+        with mock.patch('item.engine.np', None):
+            python_candidates = load_candidates()
+        self.assertIsInstance(python_candidates, list)
+        for item in candidates[::10]:
+            self.assertEqual(compute_related(item, catalog), compute_related(item, python_candidates))
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        seller = User.objects.create_user('seller')
+        self.category = Category.objects.create(name='Диваны и кресла')
+        self.add = lambda name, **fields: Item.objects.create(category=self.category, name=name, created_by=seller, **fields)
+
+    def search(self, query):
+        return [item.name for item in search_items(Item.objects.all(), query)]
+
+    def test_stems(self):
+        self.assertEqual({stem(word) for word in ['Диваны', 'дивана', 'диван']}, {'дива'})
+        self.assertTrue(stem('диваном').startswith(stem('диваны')))
+        self.assertEqual(stem('Ёлочный'), stem('елочный'))
+        self.assertEqual(stem('Sofa'), 'sofa')
+        # the word is indexed beside its stem
+        self.assertEqual(index_terms('Кровати, кровать!'), 'кровати кроват кровать крова')
+        # a stem too short to match on keeps the whole word
+        self.assertEqual(query_terms('Ели диваны'), ['ели', 'дива'])
+
+    def test_inflections_and_ranking(self):
+        self.add('Кресло мягкое', description='Подойдёт к любому дивану')
+        self.add('Диван угловой')
+        tagged = self.add('Пуф')
+        tagged.tags.add(Tag.objects.create(name='диваны'))
+        self.add('Стол обеденный')
+
+        # a name match ranks above a tag match, a tag above the description
+        self.assertEqual(self.search('диваны'), ['Диван угловой', 'Пуф', 'Кресло мягкое'])
+        self.assertEqual(self.search('мягкий угловой'), [])
+        self.assertEqual(self.search('угловые диваны'), ['Диван угловой'])
+        self.assertEqual(self.search('обеден'), ['Стол обеденный'])
+        self.assertEqual(self.search('?!'), [])
+
+    def test_index_follows_changes(self):
+        item = self.add('Диван угловой')
+        tag = Tag.objects.create(name='лофт')
+        item.tags.add(tag)
+        self.assertEqual(self.search('лофт'), ['Диван угловой'])
+
+        tag.name = 'сканди'
+        tag.save()
+        self.assertEqual(self.search('лофт'), [])
+        self.assertEqual(self.search('сканди'), ['Диван угловой'])
+
+        item.name = 'Кушетка'
+        item.save()
+        self.assertEqual(self.search('диван'), [])
+        item.delete()
+        self.assertEqual(self.search('кушетка'), [])
+
+
+class FacetTests(TestCase):
+
+    def setUp(self):
+        grow_catalog(150)
+        facets._index = None
+        self.addCleanup(setattr, facets, '_index', None)
+
+    def assertCountsMatchQueries(self, index, selection, base=Item.objects.all()):
+        counts = index.counts(selection, None if base is None else facets._bitmap(list(base.values_list('pk', flat=True))))
+        unsold = base.filter(is_sold=False)
+        for param, values in counts.items():
+            for value, count in values.items():
+                others = {other: selected for other, selected in selection.items() if other != param}
+                with self.subTest(param=param, value=value):
+                    self.assertEqual(count, filter_items(unsold, {**others, param: [value]}).count())
+
+    def test_counts(self):
+        index = FacetIndex.load()
+        item = Item.objects.filter(is_sold=False).exclude(style=None).first()
+        for selection in [{}, {'style': [item.style]}, {'style': [item.style], 'price': ['medium', 'cheap']}]:
+            self.assertCountsMatchQueries(index, selection)
+        self.assertCountsMatchQueries(index, {'price': ['cheap']}, search_items(Item.objects.all(), item.name))
+
+        # sold and changed items are taken out or moved by an update
+        sold = Item.objects.filter(is_sold=False, style=item.style).exclude(pk=item.pk).first()
+        Item.objects.filter(pk=sold.pk).update(is_sold=True)
+        Item.objects.filter(pk=item.pk).update(style='ethnic' if item.style != 'ethnic' else 'loft', price_tg=250000)
+        index.update([sold.pk, item.pk])
+        self.assertCountsMatchQueries(index, {'style': [item.style]})
+        self.assertCountsMatchQueries(index, {'price': ['expensive']})
+
+    def test_search_narrows_the_counts(self):
+        item = Item.objects.filter(is_sold=False).first()
+        hits = search_items(Item.objects.filter(is_sold=False), item.name)
+        total = lambda response: sum(value['count'] for value in response.context['facets'][0]['values'])
+
+        response = self.client.get(reverse('item:items'), {'query': item.name})
+        self.assertEqual(total(response), hits.count())
+        # with more hits than are listed, the counts cover the whole catalog
+        with self.settings(FACET_BASE_MAX_IDS=hits.count() - 1):
+            invalidate('item')
+            response = self.client.get(reverse('item:items'), {'query': item.name})
+        self.assertEqual(total(response), Item.objects.filter(is_sold=False).count())
+
+
+class PaginationTests(TestCase):
+
+    def walk(self, queryset, per_page):
+        pages, cursor = [], None
+        while True:
+            page, cursor = paginate(queryset, cursor, per_page=per_page)
+            pages.append(page)
+            if cursor is None:
+                return pages
+            # a cursor decodes to the position of the page's last item
+            self.assertEqual(decode_cursor(cursor), decode_cursor(encode_cursor(page[-1])))
+
+    def test_cursor_round_trip_with_ties(self):
+        seller = User.objects.create_user('seller')
+        category = Category.objects.create(name='Диваны')
+        items = [
+            Item.objects.create(category=category, name='Диван угловой', description='Мягкий диван', created_by=seller)
+            for i in range(11)
+        ]
+        # items created within the same instant, and equally relevant to a search
+        Item.objects.filter(pk__in=[item.pk for item in items[2:9]]).update(created_at=items[2].created_at)
+
+        listing = Item.objects.filter(is_sold=False)
+        pages = self.walk(listing, per_page=3)
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 2])
+        newest_first = list(listing.order_by('-created_at', '-id'))
+        self.assertEqual([item for page in pages for item in page], newest_first)
+
+        ranked = search_items(listing, 'диван')
+        pages = self.walk(ranked, per_page=4)
+        self.assertEqual([item for page in pages for item in page], list(ranked))
+        self.assertEqual(sorted(item.pk for page in pages for item in page), [item.pk for item in items])
+
+        # a broken cursor starts over
+        self.assertEqual(paginate(listing, 'not-a-cursor', per_page=3)[0], newest_first[:3])
+
+
+class ImageDerivativeTests(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = self.settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        buffer = BytesIO()
+        Image.new('RGB', (700, 400), 'orange').save(buffer, 'JPEG')
+        self.photo = buffer.getvalue()
+
+    def test_existing_copies(self):
+        name = 'item_images/sofa.jpg'
+        os.makedirs(os.path.join(self.media, 'item_images'))
+        with open(os.path.join(self.media, name), 'wb') as f:
+            f.write(self.photo)
+        variants = generate_derivatives(name, self.media)
+        self.assertEqual(variants, {'name': name, 'width': 700, 'widths': [160, 320, 640]})
+
+        # with every copy on disk the image is not decoded
+        with mock.patch('item.images.ImageOps.exif_transpose', wraps=ImageOps.exif_transpose) as transpose:
+            self.assertEqual(generate_derivatives(name, self.media), variants)
+            transpose.assert_not_called()
+            os.remove(os.path.join(self.media, variant_name(name, 320, 'webp')))
+            self.assertEqual(generate_derivatives(name, self.media), variants)
+            transpose.assert_called_once()
+        self.assertTrue(os.path.exists(os.path.join(self.media, variant_name(name, 320, 'webp'))))
+
+    def test_copies_are_made_off_the_request(self):
+        user = User.objects.create_user('seller', password='pass')
+        category = Category.objects.create(name='Sofas')
+        upload = lambda name, content: Item.objects.create(
+            category=category, created_by=user, name=name, image=SimpleUploadedFile(f'{name}.jpg', content, content_type='image/jpeg'),
+        )
+        with mock.patch('item.images.generate_derivatives', wraps=images.generate_derivatives) as generate:
+            with self.captureOnCommitCallbacks(execute=True):
+                sofa, same_sofa = upload('sofa', self.photo), upload('same-sofa', self.photo)
+                broken = upload('broken', b'not an image')
+            generate.assert_not_called()
+        self.assertEqual(Item.objects.filter(image_variants__isnull=True).count(), 3)
+
+        command = 'item.management.commands.build_image_derivatives.generate_derivatives'
+        with mock.patch(command, wraps=images.generate_derivatives) as generate, self.assertLogs('item.images', 'WARNING'):
+            call_command('build_image_derivatives', workers=1, stdout=StringIO())
+        # the file the two sofas share is made once
+        self.assertEqual(generate.call_count, 2)
+        variants = dict(Item.objects.values_list('pk', 'image_variants'))
+        self.assertEqual(variants[sofa.pk]['widths'], [160, 320, 640])
+        self.assertEqual(variants[same_sofa.pk], variants[sofa.pk])
+        # an unreadable image is not tried again
+        self.assertEqual(variants[broken.pk], {'name': broken.image.name})
+        with mock.patch(command) as generate:
+            call_command('build_image_derivatives', workers=1, stdout=StringIO())
+        generate.assert_not_called()
+
+        # saving an item keeps its copies, a new image waits for new ones
+        sofa.refresh_from_db()
+        sofa.name = 'Sofa bed'
+        sofa.save()
+        sofa.refresh_from_db()
+        self.assertEqual(sofa.image_variants, variants[sofa.pk])
+        sofa.image = SimpleUploadedFile('other.png', self.photo, content_type='image/png')
+        sofa.save()
+        sofa.refresh_from_db()
+        self.assertIsNone(sofa.image_variants)
+
+
+class CategoryMatchesTests(TestCase):
+
+    def test_newest_other_items_of_the_category(self):
+        seller = User.objects.create_user('seller')
+        sofas, lamps = Category.objects.create(name='Диваны'), Category.objects.create(name='Лампы')
+        items = [Item.objects.create(category=sofas if i % 3 else lamps, name=f'Товар {i}', created_by=seller) for i in range(12)]
+        # items created within the same instant are ordered by id
+        Item.objects.filter(pk__in=[item.pk for item in items[4:9]]).update(created_at=items[4].created_at)
+        newest = {
+            category: list(Item.objects.filter(category=category).order_by('-created_at', '-id'))
+            for category in (sofas, lamps)
+        }
+        featured = [newest[sofas][0], newest[sofas][2], newest[lamps][1]]
+        with self.assertNumQueries(1):
+            attach_category_matches(featured, limit=3)
+        for item in featured:
+            expected = [match for match in newest[item.category] if match != item][:3]
+            self.assertEqual(item.matches, expected)
+
+
+class FilenameTests(TestCase):
+
+    def test_inflected_words(self):
+        self.assertEqual(parse_filename('item_images/диваны угловые модерн красные.jpg'), {
+            'category': 'Диваны и кресла', 'style': 'modern', 'color': 'red', 'age': 'adult',
+        })
+        self.assertEqual(parse_filename('столик журнальный классика белая.png'), {
+            'category': 'Столы и стулья', 'style': 'classic', 'color': 'white', 'age': 'adult',
+        })
+        self.assertEqual(parse_filename('детям4 кровать модерновая зелёный.jpg'), {
+            'category': 'Кровати и матрасы', 'style': 'modern', 'color': 'green', 'age': 'kid',
+        })
+        self.assertEqual(parse_filename('Ковры_рустик-серый 3.webp')['category'], 'Ковры и текстиль')
+        self.assertEqual(parse_filename('стеллажи.jpg')['category'], 'Шкафы и стеллажи')
+
+    def test_first_category_word_wins(self):
+        # "настольная" only contains "стол"; the lamp is the furniture word
+        self.assertEqual(parse_filename('настольная лампа.jpg')['category'], 'Освещение')
+        self.assertEqual(parse_filename('кресло и пуф.jpg')['category'], 'Диваны и кресла')
+
+    def test_unknown_words(self):
+        self.assertEqual(parse_filename('IMG_2041.jpg'), {'category': None, 'style': None, 'color': None, 'age': 'adult'})
+
+    def test_index_falls_back_to_fewer_attributes(self):
+        index = ImageIndex(['диван модерн красный.jpg', 'диван классика.jpg', 'лампа.jpg'])
+        first = lambda paths: paths[0]
+        sofa = {'category': 'Диваны и кресла', 'style': 'modern', 'color': 'red', 'age': 'adult'}
+        self.assertEqual(index.match(sofa, choice=first), 'диван модерн красный.jpg')
+        self.assertEqual(index.match(dict(sofa, style='classic', color='blue'), choice=first), 'диван классика.jpg')
+        self.assertEqual(index.match(dict(sofa, category='Освещение', style=None), choice=first), 'лампа.jpg')
+        self.assertEqual(index.match(dict(sofa, category='Декор', color=None), choice=first), 'диван модерн красный.jpg')
+        self.assertIsNone(ImageIndex([]).match(sofa))
+
+
+class CartTests(TestCase):
+
+    def test_price_change_reprices_cached_cart(self):
+        seller = User.objects.create_user('seller')
+        category = Category.objects.create(name='Диваны')
+        sofa = Item.objects.create(category=category, name='Диван', price_tg=100000, created_by=seller)
+        lamp = Item.objects.create(category=category, name='Лампа', price_tg=5000, created_by=seller)
+        lines = json.dumps({'lines': [{'item': sofa.pk, 'qty': 2}, {'item': lamp.pk, 'qty': 1}]})
+        self.assertEqual(self.client.post(reverse('item:cart_api'), lines, content_type='application/json').json()['total'], 205000)
+        # served from the snapshot until an item changes: only the cart is read
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse('item:cart_api')).json()['total'], 205000)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            sofa.price_tg = 90000
+            sofa.save()
+        self.assertEqual(self.client.get(reverse('item:cart_api')).json()['total'], 185000)
+        with self.captureOnCommitCallbacks(execute=True):
+            lamp.is_sold = True
+            lamp.save()
+        self.assertEqual(self.client.get(reverse('item:cart_api')).json()['total'], 180000)
+
+    def test_stored_by_id(self):
+        seller = User.objects.create_user('seller')
+        sofa = Item.objects.create(category=Category.objects.create(name='Диваны'), name='Диван', price_tg=100000, created_by=seller)
+        # one upsert, whether the cart is new (nothing to read yet) or not
+        with self.assertNumQueries(2):
+            self.client.get(reverse('item:cart_add', args=[sofa.pk]))
+        with self.assertNumQueries(3):
+            self.client.get(reverse('item:cart_add', args=[sofa.pk]))
+        stored = StoredCart.objects.get()
+        self.assertEqual(stored.lines, {str(sofa.pk): 2})
+
+        # a cart untouched for CART_TIMEOUT is gone
+        StoredCart.objects.update(updated_at=timezone.now() - timedelta(days=31))
+        self.assertEqual(self.client.get(reverse('item:cart_api')).json()['count'], 0)
+        self.assertEqual(clear_expired(), 1)
+        self.assertFalse(StoredCart.objects.exists())
+
+        self.client.post(reverse('item:cart_update', args=[sofa.pk]), {'qty': 1})
+        self.client.post(reverse('item:cart_update', args=[sofa.pk]), {'qty': 0})
+        self.assertFalse(StoredCart.objects.exists())
+        self.assertEqual(self.client.cookies[CART_COOKIE].value, '')
+
+    def test_session_cart_is_carried_over(self):
+        seller = User.objects.create_user('seller')
+        category = Category.objects.create(name='Диваны')
+        sofa = Item.objects.create(category=category, name='Диван', price_tg=100000, created_by=seller)
+        lamp = Item.objects.create(category=category, name='Лампа', price_tg=5000, created_by=seller)
+        # as the cart views kept it before StoredCart
+        session = self.client.session
+        session['cart'] = {str(sofa.pk): 2, str(lamp.pk): 1}
+        session.save()
+
+        self.assertEqual(self.client.get(reverse('item:cart')).context['total'], 205000)
+        self.assertEqual(StoredCart.objects.get().lines, {str(sofa.pk): 2, str(lamp.pk): 1})
+        self.assertNotIn('cart', self.client.session)
+        self.assertIn(CART_COOKIE, self.client.cookies)
+        self.client.get(reverse('item:cart_add', args=[lamp.pk]))
+        self.assertEqual(self.client.get(reverse('item:cart_api')).json()['total'], 210000)
+
+
+class ItemQueryPlanTests(QueryPlanTestCase):
+
+    def test_listing(self):
+        item = Item.objects.filter(is_sold=False).exclude(style=None).first()
+        unsold = Item.objects.filter(is_sold=False)
+        self.assertUsesIndex(unsold[:25], 'item_listing_idx')
+        self.assertUsesIndex(unsold.filter(category=item.category_id)[:25], 'item_unsold_category_idx')
+        self.assertUsesIndex(unsold.filter(style=item.style)[:25], 'item_unsold_style_idx')
+        self.assertUsesIndex(unsold.filter(price_tg__gt=50000, price_tg__lte=200000)[:25], 'item_unsold_price_idx')
+        for params in [{}, {'category': item.category_id}, {'style': item.style}, {'price': 'medium'}, {'query': 'диван'}]:
+            with self.subTest(**params):
+                self.assertGetNoFullScan(reverse('item:items'), params)
+
+    def test_pending_images(self):
+        pending = Item.objects.filter(image__gt='', image_variants__isnull=True)
+        self.assertUsesIndex(pending.filter(pk__gt=0).order_by('pk').values_list('pk', 'image')[:500], 'item_pending_variants_idx')
 
-# Create your tests here.
+    def test_detail(self):
+        item = Item.objects.filter(is_sold=False).select_related('category').first()
+        # with stored matches, as after build_related_items
+        store_related({item.pk: compute_related(item, load_candidates())})
+        self.assertGetNoFullScan(reverse('item:detail', args=[item.pk]))
@@ -6,6 +6,8 @@ app_name = 'item'
 
 urlpatterns = [
     path('', views.items, name='items'),
+    path('page/', views.items_page, name='items_page'),
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
     path('new/', views.new, name='new'),
     path('<int:pk>/', views.detail, name='detail'),
     path('<int:pk>/delete/', views.delete, name='delete'),
@@ -14,4 +16,5 @@ urlpatterns = [
     path('cart/add/<int:pk>/', views.cart_add, name='cart_add'),
     path('cart/remove/<int:pk>/', views.cart_remove, name='cart_remove'),
     path('cart/update/<int:pk>/', views.cart_update, name='cart_update'),
+    path('cart/api/', views.cart_api, name='cart_api'),
 ]
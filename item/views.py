@@ -1,136 +1,123 @@
+import json
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.db.models import Q
+from django.http import JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.views.decorators.http import require_http_methods
+
+from core.pagecache import cache_anonymous_page
 
+from .autocomplete import get_index as get_autocomplete_index
+from .cart import get_cart
+from .facets import facet_groups, filter_items, selection_from
 from .forms import NewItemForm, EditItemForm
-from .models import Category, Item, Tag
+from .models import Item
+from .pagination import paginate
+from .recommendations import get_related_items
+from .search import get_backend as get_search_backend, search_items
 
 
-# mapping of category code/name to complementary categories (by name)
-COMPLEMENTARY = {
-    'Диваны и кресла': ['Столы и стулья', 'Ковры и текстиль', 'Декор'],
-    'Ковры и текстиль': ['Диваны и кресла', 'Кровати и матрасы', 'Декор'],
-    'Столы и стулья': ['Диваны и кресла', 'Освещение', 'Декор'],
-    'Шкафы и стеллажи': ['Декор', 'Освещение'],
-    'Кровати и матрасы': ['Ковры и текстиль', 'Декор'],
-    'Освещение': ['Столы и стулья', 'Декор'],
-    'Декор': ['Диваны и кресла', 'Столы и стулья', 'Кровати и матрасы'],
-}
+def _category_token(category_name):
+    # match by image filename, item name, or tags
+    return Q(image__icontains=category_name) | Q(name__icontains=category_name) | Q(tags__name__icontains=category_name)
 
-def items(request):
+
+def _listing(request):
+    """Unsold items matching the request's search, category token and facets."""
     query = request.GET.get('query', '')
-    category_id = request.GET.get('category', 0)
     category_name = request.GET.get('category_name')
-    categories = Category.objects.all()
     items = Item.objects.filter(is_sold=False)
 
-    # filter by explicit category id or by category_name token (derived from image filenames or labels)
-    if category_id:
-        items = items.filter(category_id=category_id)
+    # filter by category_name token (derived from image filenames or labels)
     if category_name:
-        # match by image filename, item name, or tags
-        items = items.filter(
-            Q(image__icontains=category_name) | Q(name__icontains=category_name) | Q(tags__name__icontains=category_name)
-        ).distinct()
+        items = items.filter(_category_token(category_name)).distinct()
 
     if query:
-        items = items.filter(Q(name__icontains=query) | Q(description__icontains=query))
+        items = search_items(items, query)
+    return items
+
+
+def _facet_base_ids(query, category_name):
+    """Ids the facet counts are narrowed to, or None to count the whole catalog.
+
+    Text hits come from the search index alone and the category token's
+    LIKE filter stops after `FACET_BASE_MAX_IDS` rows; a part with more hits
+    than that does not narrow the counts.
+    """
+    limit = getattr(settings, 'FACET_BASE_MAX_IDS', 10000)
+    parts = []
+    if query:
+        parts.append(get_search_backend().match_ids(query, limit + 1))
+    if category_name:
+        token = Item.objects.filter(_category_token(category_name), is_sold=False)
+        parts.append(token.values_list('pk', flat=True).distinct()[:limit + 1])
+    parts = [set(ids) for ids in parts if len(ids) <= limit]
+    return set.intersection(*parts) if parts else None
+
+
+def _next_page_query(request, cursor):
+    if cursor is None:
+        return ''
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return params.urlencode()
+
+
+@cache_anonymous_page('item', 'category', 'tag')
+def items(request):
+    query = request.GET.get('query', '')
+    category_name = request.GET.get('category_name')
+    selection = selection_from(request.GET)
+    items = _listing(request)
+
+    # facet counts come from the in-memory index; a text query or category
+    # token narrows them down to the items it matched
+    base_ids = None
+    if query or category_name:
+        base_ids = _facet_base_ids(query, category_name)
+
+    page, cursor = paginate(filter_items(items, selection), request.GET.get('cursor'))
 
     return render(request, 'item/items.html', {
-        'items': items,
+        'items': page,
+        'next_page_query': _next_page_query(request, cursor),
         'query': query,
-        'categories': categories,
-        'category_id': int(category_id)
+        'category_name': category_name or '',
+        'facets': facet_groups(selection, base_ids),
     })
 
+
+@cache_anonymous_page('item', 'category', 'tag')
+def items_page(request):
+    # the next batch of cards for infinite scroll on the items page
+    items = filter_items(_listing(request), selection_from(request.GET))
+    page, cursor = paginate(items, request.GET.get('cursor'))
+
+    return render(request, 'item/items_page.html', {
+        'items': page,
+        'next_page_query': _next_page_query(request, cursor),
+    })
+
+def autocomplete(request):
+    # called on every keystroke: answered from the in-memory index only
+    items_url = reverse('item:items')
+    params = {'item': 'query', 'tag': 'tag', 'category': 'category'}
+    suggestions = [
+        {'label': label, 'kind': kind, 'url': f'{items_url}?{urlencode({params[kind]: pk})}'}
+        for kind, pk, label in get_autocomplete_index().suggest(request.GET.get('q', '')[:100])
+    ]
+    return JsonResponse({'suggestions': suggestions})
+
+@cache_anonymous_page('item', 'category', 'tag')
 def detail(request, pk):
     item = get_object_or_404(Item, pk=pk)
 
-    # Recommendation algorithm: find complementary items rather than just same-category
-    candidates = Item.objects.filter(is_sold=False).exclude(pk=pk).select_related('category')
-
-    # narrow candidates to those that share style or tags or price-group tag or same color
-    base_tags = set([t.name for t in item.tags.all()])
-    base_style = item.style
-    base_color = (item.color or '').lower()
-    base_price = item.price_tg or 0
-
-    # helper: color complementarity
-    NEUTRALS = {'black', 'white', 'gray', 'beige', 'brown'}
-    COMPLEMENTS = {
-        'blue': ['orange', 'beige'],
-        'orange': ['blue', 'beige'],
-        'red': ['green', 'beige'],
-        'green': ['red', 'beige'],
-        'yellow': ['blue', 'beige'],
-        'beige': ['blue', 'orange', 'brown'],
-    }
-
-    def color_compat_score(a, b):
-        if not a or not b:
-            return 0
-        a = a.lower(); b = b.lower()
-        if a == b:
-            return 10
-        if a in NEUTRALS or b in NEUTRALS:
-            return 6
-        if b in COMPLEMENTS.get(a, []):
-            return 7
-        return 0
-
-    # size compatibility: same size preferred, adjacent size OK
-    SIZE_PREF = {
-        ('S', 'S'): 8,
-        ('M', 'M'): 8,
-        ('L', 'L'): 8,
-        ('S', 'M'): 4,
-        ('M', 'S'): 4,
-        ('M', 'L'): 4,
-        ('L', 'M'): 4,
-    }
-
-    scored = []
-    for cand in candidates:
-        score = 0
-        comp = COMPLEMENTARY.get(item.category.name, []) if item.category else []
-
-        # complementary category bonus
-        if item.category and cand.category and cand.category.name in comp:
-            score += 40
-
-        # style match
-        if base_style and cand.style == base_style:
-            score += 20
-
-        # shared tags
-        cand_tags = set([t.name for t in cand.tags.all()])
-        inter = base_tags.intersection(cand_tags)
-        score += len(inter) * 8
-
-        # color compatibility
-        score += color_compat_score(base_color, cand.color)
-
-        # size compatibility
-        if item.size_category and cand.size_category:
-            score += SIZE_PREF.get((item.size_category, cand.size_category), 0)
-
-        # price proximity
-        if cand.price_tg and base_price > 0:
-            diff = abs(cand.price_tg - base_price)
-            if diff < max(1, base_price * 0.1):
-                score += 8
-            elif diff < max(1, base_price * 0.25):
-                score += 4
-
-        # minor boost if different category (but not complementary)
-        if item.category and cand.category and cand.category != item.category and cand.category.name not in comp:
-            score += 5
-
-        if score > 0:
-            scored.append((score, cand))
-
-    scored.sort(key=lambda x: x[0], reverse=True)
-    related_items = [c for s, c in scored[:6]]
+    # complementary items are precomputed by `build_related_items`
+    related_items = get_related_items(item)
 
     return render(request, 'item/detail.html', {
         'item': item,
@@ -139,45 +126,71 @@ def detail(request, pk):
 
 
 def cart_view(request):
-    cart = request.session.get('cart', {})
-    item_ids = list(cart.keys())
-    items = Item.objects.filter(id__in=item_ids)
-    total = 0
-    cart_items = []
-    for it in items:
-        qty = cart.get(str(it.id), 0)
-        subtotal = (it.price_tg or 0) * qty
-        total += subtotal
-        cart_items.append({'item': it, 'qty': qty, 'subtotal': subtotal})
+    cart = get_cart(request)
+    cart_items, total, missing = cart.rows()
+    response = render(request, 'item/cart.html', {'cart_items': cart_items, 'total': total, 'missing': len(missing)})
+    if missing or cart.carried_over:
+        # items deleted since they were added: say so once and drop them
+        for pk in missing:
+            cart.set(pk, 0)
+        cart.save(response)
+    return response
+
 
-    return render(request, 'item/cart.html', {'cart_items': cart_items, 'total': total})
+def _cart_redirect(cart, *args, **kwargs):
+    response = redirect(*args, **kwargs)
+    cart.save(response)
+    return response
 
 
 def cart_add(request, pk):
     # add one item to cart and redirect back
     item = get_object_or_404(Item, pk=pk)
-    cart = request.session.get('cart', {})
-    cart[str(item.id)] = cart.get(str(item.id), 0) + 1
-    request.session['cart'] = cart
-    return redirect('item:detail', pk=pk)
+    cart = get_cart(request)
+    cart.add(item.id)
+    return _cart_redirect(cart, 'item:detail', pk=pk)
 
 
 def cart_remove(request, pk):
-    cart = request.session.get('cart', {})
-    cart.pop(str(pk), None)
-    request.session['cart'] = cart
-    return redirect('item:cart')
+    cart = get_cart(request)
+    cart.set(pk, 0)
+    return _cart_redirect(cart, 'item:cart')
 
 
 def cart_update(request, pk):
-    qty = int(request.POST.get('qty', 1))
-    cart = request.session.get('cart', {})
-    if qty <= 0:
-        cart.pop(str(pk), None)
-    else:
-        cart[str(pk)] = qty
-    request.session['cart'] = cart
-    return redirect('item:cart')
+    cart = get_cart(request)
+    try:
+        cart.set(pk, int(request.POST.get('qty', 1)))
+    except ValueError:
+        pass
+    return _cart_redirect(cart, 'item:cart')
+
+
+@require_http_methods(['GET', 'POST'])
+def cart_api(request):
+    """The cart as JSON; a POST of {"lines": [{"item": id, "qty": n} or {"item": id, "add": n}, ...]} changes it first."""
+    cart = get_cart(request)
+    if request.method == 'POST':
+        try:
+            cart.apply(json.loads(request.body).get('lines', []))
+        except (AttributeError, ValueError) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+    rows, total, missing = cart.rows()
+    for pk in missing:
+        cart.set(pk, 0)
+    response = JsonResponse({
+        'lines': [
+            {'item': row['item'].id, 'qty': row['qty'], 'subtotal': row['subtotal'], 'sold': row['item'].is_sold}
+            for row in rows
+        ],
+        'count': len(rows),
+        'total': total,
+        'missing': [int(pk) for pk in missing],
+    })
+    if request.method == 'POST' or missing or cart.carried_over:
+        cart.save(response)
+    return response
 
 @login_required
 def new(request):
@@ -0,0 +1,59 @@
+"""The production SQLite profile, used by settings.py with DB_PROFILE=production.
+
+The primary runs in WAL mode, so readers are not blocked by a writer and
+cart writes and message posts do not stall page renders. Write
+transactions start as IMMEDIATE, so two writers queue on the busy timeout
+instead of one failing with "database is locked" halfway through.
+Connections are kept open between requests, so the PRAGMAs and the page
+cache are set up once per worker thread and not once per request.
+
+An optional read replica, a copy of the primary refreshed by
+`manage.py sync_replica` (or a tool such as Litestream), takes the
+catalog reads (core/dbrouter.py).
+"""
+
+# seconds a connection waits for a lock before giving up with "database is locked"
+BUSY_TIMEOUT = 5
+
+# seconds a connection is kept open between requests
+CONN_MAX_AGE = 600
+
+PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    # with WAL still consistent after a crash; only the last commits can be lost on power failure
+    'PRAGMA synchronous = NORMAL',
+    # 64 MiB page cache per connection (negative: in KiB)
+    'PRAGMA cache_size = -65536',
+    # read the first 256 MiB of the file through the OS page cache
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+]
+
+
+def sqlite_database(path, replica=False):
+    """DATABASES entry of a production SQLite file; a replica connection is read-only."""
+    pragmas = PRAGMAS[1:] + ['PRAGMA query_only = ON'] if replica else PRAGMAS
+    options = {
+        'init_command': '; '.join(pragmas),
+        'timeout': BUSY_TIMEOUT,
+    }
+    if not replica:
+        options['transaction_mode'] = 'IMMEDIATE'
+    database = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': options,
+    }
+    if replica:
+        # tests use the primary's test database for both
+        database['TEST'] = {'MIRROR': 'default'}
+    return database
+
+
+def production_databases(path, replica_path=None):
+    databases = {'default': sqlite_database(path)}
+    if replica_path:
+        databases['replica'] = sqlite_database(replica_path, replica=True)
+    return databases
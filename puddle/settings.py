@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from .database import production_databases
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -50,6 +53,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.sqlstats.SQLStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,7 +68,8 @@ ROOT_URLCONF = 'puddle.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # the Django backend, timing renders for the metrics (core/metrics.py)
+        'BACKEND': 'core.metrics.TimedDjangoTemplates',
         # include project-level templates directory so templates/cozyyu/index.html is found
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
@@ -73,6 +79,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'item.context_processors.cart',
             ],
         },
     },
@@ -91,6 +98,24 @@ DATABASES = {
     }
 }
 
+# DB_PROFILE=production switches to the tuned SQLite setup of
+# puddle/database.py (WAL, PRAGMAs, persistent connections). With
+# SQLITE_REPLICA_PATH set too, catalog reads go to that copy of the
+# database, refreshed by `manage.py sync_replica`, except for a short while
+# after a visitor's writes
+if os.environ.get('DB_PROFILE') == 'production':
+    DATABASES = production_databases(
+        os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        os.environ.get('SQLITE_REPLICA_PATH'),
+    )
+    if 'replica' in DATABASES:
+        DATABASE_ROUTERS = ['core.dbrouter.ReplicaRouter']
+        MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.security.SecurityMiddleware'), 'core.dbrouter.PrimaryPinMiddleware')
+
+# Seconds a visitor's reads stay on the primary after they wrote something,
+# longer than the replica takes to catch up (core/dbrouter.py)
+REPLICA_PIN_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -138,3 +163,78 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Seconds before the recommendation engine of the process_related_updates
+# worker (item/engine.py) is reloaded to pick up changes made around the queue
+RELATED_ENGINE_MAX_AGE = 300
+
+# Catalog search (item/search.py). SEARCH_BACKEND defaults to SQLite FTS5 on
+# SQLite and to plain icontains filters elsewhere
+# SEARCH_BACKEND = 'item.search.SQLiteFTSBackend'
+
+# Seconds before the in-process facet count index (item/facets.py) is
+# reloaded to pick up catalog changes made by other processes
+FACET_INDEX_MAX_AGE = 60
+
+# Most search or category-token hits the facet counts are narrowed to; with
+# more, the counts cover the whole catalog
+FACET_BASE_MAX_IDS = 10000
+
+# Seconds before the search autocomplete index (item/autocomplete.py) is
+# rebuilt in the background to pick up changes made by other processes
+AUTOCOMPLETE_INDEX_MAX_AGE = 300
+
+# Anonymous catalog pages are cached (core/pagecache.py) and invalidated by
+# model tags. The local-memory cache is per process, so with several worker
+# processes use a shared backend (Redis, Memcached) to make invalidation
+# reach all of them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    # priced cart snapshots and item price versions (item/cart.py), kept
+    # apart so page entries do not push them out; per process like the
+    # default cache, so with several workers use the same shared backend
+    'carts': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'carts',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+# Seconds a cached page is fresh, and how long after that it may still be
+# served stale while one request renders it again
+PAGE_CACHE_TIMEOUT = 60
+PAGE_CACHE_STALE = 300
+
+# Seconds an untouched cart is kept (item/cart.py, clear_expired_carts)
+CART_TIMEOUT = 60 * 60 * 24 * 30
+
+# SQL statistics per request (core/sqlstats.py): a query shape repeated this
+# many times in one request is reported as a likely N+1; views can be given
+# a query budget by URL name, e.g. {'item:detail': 3}, and with
+# SQL_BUDGET_RAISE a request over its budget fails instead of being logged
+SQL_REPEAT_THRESHOLD = 5
+SQL_QUERY_BUDGETS = {}
+SQL_BUDGET_RAISE = False
+
+# Request metrics at /metrics/ (core/metrics.py). With several worker
+# processes point METRICS_DIR at a directory they share (cleared on
+# restart), so that /metrics/ adds up all of them. Only these addresses may
+# read the metrics (any address with DEBUG on)
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 5
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # one JSON line per request; INFO logs every request, WARNING only the suspicious ones
+        'core.sql': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
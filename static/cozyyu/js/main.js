@@ -18,5 +18,45 @@ document.addEventListener('DOMContentLoaded', function(){
         })
     }
 
+    // search-as-you-type suggestions for inputs with data-autocomplete-url
+    document.querySelectorAll('input[data-autocomplete-url]').forEach(function(input){
+        var list = document.createElement('ul')
+        list.className = 'cy-suggest'
+        input.parentNode.style.position = 'relative'
+        input.parentNode.appendChild(list)
+        input.setAttribute('autocomplete', 'off')
+
+        var timer = null
+        var controller = null
+        input.addEventListener('input', function(){
+            clearTimeout(timer)
+            timer = setTimeout(function(){
+                var q = input.value.trim()
+                if(controller){ controller.abort() }
+                if(!q){ list.innerHTML = ''; return }
+                controller = new AbortController()
+                fetch(input.dataset.autocompleteUrl + '?q=' + encodeURIComponent(q), {signal: controller.signal})
+                    .then(function(response){ return response.json() })
+                    .then(function(data){
+                        list.innerHTML = ''
+                        data.suggestions.forEach(function(suggestion){
+                            var li = document.createElement('li')
+                            var a = document.createElement('a')
+                            a.href = suggestion.url
+                            a.textContent = suggestion.label
+                            a.className = 'cy-suggest-' + suggestion.kind
+                            li.appendChild(a)
+                            list.appendChild(li)
+                        })
+                    })
+                    .catch(function(){})
+            }, 100)
+        })
+        input.addEventListener('blur', function(){
+            // let a click on a suggestion land first
+            setTimeout(function(){ list.innerHTML = '' }, 200)
+        })
+    })
+
     // site logo is now a normal link to home (no JS required)
 })